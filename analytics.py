@@ -0,0 +1,352 @@
+"""
+Optional in-process columnar cache of detection_events metadata.
+
+The dashboard's stats, the all_patents total and the filter dropdowns are
+aggregates over a few narrow columns, yet every filter change sends them to
+Postgres. With ANALYTICS_CACHE=true each worker keeps those columns in NumPy
+arrays instead:
+
+  - created_at as int64 microseconds, camera_confidence as float64 (NaN for NULL),
+  - camera_plate_text, vehicle_brand, vehicle_color and vehicle_type
+    dictionary-encoded: an int32 code per row into a list of the raw values
+    seen (-1 for NULL), so filters on canonical values expand to raw codes
+    exactly like the SQL `= ANY(...)` predicates.
+
+db_utils.fetch_stats(), the all_patents count and fetch_filter_options()
+answer from the cache with vectorized masks when it is loaded and the filters
+are ones it can evaluate exactly; anything else (image queries, collapsed
+listings, ILIKE patterns with wildcards) still goes to SQL.
+
+The arrays are loaded once (in the gunicorn master when preload_app is on, so
+workers share them copy-on-write), then extended with the rows after the
+(created_at, id) watermark at most every ANALYTICS_REFRESH_SECONDS, and
+reloaded in the background every ANALYTICS_RELOAD_SECONDS to pick up updated
+or deleted rows. Memory is about 36 bytes per row per worker.
+"""
+import datetime
+import logging
+import os
+import threading
+import time
+import zoneinfo
+
+import psycopg2
+
+import db_utils
+
+# numpy is optional (without it every query goes to SQL) and only imported by
+# start() when ANALYTICS_CACHE is on: loading it is slower than the app itself
+numpy = None
+
+logger = logging.getLogger(__name__)
+
+_truthy = {"true", "1", "yes", "on"}
+ANALYTICS_CACHE = os.environ.get("ANALYTICS_CACHE", "false").lower() in _truthy
+ANALYTICS_REFRESH_SECONDS = float(os.environ.get("ANALYTICS_REFRESH_SECONDS", "5"))
+ANALYTICS_RELOAD_SECONDS = float(os.environ.get("ANALYTICS_RELOAD_SECONDS", "3600"))
+# Rows younger than this are left for the next refresh, so rows committed
+# slightly out of created_at order are not skipped by the watermark
+ANALYTICS_LAG_SECONDS = float(os.environ.get("ANALYTICS_LAG_SECONDS", "2"))
+
+_EPOCH = datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
+_US = datetime.timedelta(microseconds=1)
+_CATEGORICAL = ("plate", "brand", "color", "type")
+_BATCH_ROWS = 50000
+# ILIKE wildcards and escapes: such search terms are left to SQL
+_LIKE_SPECIAL = set("%_\\")
+
+
+def _to_us(ts):
+    return (ts - _EPOCH) // _US
+
+
+def _from_us(us):
+    return _EPOCH + datetime.timedelta(microseconds=int(us))
+
+
+def _session_timezone(cur):
+    """
+    The session's TimeZone, in which Postgres reads zone-less timestamps. Settings
+    that are not IANA names (POSIX strings like <-03>+03) become their current
+    UTC offset.
+    """
+    cur.execute("SHOW TimeZone")
+    name = cur.fetchone()[0]
+    try:
+        return zoneinfo.ZoneInfo(name)
+    except (zoneinfo.ZoneInfoNotFoundError, ValueError):
+        cur.execute("SELECT extract(timezone FROM now())")
+        return datetime.timezone(datetime.timedelta(seconds=int(cur.fetchone()[0])), name)
+
+
+class _Column:
+    """A growable NumPy array. Appends never touch rows[:n], so readers holding an old view are safe."""
+
+    def __init__(self, dtype):
+        self.data = numpy.empty(1024, dtype=dtype)
+
+    def append(self, n, values):
+        needed = n + len(values)
+        if needed > len(self.data):
+            grown = numpy.empty(max(needed, 2 * len(self.data)), dtype=self.data.dtype)
+            grown[:n] = self.data[:n]
+            self.data = grown
+        self.data[n:needed] = values
+
+
+class _Dictionary:
+    """Raw value <-> int32 code for one categorical column; -1 is NULL."""
+
+    def __init__(self):
+        self.values = []
+        self.codes = {}
+
+    def encode(self, value):
+        if value is None:
+            return -1
+        code = self.codes.get(value)
+        if code is None:
+            code = self.codes[value] = len(self.values)
+            self.values.append(value)
+        return code
+
+
+class ColumnarCache:
+    """Metadata columns of detection_events with vectorized stats, counts and distinct values."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._reset()
+        self.loaded_at = None
+        self.refreshed_at = 0.0
+        self.timezone = datetime.timezone.utc
+        self.hits = 0
+
+    def _reset(self):
+        self.n = 0
+        self.watermark = None
+        self.created = _Column(numpy.int64)
+        self.confidence = _Column(numpy.float64)
+        self.columns = {name: _Column(numpy.int32) for name in _CATEGORICAL}
+        self.dictionaries = {name: _Dictionary() for name in _CATEGORICAL}
+
+    @property
+    def ready(self):
+        return self.loaded_at is not None
+
+    # --- loading ---
+
+    def load(self):
+        """Read every row (replacing what is loaded). Raises DBError on failure."""
+        fresh = ColumnarCache.__new__(ColumnarCache)
+        fresh._reset()
+        started = time.monotonic()
+        fresh._pull(since=None)
+        # Wait out an incremental refresh: it would append to the arrays being replaced
+        with self._refresh_lock, self._lock:
+            self.n, self.watermark = fresh.n, fresh.watermark
+            self.created, self.confidence = fresh.created, fresh.confidence
+            self.columns, self.dictionaries = fresh.columns, fresh.dictionaries
+            self.timezone = fresh.timezone
+            self.loaded_at = self.refreshed_at = time.monotonic()
+        logger.info("Analytics cache loaded %d rows in %.2fs", self.n, time.monotonic() - started)
+
+    def refresh(self):
+        """Append rows newer than the watermark; reload in the background when due."""
+        if time.monotonic() - self.refreshed_at < ANALYTICS_REFRESH_SECONDS:
+            return
+        if not self._refresh_lock.acquire(blocking=False):
+            return  # another thread is refreshing: answer from what is loaded
+        try:
+            now = time.monotonic()
+            if now - self.refreshed_at < ANALYTICS_REFRESH_SECONDS:
+                return
+            self.refreshed_at = now
+            if now - self.loaded_at >= ANALYTICS_RELOAD_SECONDS:
+                self.loaded_at = now  # don't start a second reload meanwhile
+                threading.Thread(target=self._reload, daemon=True, name="analytics-reload").start()
+                return
+            self._pull(since=self.watermark)
+        except (db_utils.DBError, RuntimeError) as e:
+            logger.warning("Analytics cache refresh failed: %s", e)
+        finally:
+            self._refresh_lock.release()
+
+    def _reload(self):
+        try:
+            self.load()
+        except db_utils.DBError as e:
+            logger.warning("Analytics cache reload failed: %s", e)
+
+    def _pull(self, since):
+        conditions = ["created_at < now() - make_interval(secs => %s)"]
+        params = [ANALYTICS_LAG_SECONDS]
+        if since:
+            conditions.append("(created_at, id) > (%s, %s::uuid) AND created_at >= %s")
+            params.extend([since[0], since[1], since[0]])
+        # A full load reads every row: its own connection without a statement
+        # timeout. Refreshes run on request threads and read a few rows: pooled.
+        pooled = since is not None
+        try:
+            conn = db_utils._get_conn() if pooled else db_utils.connect_direct(statement_timeout_ms=0)
+        except psycopg2.Error as e:
+            raise db_utils.DBError("Analytics cache could not connect") from e
+        try:
+            with conn.cursor() as cur:
+                self.timezone = _session_timezone(cur)
+            with conn.cursor(name="analytics") as cur:
+                cur.itersize = _BATCH_ROWS
+                cur.execute(
+                    "SELECT created_at, id, camera_confidence, camera_plate_text, vehicle_brand,"
+                    " vehicle_color, vehicle_type FROM detection_events WHERE "
+                    + " AND ".join(conditions) + " ORDER BY created_at, id",
+                    params,
+                )
+                while True:
+                    rows = cur.fetchmany(_BATCH_ROWS)
+                    if not rows:
+                        break
+                    self._append(rows)
+            conn.rollback()
+        except psycopg2.Error as e:
+            raise db_utils.DBError("Analytics cache query failed") from e
+        finally:
+            if pooled:
+                db_utils._put_conn(conn)
+            else:
+                conn.close()
+
+    def _append(self, rows):
+        n = self.n
+        self.created.append(n, [_to_us(r[0]) for r in rows])
+        self.confidence.append(n, [numpy.nan if r[2] is None else float(r[2]) for r in rows])
+        for position, name in enumerate(_CATEGORICAL, start=3):
+            encode = self.dictionaries[name].encode
+            self.columns[name].append(n, [encode(r[position]) for r in rows])
+        self.watermark = (rows[-1][0], str(rows[-1][1]))
+        # Publish the new length last: readers only look at rows[:n]
+        self.n = n + len(rows)
+
+    # --- queries ---
+
+    def _view(self):
+        with self._lock:
+            n = self.n
+            return (n, self.created.data[:n], self.confidence.data[:n],
+                    {name: col.data[:n] for name, col in self.columns.items()},
+                    self.dictionaries)
+
+    def _timestamp_us(self, value):
+        ts = datetime.datetime.fromisoformat(value)
+        if ts.tzinfo is None:
+            # Postgres reads zone-less literals in the session time zone
+            ts = ts.replace(tzinfo=self.timezone)
+        return _to_us(ts)
+
+    def supports(self, search_term=None):
+        """Whether the cache can evaluate a filter set with this search term exactly."""
+        return self.ready and not (search_term and _LIKE_SPECIAL & set(search_term))
+
+    def _mask(self, view, search_term=None, brand_filter=None, color_filter=None,
+              type_filter=None, start_date_filter=None, end_date_filter=None,
+              min_confidence_filter=None):
+        """Boolean mask of the rows matching the _build_where_clause() filters."""
+        n, created, confidence, columns, dictionaries = view
+        mask = numpy.ones(n, dtype=bool)
+        if search_term:
+            needle = search_term.lower()
+            codes = [code for code, value in enumerate(dictionaries["plate"].values)
+                     if needle in value.lower()]
+            mask &= numpy.isin(columns["plate"], codes)
+        for name, dimension, values in (("brand", "brand", brand_filter),
+                                        ("color", "color", color_filter),
+                                        ("type", "type", type_filter)):
+            if values:
+                lookup = dictionaries[name].codes
+                codes = [lookup[v] for v in db_utils._expand_filter(dimension, values) if v in lookup]
+                mask &= numpy.isin(columns[name], codes)
+        start = db_utils._validate_date(start_date_filter)
+        if start:
+            mask &= created >= self._timestamp_us(start)
+        end = db_utils._validate_date(end_date_filter)
+        if end:
+            mask &= created <= self._timestamp_us(end)
+        if min_confidence_filter is not None:
+            threshold = max(0.0, min(1.0, float(min_confidence_filter)))
+            mask &= confidence >= threshold
+        return mask
+
+    def count(self, **filters):
+        """COUNT(*) of detection_events under the filters."""
+        self.hits += 1
+        view = self._view()
+        return int(numpy.count_nonzero(self._mask(view, **filters)))
+
+    def stats(self, start_date_filter=None, end_date_filter=None):
+        """The fetch_stats() result computed from the arrays."""
+        self.hits += 1
+        view = self._view()
+        n, created, confidence, columns, _ = view
+        mask = self._mask(view, start_date_filter=start_date_filter, end_date_filter=end_date_filter)
+        total = int(numpy.count_nonzero(mask))
+        conf = confidence[mask]
+        conf = conf[~numpy.isnan(conf)]
+        plates = columns["plate"][mask]
+        plates = plates[plates >= 0]
+        result = {
+            "total": total,
+            "unique_plates": int(numpy.count_nonzero(numpy.bincount(plates))) if len(plates) else 0,
+            "avg_confidence": round(float(conf.mean()), 4) if len(conf) else 0.0,
+            "low_confidence_count": int(numpy.count_nonzero(conf < 0.7)),
+            "high_conf": int(numpy.count_nonzero(conf >= 0.9)),
+            "mid_conf": int(numpy.count_nonzero((conf >= 0.7) & (conf < 0.9))),
+            "last_detection_at": None,
+            "first_detection_at": None,
+        }
+        if total:
+            times = created[mask]
+            result["last_detection_at"] = _from_us(times.max()).astimezone(self.timezone)
+            result["first_detection_at"] = _from_us(times.min()).astimezone(self.timezone)
+        return result
+
+    def distinct_values(self, dimension):
+        """Non-blank raw values of a brand/color/type column, like SELECT DISTINCT."""
+        self.hits += 1
+        n, _, _, columns, dictionaries = self._view()
+        present = numpy.flatnonzero(numpy.bincount(columns[dimension][columns[dimension] >= 0],
+                                                   minlength=len(dictionaries[dimension].values)))
+        values = dictionaries[dimension].values
+        return [values[code] for code in present if values[code] and values[code].strip()]
+
+    def metrics(self):
+        return {
+            "rows": self.n,
+            "loaded": self.ready,
+            "hits": self.hits,
+            "distinct": {name: len(d.values) for name, d in self.dictionaries.items()},
+        }
+
+
+cache = None
+
+
+def start():
+    """Load the cache and hand it to db_utils. No-op unless ANALYTICS_CACHE is on and numpy installed."""
+    global numpy, cache
+    if not ANALYTICS_CACHE:
+        return
+    if cache is None:
+        try:
+            import numpy
+        except ImportError:
+            logger.warning("ANALYTICS_CACHE=true but numpy is not installed; queries stay in SQL")
+            return
+        cache = ColumnarCache()
+    if not cache.ready:
+        cache.load()
+    db_utils.columnar_cache = cache
+
+
+def metrics():
+    return cache.metrics() if cache is not None and cache.ready else {"loaded": False}
@@ -1,4 +1,6 @@
+import hashlib
 import hmac
+import json
 import logging
 import os
 import re
@@ -6,12 +8,26 @@ from dotenv import load_dotenv
 
 load_dotenv()   # must be before db_utils import
 
-from flask import Flask, jsonify, request, render_template, Response, session, redirect, url_for
+from flask import Flask, jsonify, request, render_template, Response, session, redirect, send_file, stream_with_context, url_for
 from flask_cors import CORS
 from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
+from itsdangerous import BadSignature, URLSafeSerializer
 from werkzeug.middleware.proxy_fix import ProxyFix
+import analytics
+import cancellation
+import compression
+import dashboard
 import db_utils
+import export
+import image_cache
+import jobs
+import json_provider
+import load_shedding
+import profiling
+import sprites
+import transcode
+import watchlist
 from db_utils import DBError
 logging.basicConfig(level=logging.INFO)
 
@@ -36,6 +52,19 @@ app.config["SESSION_COOKIE_SAMESITE"] = "Lax"
 _debug_values = {"true", "1", "yes", "on"}
 app.config["SESSION_COOKIE_SECURE"] = os.environ.get("FLASK_DEBUG", "").lower() not in _debug_values
 
+# orjson-backed jsonify() when available (JSON_PROVIDER); datetimes as ISO 8601
+json_provider.init_app(app)
+# Opt-in Server-Timing / stack sampling (PROFILE_TOKEN, PROFILE_SAMPLE_RATE). Registered
+# before compression so the profiled total includes compressing the response.
+profiling.init_app(app)
+# gzip/brotli for JSON and HTML; static files precompressed and fingerprinted at startup
+compression.init_app(app)
+# Per-route concurrency budgets and queue-time shedding (503 + Retry-After) under
+# overload; runs before the login check so shed requests cost next to nothing
+load_shedding.init_app(app)
+# Cancel a request's running query when its client disconnects (CANCEL_ON_DISCONNECT)
+cancellation.init_app(app)
+
 _PUBLIC_PATHS = {'/login', '/logout', '/health'}
 
 @app.before_request
@@ -50,7 +79,11 @@ def require_login():
         return jsonify({"error": "Unauthorized"}), 401
     return redirect(url_for('login', next=request.script_root + request.path))
 
+# RATE_LIMIT_ENABLED=false disables all limits — only for load benchmarks (bench/load_driver.py)
+app.config["RATELIMIT_ENABLED"] = os.environ.get("RATE_LIMIT_ENABLED", "true").lower() in _debug_values
 _default_limit = os.environ.get("RATE_LIMIT_DEFAULT", "120 per minute")
+# Image bytes are immutable and browser-cached, but the carousels request several per slide
+_image_limit = os.environ.get("RATE_LIMIT_IMAGES", "300 per minute")
 limiter = Limiter(
     get_remote_address,
     app=app,
@@ -86,6 +119,7 @@ def set_security_headers(response):
 
 @app.route('/health')
 @limiter.exempt
+@load_shedding.limit(priority="critical")
 def health():
     """DB liveness probe. No rate limit — must be reachable by load balancers and uptime monitors."""
     try:
@@ -97,8 +131,24 @@ def health():
     return jsonify({"status": "error", "detail": "DB query failed"}), 503
 
 
+@app.route('/api/metrics')
+def metrics():
+    """Per-worker operational counters (DB pools, image and sprite caches, bulkheads). Requires login."""
+    return jsonify({
+        "db_pools": db_utils.pool_metrics(),
+        "image_cache": image_cache.cache.metrics(),
+        "blob_refs": image_cache.refs.metrics(),
+        "load_shedding": load_shedding.metrics(),
+        "sprites": sprites.cache.metrics(),
+        "cancellation": cancellation.metrics(),
+        "analytics": analytics.metrics(),
+        "transcodes": transcode.store.metrics() if transcode.store else None,
+    })
+
+
 @app.route('/login', methods=['GET', 'POST'])
 @limiter.limit("10 per minute", methods=["POST"])
+@load_shedding.limit(priority="critical")
 def login():
     """Login page. GET renders form; POST validates credentials."""
     if session.get('authenticated'):
@@ -125,6 +175,7 @@ def login():
 
 
 @app.route('/logout')
+@load_shedding.limit(priority="critical")
 def logout():
     """Clear session and redirect to login."""
     session.clear()
@@ -159,6 +210,57 @@ def recent_thumbnails():
         return jsonify({"error": "Service temporarily unavailable"}), 503
     return jsonify(thumbnails)
 
+@app.route('/api/thumbnail_sprite')
+def thumbnail_sprite():
+    """
+    Offset map of the recent thumbnails composed into one sprite image: the
+    /api/recent_thumbnails items with the x/y of their tile, the tile size and
+    the sprite URL. 404 when sprites are unavailable (no Pillow) or there are no images.
+    """
+    limit = request.args.get('limit', 8, type=int)
+    limit = max(1, min(20, limit))
+    if not sprites.available():
+        return jsonify({"error": "Sprites unavailable"}), 404
+    try:
+        thumbnails = db_utils.fetch_recent_thumbnails(limit=limit)
+    except (DBError, RuntimeError):
+        return jsonify({"error": "Service temporarily unavailable"}), 503
+    if not thumbnails:
+        return jsonify({"error": "No thumbnails"}), 404
+    return jsonify(_sprite_map(thumbnails))
+
+
+def _sprite_map(thumbnails):
+    """The /api/thumbnail_sprite payload for fetch_recent_thumbnails() results."""
+    return {
+        'url': url_for('thumbnail_sprite_image', anchor_id=thumbnails[0]['image_id'],
+                       count=len(thumbnails)),
+        'tile_width': sprites.SPRITE_TILE_WIDTH,
+        'tile_height': sprites.SPRITE_TILE_HEIGHT,
+        'thumbnails': sprites.offsets(thumbnails),
+    }
+
+
+@app.route('/api/thumbnail_sprite/<anchor_id>.jpg')
+def thumbnail_sprite_image(anchor_id):
+    """The sprite of the `count` newest thumbnails up to image `anchor_id`; immutable."""
+    count = max(1, min(20, request.args.get('count', 8, type=int)))
+    if not _UUID_RE.match(anchor_id):
+        return jsonify({"error": "Invalid image_id format"}), 400
+    if not sprites.available():
+        return jsonify({"error": "Sprites unavailable"}), 404
+    try:
+        sprite = sprites.cache.get(anchor_id, count)
+    except (DBError, RuntimeError):
+        return jsonify({"error": "Service temporarily unavailable"}), 503
+    if sprite is None:
+        return jsonify({"error": "Image not found"}), 404
+    response = Response(sprite.data, mimetype='image/jpeg',
+                        headers={'Cache-Control': 'public, max-age=86400, immutable'})
+    response.set_etag(sprite.etag)
+    return response.make_conditional(request, accept_ranges=True,
+                                     complete_length=len(sprite.data))
+
 @app.route('/api/filter_options')
 def filter_options():
     """Returns unique sorted values for brand, color, and type dropdowns."""
@@ -169,6 +271,7 @@ def filter_options():
     return jsonify(options)
 
 @app.route('/api/search_plate', methods=['GET'])
+@load_shedding.limit(priority="heavy")
 def search_plate():
     """
     Searches for images and associated plate detection data based on plate text.
@@ -184,8 +287,84 @@ def search_plate():
         return jsonify({"error": "Service temporarily unavailable"}), 503
     return jsonify(results)
 
+_MAX_PLATE_TIMELINE = 200
+
+
+@app.route('/api/plate_profile', methods=['GET'])
+def plate_profile():
+    """
+    Aggregated history of one plate ('plate', case and separators ignored): first and
+    last seen, sightings in total and per day, dominant brand/color/type. No images.
+    """
+    plate_key = db_utils.normalize_plate(request.args.get('plate', '', type=str))
+    if not plate_key:
+        return jsonify({"error": "Missing 'plate' query parameter"}), 400
+    try:
+        profile = db_utils.fetch_plate_profile(plate_key)
+    except (DBError, RuntimeError):
+        return jsonify({"error": "Service temporarily unavailable"}), 503
+    if profile is None:
+        return jsonify({"error": "Plate not found"}), 404
+    return jsonify(profile)
+
+
+@app.route('/api/plate_timeline', methods=['GET'])
+def plate_timeline():
+    """
+    Sightings of one plate, newest first, with image ids but no image bytes.
+    Pass the returned next_cursor values as cursor_ts/cursor_id for the next page.
+    """
+    plate_key = db_utils.normalize_plate(request.args.get('plate', '', type=str))
+    if not plate_key:
+        return jsonify({"error": "Missing 'plate' query parameter"}), 400
+    cursor_ts = request.args.get('cursor_ts', None, type=str)
+    cursor_id = request.args.get('cursor_id', None, type=str)
+    if cursor_id and not _UUID_RE.match(cursor_id):
+        return jsonify({"error": "Invalid cursor_id format"}), 400
+    limit = max(1, min(_MAX_PLATE_TIMELINE, request.args.get('limit', 50, type=int)))
+    extra = {}
+    try:
+        events = db_utils.fetch_plate_timeline(plate_key, cursor_ts=cursor_ts,
+                                               cursor_id=cursor_id, limit=limit)
+    except (DBError, RuntimeError):
+        if not db_utils.PLATE_SNAPSHOT_PATH:
+            return jsonify({"error": "Service temporarily unavailable"}), 503
+        # Postgres is failing: answer from the local snapshot, without images
+        try:
+            events, built_at = db_utils.snapshot_plate_timeline(
+                plate_key, cursor_ts=cursor_ts, cursor_id=cursor_id, limit=limit)
+        except RuntimeError:
+            return jsonify({"error": "Service temporarily unavailable"}), 503
+        extra = {"source": "snapshot", "snapshot_built_at": built_at}
+    next_cursor = None
+    if len(events) == limit:
+        last = events[-1]
+        next_cursor = {"cursor_ts": last.created_at, "cursor_id": last.event_id}
+    return jsonify({"plate": plate_key, "events": events, "next_cursor": next_cursor, **extra})
+
+
+@app.route('/api/snapshot/search', methods=['GET'])
+def snapshot_search():
+    """
+    Sightings from the local plate snapshot (PLATE_SNAPSHOT_PATH) without touching
+    Postgres: the newest of the plates starting with 'plate', or else those between
+    'start' and 'end' (ISO timestamps), oldest first.
+    """
+    plate = request.args.get('plate', '', type=str)
+    start = request.args.get('start', None, type=str)
+    end = request.args.get('end', None, type=str)
+    if not plate and not (start or end):
+        return jsonify({"error": "Pass 'plate' or a 'start'/'end' range"}), 400
+    limit = max(1, min(_MAX_PLATE_TIMELINE, request.args.get('limit', 50, type=int)))
+    try:
+        events, built_at = db_utils.snapshot_search(plate, start=start, end=end, limit=limit)
+    except RuntimeError:
+        return jsonify({"error": "Plate snapshot unavailable"}), 503
+    return jsonify({"events": events, "snapshot_built_at": built_at})
+
 @app.route('/api/images_by_datetime', methods=['GET'])
 @limiter.limit("20 per minute")
+@load_shedding.limit(priority="heavy", concurrency=1)
 def images_by_datetime():
     """
     Fetches images and associated plate detection data within a specified datetime range.
@@ -210,24 +389,10 @@ def images_by_datetime():
 
     return jsonify(results)
 
-@app.route('/api/all_patents', methods=['GET'])
-def all_patents():
-    """
-    Fetches all patent data with pagination and optional search.
-    Expects 'page' and 'page_size' as query parameters.
-    Optionally accepts 'search_term' for filtering by plate text.
-    """
+def _listing_args():
+    """/api/all_patents paging and filters from the query string, as keyword arguments for db_utils."""
     page = request.args.get('page', 1, type=int)
     page_size = request.args.get('page_size', 10, type=int)
-    search_term = request.args.get('search_term', None, type=str)
-    brand_filter_raw = request.args.get('brand_filter', None, type=str)
-    color_filter_raw = request.args.get('color_filter', None, type=str)
-    type_filter_raw  = request.args.get('type_filter',  None, type=str)
-    brand_filter = [v.strip() for v in brand_filter_raw.split(',') if v.strip()] if brand_filter_raw else None
-    color_filter = [v.strip() for v in color_filter_raw.split(',') if v.strip()] if color_filter_raw else None
-    type_filter  = [v.strip() for v in type_filter_raw.split(',')  if v.strip()] if type_filter_raw  else None
-    start_date_filter = request.args.get('start_date_filter', None, type=str)
-    end_date_filter = request.args.get('end_date_filter', None, type=str)
     min_confidence_filter = request.args.get('min_confidence_filter', None, type=float)
 
     if page < 1:
@@ -239,24 +404,40 @@ def all_patents():
     if min_confidence_filter is not None:
         min_confidence_filter = max(0.0, min(1.0, min_confidence_filter))
 
+    return {
+        'page': page,
+        'page_size': page_size,
+        'search_term': request.args.get('search_term', None, type=str),
+        'brand_filter': _csv_arg('brand_filter'),
+        'color_filter': _csv_arg('color_filter'),
+        'type_filter': _csv_arg('type_filter'),
+        'start_date_filter': request.args.get('start_date_filter', None, type=str),
+        'end_date_filter': request.args.get('end_date_filter', None, type=str),
+        'min_confidence_filter': min_confidence_filter,
+        'collapse_window': _collapse_window(),
+    }
+
+
+@app.route('/api/all_patents', methods=['GET'])
+@load_shedding.limit(priority="heavy")
+def all_patents():
+    """
+    Fetches all patent data with pagination and optional search.
+    Expects 'page' and 'page_size' as query parameters.
+    Optionally accepts 'search_term' for filtering by plate text.
+    With 'collapse=1', repeated sightings within 'collapse_window' seconds are one row.
+    """
+    listing = _listing_args()
     try:
-        patents, total_count = db_utils.fetch_all_patents_paginated(
-            page, page_size, search_term,
-            brand_filter=brand_filter,
-            color_filter=color_filter,
-            type_filter=type_filter,
-            start_date_filter=start_date_filter,
-            end_date_filter=end_date_filter,
-            min_confidence_filter=min_confidence_filter
-        )
+        patents, total_count = db_utils.fetch_all_patents_paginated(**listing)
     except (DBError, RuntimeError):
         return jsonify({"error": "Service temporarily unavailable"}), 503
 
     return jsonify({
         'patents': patents,
         'total_count': total_count,
-        'page': page,
-        'page_size': page_size
+        'page': listing['page'],
+        'page_size': listing['page_size']
     })
 
 @app.route('/api/stats', methods=['GET'])
@@ -272,10 +453,75 @@ def stats():
         return jsonify(result)
     return jsonify({"error": "Failed to fetch stats"}), 500
 
+@app.route('/api/dashboard', methods=['GET'])
+@load_shedding.limit(priority="heavy")
+def dashboard_bootstrap():
+    """
+    Everything the index page loads at once, queried concurrently: 'patents' (the
+    /api/all_patents payload, same parameters), 'stats' (for start_date_filter /
+    end_date_filter), 'thumbnails' (recent_thumbnails items, 'thumbnails' of them),
+    'sprite' (the /api/thumbnail_sprite payload, null without sprites) and
+    'filter_options'. Sections whose query failed are null and listed in 'errors';
+    503 only when all of them failed.
+    """
+    listing = _listing_args()
+    limit = max(1, min(20, request.args.get('thumbnails', 8, type=int)))
+    stats_filters = {'start_date_filter': listing['start_date_filter'],
+                     'end_date_filter': listing['end_date_filter']}
+    results, failed = dashboard.bootstrap(listing, stats_filters, limit)
+    if not results:
+        return jsonify({"error": "Service temporarily unavailable"}), 503
+
+    patents = None
+    if 'patents' in results:
+        rows, total_count = results['patents']
+        patents = {'patents': rows, 'total_count': total_count,
+                   'page': listing['page'], 'page_size': listing['page_size']}
+    thumbnails = results.get('thumbnails')
+    return jsonify({
+        'patents': patents,
+        'stats': results.get('stats'),
+        'thumbnails': thumbnails,
+        'sprite': _sprite_map(thumbnails) if thumbnails and sprites.available() else None,
+        'filter_options': results.get('filter_options'),
+        'errors': failed,
+    })
+
 _VALID_BROWSE_TYPES = {'vehicle_detection', 'vehicle_picture', 'plate'}
 
+
+def _csv_arg(name):
+    raw = request.args.get(name, None, type=str)
+    return [v.strip() for v in raw.split(',') if v.strip()] if raw else None
+
+
+def _collapse_window():
+    """Dedup window in seconds when the listing is requested with collapse=1, else None."""
+    if request.args.get('collapse', '', type=str).lower() not in _debug_values:
+        return None
+    return request.args.get('collapse_window', db_utils.DEDUP_WINDOW_SECONDS, type=int)
+
+
+def _browse_filters():
+    """Carousel filters from the query string, as keyword arguments for db_utils."""
+    types_raw = request.args.get('types', 'vehicle_detection,vehicle_picture', type=str)
+    types = [t.strip() for t in types_raw.split(',') if t.strip() in _VALID_BROWSE_TYPES]
+    if not types:
+        types = ['vehicle_detection', 'vehicle_picture']
+    return {
+        'types': types,
+        'start_date': request.args.get('start_date', None, type=str),
+        'end_date': request.args.get('end_date', None, type=str),
+        'search_term': request.args.get('search_term', None, type=str),
+        'brand_filter': _csv_arg('brand_filter'),
+        'color_filter': _csv_arg('color_filter'),
+        'vehicle_type_filter': _csv_arg('vehicle_type_filter'),
+        'collapse_window': _collapse_window(),
+    }
+
 @app.route('/api/browse_images', methods=['GET'])
 @limiter.limit("30 per minute")
+@load_shedding.limit(priority="heavy")
 def browse_images():
     """Keyset-paginated image metadata for the global carousel."""
     cursor_ts = request.args.get('cursor_ts', None, type=str)
@@ -286,29 +532,12 @@ def browse_images():
     if direction not in ('forward', 'backward'):
         direction = 'forward'
 
-    types_raw = request.args.get('types', 'vehicle_detection,vehicle_picture', type=str)
-    types = [t.strip() for t in types_raw.split(',') if t.strip() in _VALID_BROWSE_TYPES]
-    if not types:
-        types = ['vehicle_detection', 'vehicle_picture']
-
-    start_date = request.args.get('start_date', None, type=str)
-    end_date = request.args.get('end_date', None, type=str)
-    search_term = request.args.get('search_term', None, type=str)
-    brand_filter_raw  = request.args.get('brand_filter',        None, type=str)
-    color_filter_raw  = request.args.get('color_filter',        None, type=str)
-    vtype_filter_raw  = request.args.get('vehicle_type_filter', None, type=str)
-    brand_filter  = [v.strip() for v in brand_filter_raw.split(',')  if v.strip()] if brand_filter_raw  else None
-    color_filter  = [v.strip() for v in color_filter_raw.split(',')  if v.strip()] if color_filter_raw  else None
-    vtype_filter  = [v.strip() for v in vtype_filter_raw.split(',')  if v.strip()] if vtype_filter_raw  else None
+    filters = _browse_filters()
 
     try:
         images = db_utils.fetch_browsable_images(
             cursor_ts=cursor_ts, cursor_id=cursor_id, limit=limit,
-            direction=direction, types=types,
-            start_date=start_date, end_date=end_date, search_term=search_term,
-            brand_filter=brand_filter,
-            color_filter=color_filter,
-            vehicle_type_filter=vtype_filter,
+            direction=direction, **filters
         )
     except (DBError, RuntimeError):
         return jsonify({"error": "Service temporarily unavailable"}), 503
@@ -318,38 +547,151 @@ def browse_images():
     # Only include total_count on first request (no cursor)
     if not cursor_ts:
         try:
-            result['total_count'] = db_utils.count_browsable_images(
-                types, start_date=start_date, end_date=end_date, search_term=search_term,
-                brand_filter=brand_filter,
-                color_filter=color_filter,
-                vehicle_type_filter=vtype_filter,
-            )
+            result['total_count'] = db_utils.count_browsable_images(**filters)
         except (DBError, RuntimeError):
             return jsonify({"error": "Service temporarily unavailable"}), 503
 
     return jsonify(result)
 
 
-@app.route('/api/browse_image/<image_id>', methods=['GET'])
+
+# Opaque carousel cursors: signed with SECRET_KEY so any worker can resume a
+# window, and bound to the filter set they were issued for.
+_browse_cursors = URLSafeSerializer(app.secret_key, salt="browse-window-cursor")
+_MAX_BROWSE_WINDOW = 50
+
+
+def _filters_digest(filters):
+    canonical = json.dumps(filters, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(canonical.encode()).hexdigest()[:16]
+
+
+def _make_cursor(item, direction, digest):
+    return _browse_cursors.dumps([item.created_at.isoformat(), item.image_id, direction[0], digest])
+
+
+@app.route('/api/browse_window', methods=['GET'])
 @limiter.limit("30 per minute")
+@load_shedding.limit(priority="heavy")
+def browse_window():
+    """
+    One carousel window plus signed cursors to its neighbours.
+
+    Returns {"images", "next_cursor", "prev_cursor"} (and "total_count" when no
+    cursor is given). Pass either cursor back as `cursor=` with the same filters
+    to get the adjacent window; a null cursor means there is nothing beyond.
+    """
+    limit = request.args.get('limit', 10, type=int)
+    limit = max(1, min(_MAX_BROWSE_WINDOW, limit))
+    filters = _browse_filters()
+    digest = _filters_digest(filters)
+
+    cursor_ts = cursor_id = None
+    direction = 'forward'
+    token = request.args.get('cursor', None, type=str)
+    if token:
+        try:
+            cursor_ts, cursor_id, direction_code, cursor_digest = _browse_cursors.loads(token)
+        except (BadSignature, ValueError):
+            return jsonify({"error": "Invalid cursor"}), 400
+        if not hmac.compare_digest(cursor_digest, digest):
+            return jsonify({"error": "Cursor does not match the current filters"}), 400
+        direction = 'backward' if direction_code == 'b' else 'forward'
+
+    try:
+        # One extra row tells whether another window exists beyond this one
+        images = db_utils.fetch_browsable_images(
+            cursor_ts=cursor_ts, cursor_id=cursor_id, limit=limit + 1,
+            direction=direction, **filters
+        )
+    except (DBError, RuntimeError):
+        return jsonify({"error": "Service temporarily unavailable"}), 503
+
+    # Rows are newest first. Going forward the extra row is the oldest one,
+    # going backward it is the newest; the row the cursor came from always
+    # exists on the other side.
+    more = len(images) > limit
+    if direction == 'forward':
+        images = images[:limit]
+        has_next, has_prev = more, token is not None
+    else:
+        images = images[-limit:]
+        has_next, has_prev = True, more
+
+    result = {
+        'images': images,
+        'next_cursor': _make_cursor(images[-1], 'forward', digest) if images and has_next else None,
+        'prev_cursor': _make_cursor(images[0], 'backward', digest) if images and has_prev else None,
+    }
+    if not token:
+        try:
+            result['total_count'] = db_utils.count_browsable_images(**filters)
+        except (DBError, RuntimeError):
+            return jsonify({"error": "Service temporarily unavailable"}), 503
+
+    return jsonify(result)
+
+@app.route('/api/browse_image/<image_id>', methods=['GET'])
+@limiter.limit(_image_limit)
 def browse_image(image_id):
-    """Serves raw image bytes for a single image by ID."""
+    """
+    Serves one image by ID: an AVIF/WebP transcode when the client accepts one
+    (TRANSCODE_DIR), else the stored bytes.
+    """
     if not _UUID_RE.match(image_id):
         return jsonify({"error": "Invalid image_id format"}), 400
+    image_id = image_id.lower()
     try:
         data = db_utils.fetch_browse_image_by_id(image_id)
     except (DBError, RuntimeError):
         return jsonify({"error": "Service temporarily unavailable"}), 503
     if not data:
         return jsonify({"error": "Image not found"}), 404
-    return Response(
-        data['image_data'],
-        mimetype='image/jpeg',
-        headers={'Cache-Control': 'public, max-age=86400'}
-    )
+
+    fmt = transcode.negotiate(request.accept_mimetypes) if transcode.store else None
+    if fmt:
+        def load_original():
+            if 'image_path' in data:
+                with open(data['image_path'], 'rb') as f:
+                    return f.read()
+            return data['image_data']
+
+        try:
+            variant = transcode.store.get(image_id, data['image_type'], fmt, load_original)
+        except OSError:
+            variant = None
+        if variant:
+            try:
+                response = send_file(variant, mimetype=transcode.MIMETYPES[fmt],
+                                     etag=os.path.basename(variant), max_age=86400, conditional=True)
+            except OSError:
+                # Evicted by another worker in the meantime: serve the original
+                response = None
+            if response is not None:
+                response.vary.add('Accept')
+                return response
+
+    if 'image_path' in data:
+        # Blob in the local store: gunicorn hands the file to sendfile()
+        with open(data['image_path'], 'rb') as f:
+            mimetype = transcode.sniff_mimetype(f.read(12))
+        response = send_file(
+            data['image_path'], mimetype=mimetype, etag=data['image_sha256'],
+            max_age=86400, conditional=True,
+        )
+    else:
+        response = Response(
+            data['image_data'],
+            mimetype=transcode.sniff_mimetype(data['image_data'][:12]),
+            headers={'Cache-Control': 'public, max-age=86400'}
+        )
+    if transcode.store:
+        response.vary.add('Accept')
+    return response
 
 
 @app.route('/api/image/<event_id>', methods=['GET'])
+@load_shedding.limit(priority="heavy")
 def get_image(event_id):
     """
     Fetches image data (base64) and type for a given event_id.
@@ -364,6 +706,212 @@ def get_image(event_id):
         return jsonify({"images": images})
     return jsonify({"error": "Image not found for this event_id"}), 404
 
+_MAX_BATCH_EVENT_IDS = 50
+
+@app.route('/api/event_images', methods=['GET'])
+def event_images():
+    """
+    Image ids and types for up to 50 events in one call (comma-separated 'event_ids').
+    Bytes are fetched separately through the cacheable /api/browse_image/<image_id>.
+    """
+    event_ids_raw = request.args.get('event_ids', '', type=str)
+    event_ids = list(dict.fromkeys(e.strip() for e in event_ids_raw.split(',') if e.strip()))
+    if not event_ids:
+        return jsonify({"error": "Missing 'event_ids' query parameter"}), 400
+    if len(event_ids) > _MAX_BATCH_EVENT_IDS:
+        return jsonify({"error": f"At most {_MAX_BATCH_EVENT_IDS} event_ids per request"}), 400
+    if not all(_UUID_RE.match(e) for e in event_ids):
+        return jsonify({"error": "Invalid event_id format"}), 400
+    try:
+        images = db_utils.fetch_image_ids_by_event_ids(event_ids)
+    except (DBError, RuntimeError):
+        return jsonify({"error": "Service temporarily unavailable"}), 503
+    return jsonify({"events": {e: images.get(e.lower(), []) for e in event_ids}})
+
+_MAX_JOB_LIST = 100
+
+
+@app.route('/api/jobs', methods=['POST'])
+@limiter.limit("10 per minute")
+def create_job():
+    """
+    Queue a background job: JSON body {"kind": ..., "params": {...}}.
+    Answers 202 with the job id; poll /api/jobs/<id> for progress and the result.
+    """
+    body = request.get_json(silent=True)
+    if not isinstance(body, dict):
+        return jsonify({"error": "Body must be a JSON object"}), 400
+    kind = body.get('kind')
+    params = body.get('params')
+    if params is None:
+        params = {}
+    if not isinstance(kind, str) or not isinstance(params, dict):
+        return jsonify({"error": "'kind' must be a string and 'params' an object",
+                        "kinds": jobs.kinds()}), 400
+    try:
+        job_id = jobs.enqueue(kind, params)
+    except ValueError as e:
+        return jsonify({"error": str(e), "kinds": jobs.kinds()}), 400
+    except (DBError, RuntimeError):
+        return jsonify({"error": "Service temporarily unavailable"}), 503
+    return jsonify({"id": job_id, "status": "queued",
+                    "url": url_for('job_status', job_id=job_id)}), 202
+
+
+@app.route('/api/jobs', methods=['GET'])
+def list_jobs():
+    """Most recent jobs (without results), optionally filtered by 'status'."""
+    status = request.args.get('status', None, type=str)
+    if status and status not in jobs.STATUSES:
+        return jsonify({"error": f"status must be one of {', '.join(jobs.STATUSES)}"}), 400
+    limit = max(1, min(_MAX_JOB_LIST, request.args.get('limit', 20, type=int)))
+    try:
+        return jsonify({"jobs": jobs.list_jobs(status=status, limit=limit)})
+    except (DBError, RuntimeError):
+        return jsonify({"error": "Service temporarily unavailable"}), 503
+
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    """Status, progress and, once succeeded, the result of a background job."""
+    if not _UUID_RE.match(job_id):
+        return jsonify({"error": "Invalid job_id format"}), 400
+    try:
+        job = jobs.get_job(job_id)
+    except (DBError, RuntimeError):
+        return jsonify({"error": "Service temporarily unavailable"}), 503
+    if not job:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify(job)
+
+
+@app.route('/api/jobs/<job_id>/cancel', methods=['POST'])
+def cancel_job(job_id):
+    """Cancel a queued job, or ask the worker running it to stop."""
+    if not _UUID_RE.match(job_id):
+        return jsonify({"error": "Invalid job_id format"}), 400
+    try:
+        status = jobs.cancel_job(job_id)
+    except (DBError, RuntimeError):
+        return jsonify({"error": "Service temporarily unavailable"}), 503
+    if status is None:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify({"id": job_id, "status": status})
+
+@app.route('/api/export', methods=['GET'])
+@limiter.limit("10 per minute")
+# Streams hold a worker thread for the whole export: one at a time per worker
+@load_shedding.limit(priority="light", concurrency=1)
+def export_detections():
+    """
+    Stream the detections matching the /api/all_patents filters as 'format'
+    csv (default) or parquet, in (created_at, id) order. With 'since' and
+    'since_id' (a previous X-Export-Watermark / X-Export-Watermark-Id), only
+    newer rows are exported. The new watermark is sent in those headers.
+    """
+    fmt = request.args.get('format', 'csv', type=str).lower()
+    if fmt not in export.FORMATS:
+        return jsonify({"error": f"format must be one of {', '.join(export.FORMATS)}"}), 400
+    since_id = request.args.get('since_id', None, type=str)
+    if since_id and not _UUID_RE.match(since_id):
+        return jsonify({"error": "Invalid since_id format"}), 400
+    filters = {
+        'search_term': request.args.get('search_term', None, type=str),
+        'brand_filter': _csv_arg('brand_filter'),
+        'color_filter': _csv_arg('color_filter'),
+        'type_filter': _csv_arg('type_filter'),
+        'start_date_filter': request.args.get('start_date_filter', None, type=str),
+        'end_date_filter': request.args.get('end_date_filter', None, type=str),
+        'min_confidence_filter': request.args.get('min_confidence_filter', None, type=float),
+    }
+    try:
+        extract = export.Export(filters, since=request.args.get('since', None, type=str),
+                                since_id=since_id)
+        chunks = extract.chunks(fmt)
+        extract.open()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except (DBError, RuntimeError):
+        return jsonify({"error": "Service temporarily unavailable"}), 503
+
+    headers = {"Content-Disposition": f'attachment; filename="detections.{fmt}"'}
+    if extract.watermark:
+        headers["X-Export-Watermark"] = extract.watermark[0].isoformat()
+        headers["X-Export-Watermark-Id"] = extract.watermark[1]
+    response = Response(stream_with_context(chunks), mimetype=export.MIMETYPES[fmt], headers=headers)
+    # Also when the body is never iterated (HEAD, client gone before the first chunk)
+    response.call_on_close(extract.close)
+    return response
+
+_MAX_WATCHLIST_PAGE = 500
+
+
+@app.route('/api/watchlist', methods=['GET'])
+def watchlist_plates():
+    """Active watchlist entries ('limit', 'offset')."""
+    limit = max(1, min(_MAX_WATCHLIST_PAGE, request.args.get('limit', 100, type=int)))
+    offset = max(0, request.args.get('offset', 0, type=int))
+    try:
+        return jsonify({"plates": watchlist.list_plates(limit=limit, offset=offset)})
+    except (DBError, RuntimeError):
+        return jsonify({"error": "Service temporarily unavailable"}), 503
+
+
+@app.route('/api/watchlist', methods=['POST'])
+@limiter.limit("10 per minute")
+def watchlist_add():
+    """
+    Add plates to the watchlist: JSON body {"plate": ..., "label": ...} or
+    {"plates": [{"plate": ..., "label": ...}, ...]}. Matching starts within a batch.
+    """
+    body = request.get_json(silent=True)
+    if not isinstance(body, dict):
+        return jsonify({"error": "Body must be a JSON object"}), 400
+    items = body.get('plates') if 'plates' in body else [body]
+    if not isinstance(items, list) or not all(isinstance(i, dict) for i in items):
+        return jsonify({"error": "Expected 'plate' or a 'plates' list"}), 400
+    if not all(isinstance(i.get(field), (str, type(None))) for i in items for field in ('plate', 'label')):
+        return jsonify({"error": "'plate' and 'label' must be strings"}), 400
+    try:
+        keys = watchlist.add_plates((i.get('plate'), i.get('label')) for i in items)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except (DBError, RuntimeError):
+        return jsonify({"error": "Service temporarily unavailable"}), 503
+    return jsonify({"plates": keys}), 201
+
+
+@app.route('/api/watchlist/<plate>', methods=['DELETE'])
+def watchlist_remove(plate):
+    """Remove a plate from the watchlist. Its past hits are kept."""
+    plate_key = db_utils.normalize_plate(plate)
+    if not plate_key:
+        return jsonify({"error": "Invalid plate"}), 400
+    try:
+        removed = watchlist.remove_plate(plate_key)
+    except (DBError, RuntimeError):
+        return jsonify({"error": "Service temporarily unavailable"}), 503
+    if not removed:
+        return jsonify({"error": "Plate not on the watchlist"}), 404
+    return jsonify({"plate": plate_key, "removed": True})
+
+
+@app.route('/api/watchlist/hits', methods=['GET'])
+def watchlist_hits():
+    """
+    Detections that matched the watchlist. Without 'since_id': most recent first.
+    With 'since_id': hits recorded after it, oldest first, for polling.
+    """
+    since_id = request.args.get('since_id', None, type=int)
+    plate = request.args.get('plate', None, type=str)
+    limit = max(1, min(_MAX_WATCHLIST_PAGE, request.args.get('limit', 100, type=int)))
+    try:
+        hits = watchlist.fetch_hits(since_id=since_id, plate_key=db_utils.normalize_plate(plate),
+                                    limit=limit)
+    except (DBError, RuntimeError):
+        return jsonify({"error": "Service temporarily unavailable"}), 503
+    return jsonify({"hits": hits})
+
 if __name__ == '__main__':
     app.run(
         debug=os.environ.get('FLASK_DEBUG', 'false').lower() == 'true',
@@ -0,0 +1,263 @@
+"""
+Fill a local Postgres with a synthetic, reproducible LPR dataset for benchmarks.
+
+Generates detection_events with realistic skew (a few plates seen very often,
+a long tail seen once), OCR brand misspellings ("Cheurolet", "Renau", ...),
+messy colour strings, and event_images with JPEG blobs of realistic size.
+The same --seed and --end always produce the same rows.
+
+Usage:
+    python bench/generate_dataset.py --dsn "dbname=patentes_bench" --create-schema --events 2000000
+
+Refuses to write to a non-local host unless --allow-remote is given, so it
+cannot be pointed at the production DB_HOST by accident.
+"""
+import argparse
+import bisect
+import datetime
+import io
+import itertools
+import math
+import os
+import random
+import string
+import sys
+import time
+import uuid
+
+import psycopg2
+
+SCHEMA_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "schema.sql")
+
+# (value, weight). Misspellings mirror what the camera OCR actually produces.
+BRANDS = [
+    ("Chevrolet", 14), ("Cheurolet", 3), ("CHEVROLET", 1),
+    ("Volkswagen", 13), ("Evolkswagen", 2),
+    ("Renault", 12), ("Renau", 2),
+    ("Ford", 11), ("Fiat", 10), ("Toyota", 9), ("Peugeot", 8), ("Citroën", 4),
+    ("Honda", 3), ("Nissan", 3), ("Jeep", 2), ("Mercedes-Benz", 1), (None, 2),
+]
+COLORS = [
+    ("Blanco", 25), ("Gris", 20), ("Negro", 15), ("Plata", 12), ("Rojo", 8),
+    ("Azul", 7), ("Blanco ", 2), ("Verde", 2), ("Bordó", 1), (None, 3),
+]
+VEHICLE_TYPES = [
+    ("Auto", 60), ("Camioneta", 20), ("Utilitario", 8), ("Moto", 6), ("Camión", 4), (None, 2),
+]
+# image_type -> (mean bytes, std dev bytes) for the camera's JPEGs
+IMAGE_SIZES = {
+    "vehicle_detection": (95_000, 20_000),
+    "vehicle_picture": (45_000, 10_000),
+    "plate": (6_000, 1_500),
+}
+# Characters the OCR confuses; used to inject near-duplicate plate readings
+OCR_CONFUSIONS = {"0": "O", "O": "0", "1": "I", "I": "1", "8": "B", "B": "8", "5": "S", "S": "5"}
+
+_JPEG_HEADER = bytes.fromhex("ffd8ffe000104a46494600010100000100010000")
+_JPEG_TRAILER = bytes.fromhex("ffd9")
+
+
+def _weighted_picker(rng, pairs):
+    values = [v for v, _ in pairs]
+    cum = list(itertools.accumulate(w for _, w in pairs))
+    total = cum[-1]
+    return lambda: values[bisect.bisect_right(cum, rng.random() * total)]
+
+
+def _make_plates(rng, count):
+    """Unique plates in both Argentine formats: legacy ABC123 and Mercosur AB123CD."""
+    letters, digits = string.ascii_uppercase, string.digits
+    plates = set()
+    while len(plates) < count:
+        if rng.random() < 0.55:
+            p = "".join(rng.choices(letters, k=3)) + "".join(rng.choices(digits, k=3))
+        else:
+            p = ("".join(rng.choices(letters, k=2)) + "".join(rng.choices(digits, k=3))
+                 + "".join(rng.choices(letters, k=2)))
+        plates.add(p)
+    return sorted(plates)
+
+
+def _zipf_picker(rng, items, exponent):
+    """Pick items with probability proportional to 1 / rank**exponent (repeat offenders first)."""
+    cum = list(itertools.accumulate(1.0 / math.pow(rank, exponent) for rank in range(1, len(items) + 1)))
+    total = cum[-1]
+    return lambda: items[bisect.bisect_right(cum, rng.random() * total)]
+
+
+def _ocr_noise(rng, plate):
+    positions = [i for i, ch in enumerate(plate) if ch in OCR_CONFUSIONS]
+    if not positions:
+        return plate
+    i = rng.choice(positions)
+    return plate[:i] + OCR_CONFUSIONS[plate[i]] + plate[i + 1:]
+
+
+def _jpeg_blob(rng, image_type):
+    """Incompressible bytes framed as a JPEG, sized like the camera's real output."""
+    mean, std = IMAGE_SIZES[image_type]
+    size = max(1024, int(rng.gauss(mean, std)))
+    return _JPEG_HEADER + rng.randbytes(size - len(_JPEG_HEADER) - len(_JPEG_TRAILER)) + _JPEG_TRAILER
+
+
+def _timestamps(rng, count, days, end):
+    """Sorted detection times over `days` days, busier during the day than at night."""
+    start = end - datetime.timedelta(days=days)
+    span = (end - start).total_seconds()
+    out = []
+    while len(out) < count:
+        t = rng.random() * span
+        hour = ((t / 3600.0) + start.hour) % 24
+        # Acceptance sampling: ~4x more traffic at 13h than at 4h
+        if rng.random() < 0.25 + 0.75 * math.sin(math.pi * ((hour - 4) % 24) / 24) ** 2:
+            out.append(start + datetime.timedelta(seconds=t))
+    out.sort()
+    return out
+
+
+def _uuid(rng):
+    return uuid.UUID(int=rng.getrandbits(128), version=4)
+
+
+def _copy_text(value):
+    """Escape one value for COPY ... FROM STDIN in text format."""
+    if value is None:
+        return "\\N"
+    if isinstance(value, (bytes, bytearray)):
+        return "\\\\x" + value.hex()
+    if isinstance(value, datetime.datetime):
+        return value.isoformat()
+    return (str(value).replace("\\", "\\\\").replace("\t", "\\t")
+            .replace("\n", "\\n").replace("\r", "\\r"))
+
+
+def _copy_rows(cur, table, columns, rows):
+    buf = io.StringIO()
+    for row in rows:
+        buf.write("\t".join(_copy_text(v) for v in row))
+        buf.write("\n")
+    buf.seek(0)
+    cur.copy_expert(f"COPY {table} ({', '.join(columns)}) FROM STDIN", buf)
+
+
+def _check_target(conn, allow_remote):
+    params = conn.get_dsn_parameters()
+    host = params.get("host", "")
+    local = host in ("", "localhost", "127.0.0.1", "::1") or host.startswith("/")
+    if not local and not allow_remote:
+        sys.exit(f"Refusing to write benchmark data to non-local host {host!r} (use --allow-remote).")
+    if os.environ.get("DB_HOST") and host == os.environ["DB_HOST"] and not allow_remote:
+        sys.exit("Refusing to write benchmark data to DB_HOST from the environment.")
+
+
+def generate(args):
+    rng = random.Random(args.seed)
+    conn = psycopg2.connect(args.dsn)
+    _check_target(conn, args.allow_remote)
+    cur = conn.cursor()
+
+    if args.create_schema:
+        with open(SCHEMA_FILE) as f:
+            cur.execute(f.read())
+    if args.truncate:
+        cur.execute("TRUNCATE event_images, detection_events")
+    conn.commit()
+
+    print(f"Generating {args.unique_plates:,} plates and {args.events:,} event timestamps...")
+    plates = _make_plates(rng, min(args.unique_plates, args.events))
+    rng.shuffle(plates)  # rank must not correlate with alphabetical order
+    pick_plate = _zipf_picker(rng, plates, args.skew)
+    pick_brand = _weighted_picker(rng, BRANDS)
+    pick_color = _weighted_picker(rng, COLORS)
+    pick_type = _weighted_picker(rng, VEHICLE_TYPES)
+    # The plate keeps its vehicle attributes across sightings, like a real car would
+    vehicle_of = {}
+
+    if args.end:
+        end = datetime.datetime.fromisoformat(args.end)
+        if end.tzinfo is None:
+            end = end.replace(tzinfo=datetime.timezone.utc)
+    else:
+        end = datetime.datetime.now(datetime.timezone.utc).replace(microsecond=0)
+    timestamps = _timestamps(rng, args.events, args.days, end)
+    # Images for the most recent events only (older blobs are typically purged)
+    image_from = args.events - int(args.events * args.image_ratio)
+
+    blob_pool = {
+        t: [_jpeg_blob(rng, t) for _ in range(args.blob_variants)] for t in IMAGE_SIZES
+    }
+
+    started = time.monotonic()
+    n_images = 0
+    for batch_start in range(0, args.events, args.batch):
+        events, images = [], []
+        for i in range(batch_start, min(batch_start + args.batch, args.events)):
+            plate = pick_plate()
+            if plate not in vehicle_of:
+                vehicle_of[plate] = (pick_brand(), pick_color(), pick_type())
+            brand, color, vtype = vehicle_of[plate]
+            if rng.random() < args.ocr_noise:
+                plate = _ocr_noise(rng, plate)
+            if rng.random() < 0.05:
+                brand = pick_brand()  # occasional misread of the make
+            confidence = round(rng.betavariate(8, 2), 4) if rng.random() > 0.01 else None
+            event_id = _uuid(rng)
+            ts = timestamps[i]
+            events.append((event_id, plate, confidence, brand, color, vtype, ts))
+            if i >= image_from:
+                for image_type in IMAGE_SIZES:
+                    # Pipeline writes images a moment after the event
+                    img_ts = ts + datetime.timedelta(milliseconds=rng.randint(50, 900))
+                    images.append((
+                        _uuid(rng), event_id, image_type, f"{image_type}_{event_id}.jpg",
+                        rng.choice(blob_pool[image_type]), img_ts,
+                    ))
+        _copy_rows(cur, "detection_events",
+                   ("id", "camera_plate_text", "camera_confidence", "vehicle_brand",
+                    "vehicle_color", "vehicle_type", "created_at"), events)
+        if images:
+            _copy_rows(cur, "event_images",
+                       ("id", "event_id", "image_type", "file_name", "image_data", "created_at"), images)
+            n_images += len(images)
+        conn.commit()
+        done = min(batch_start + args.batch, args.events)
+        rate = done / max(time.monotonic() - started, 1e-6)
+        print(f"  {done:,}/{args.events:,} events, {n_images:,} images ({rate:,.0f} events/s)", flush=True)
+
+    print("Analyzing...")
+    conn.autocommit = True
+    cur.execute("ANALYZE detection_events")
+    cur.execute("ANALYZE event_images")
+    cur.close()
+    conn.close()
+    print(f"Done in {time.monotonic() - started:.1f}s: {args.events:,} events, {n_images:,} images.")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--dsn", default=os.environ.get("BENCH_DSN", "dbname=patentes_bench"),
+                        help="libpq connection string of the benchmark database (env BENCH_DSN)")
+    parser.add_argument("--events", type=int, default=1_000_000, help="detection_events rows to insert")
+    parser.add_argument("--unique-plates", type=int, default=150_000, help="distinct vehicles")
+    parser.add_argument("--skew", type=float, default=0.7,
+                        help="Zipf exponent for plate repetition (higher = more repeat sightings)")
+    parser.add_argument("--ocr-noise", type=float, default=0.03,
+                        help="fraction of readings with one OCR-confused character")
+    parser.add_argument("--days", type=int, default=90, help="time span covered by the events")
+    parser.add_argument("--end", default=None,
+                        help="ISO timestamp of the newest event (default: now); fix it for identical reruns")
+    parser.add_argument("--image-ratio", type=float, default=0.02,
+                        help="fraction of (most recent) events that get their 3 images; "
+                             "each image set is ~150 KB, so 1M events at 1.0 is ~150 GB")
+    parser.add_argument("--blob-variants", type=int, default=16,
+                        help="distinct JPEG payloads generated per image type and reused")
+    parser.add_argument("--batch", type=int, default=5_000, help="rows per COPY batch")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--create-schema", action="store_true", help="create tables from bench/schema.sql")
+    parser.add_argument("--truncate", action="store_true", help="empty both tables first")
+    parser.add_argument("--allow-remote", action="store_true", help="allow a non-local database host")
+    generate(parser.parse_args(argv))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+"""
+Microbenchmark: row materialization + JSON encoding per API endpoint.
+
+Compares, for result sets shaped like each endpoint's query output,
+  - legacy:  dict(zip(columns, row)) per row, str()/isoformat() in Python,
+             encoded by Flask's DefaultJSONProvider
+  - stdlib:  json_provider records, encoded by StdlibJSONProvider
+  - orjson:  json_provider records, encoded by OrjsonProvider (if installed)
+
+Only the Python work between cursor.fetchall() and the response body is
+timed; no database is needed.
+
+Usage:
+    python bench/json_bench.py [--repeat 200] [--image-kb 0]
+"""
+import argparse
+import base64
+import datetime
+import os
+import random
+import sys
+import time
+import uuid
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask  # noqa: E402
+from flask.json.provider import DefaultJSONProvider  # noqa: E402
+
+import json_provider  # noqa: E402
+
+IMAGE_COLUMNS = ("event_id", "image_id", "created_at", "image_data", "image_type",
+                 "file_name", "plate_text", "plate_confidence")
+PATENT_COLUMNS = ("event_id", "plate_text", "vehicle_brand", "vehicle_color",
+                  "vehicle_type", "plate_confidence", "created_at")
+BROWSE_COLUMNS = ("image_id", "event_id", "created_at", "image_type", "plate_text")
+
+# endpoint -> (columns, rows per response, wrap result in {"<key>": ...})
+ENDPOINTS = {
+    "latest_images": (IMAGE_COLUMNS, 50, None),
+    "search_plate": (IMAGE_COLUMNS, 50, None),
+    "images_by_datetime": (IMAGE_COLUMNS, 500, None),
+    "all_patents": (PATENT_COLUMNS, 100, "patents"),
+    "browse_images": (BROWSE_COLUMNS, 10, "images"),
+}
+
+
+def _rows(rng, columns, count, image_bytes):
+    now = datetime.datetime.now(datetime.timezone.utc)
+    values = {
+        "event_id": lambda: str(uuid.UUID(int=rng.getrandbits(128), version=4)),
+        "image_id": lambda: str(uuid.UUID(int=rng.getrandbits(128), version=4)),
+        "created_at": lambda: now - datetime.timedelta(seconds=rng.randint(0, 86400)),
+        "image_data": lambda: rng.randbytes(image_bytes) if image_bytes else None,
+        "image_type": lambda: rng.choice(("vehicle_detection", "vehicle_picture", "plate")),
+        "file_name": lambda: "plate_%d.jpg" % rng.getrandbits(32),
+        "plate_text": lambda: "AB%03dCD" % rng.randint(0, 999),
+        "plate_confidence": lambda: round(rng.random(), 4),
+        "vehicle_brand": lambda: rng.choice(("Ford", "Fiat", "Chevrolet")),
+        "vehicle_color": lambda: rng.choice(("Blanco", "Gris")),
+        "vehicle_type": lambda: "Auto",
+    }
+    return [tuple(values[c]() for c in columns) for _ in range(count)]
+
+
+def _legacy(columns, rows):
+    """What db_utils did before: a dict per row, conversions done in Python."""
+    out = []
+    for row in rows:
+        row_dict = dict(zip(columns, row))
+        if row_dict.get("image_data"):
+            row_dict["image_data"] = base64.b64encode(row_dict["image_data"]).decode("utf-8")
+        if row_dict.get("created_at"):
+            row_dict["created_at"] = row_dict["created_at"].isoformat()
+        row_dict["event_id"] = str(row_dict["event_id"])
+        out.append(row_dict)
+    return out
+
+
+def _records(columns, rows):
+    row_type = json_provider.record_type(columns)
+    out = [row_type(*row) for row in rows]
+    if "image_data" in columns:
+        for rec in out:
+            if rec.image_data:
+                rec.image_data = base64.b64encode(rec.image_data).decode("ascii")
+    return out
+
+
+def _time(fn, repeat):
+    fn()  # warm-up
+    started = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - started) / repeat * 1000
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=200, help="iterations per measurement")
+    parser.add_argument("--image-kb", type=int, default=0,
+                        help="image_data size for image endpoints (0 = metadata only, isolates "
+                             "row handling from base64 cost)")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args(argv)
+
+    rng = random.Random(args.seed)
+    app = Flask(__name__)
+    variants = [("legacy", _legacy, DefaultJSONProvider(app)),
+                ("stdlib", _records, json_provider.StdlibJSONProvider(app))]
+    if json_provider.orjson is not None:
+        variants.append(("orjson", _records, json_provider.OrjsonProvider(app)))
+    else:
+        print("orjson not installed: skipping the orjson variant\n")
+
+    header = f"{'endpoint':<20} {'rows':>5} " + " ".join(f"{name + ' ms':>11}" for name, _, _ in variants)
+    print(header + f" {'speedup':>8}")
+    with app.app_context():
+        for endpoint, (columns, count, key) in ENDPOINTS.items():
+            rows = _rows(rng, columns, count, args.image_kb * 1024)
+            timings = []
+            for _name, materialize, provider in variants:
+                def run(materialize=materialize, provider=provider):
+                    result = materialize(columns, rows)
+                    provider.response({key: result} if key else result).get_data()
+                timings.append(_time(run, args.repeat))
+            cells = " ".join(f"{ms:>11.3f}" for ms in timings)
+            print(f"{endpoint:<20} {count:>5} {cells} {timings[0] / timings[-1]:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
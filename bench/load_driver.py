@@ -0,0 +1,479 @@
+"""
+HTTP load driver for the app: exercises every route and reports latency percentiles.
+
+Logs in once per client thread, discovers real ids/plates from the API, then
+replays a weighted route mix for --duration seconds. Reports per-route
+p50/p95/p99/max latency, throughput, error counts, bytes, and the RSS of the
+gunicorn workers when --gunicorn-pid (master) or --pid is given.
+
+Usage:
+    FLASK_DEBUG=true RATE_LIMIT_ENABLED=false gunicorn app:app --config gunicorn.conf.py &
+    python bench/load_driver.py --base-url http://127.0.0.1:10000 --duration 60 --concurrency 8 \\
+        --gunicorn-pid $(pgrep -of 'gunicorn app:app') --json bench_output.txt
+
+Start the server with RATE_LIMIT_ENABLED=false, otherwise the per-IP limits
+turn most of the run into 429s, and with FLASK_DEBUG=true when it listens on
+plain HTTP so the session cookie is not marked Secure. The jobs_create and
+watchlist_add routes write rows, so point the server at a benchmark database.
+snapshot_search answers 503 unless the server has a PLATE_SNAPSHOT_PATH.
+"""
+import argparse
+import http.cookiejar
+import json
+import math
+import os
+import random
+import sys
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+
+# name -> (weight, url builder). Builders get the shared Fixtures and an RNG and
+# return a GET path, or a (method, path, json_body) tuple for other requests.
+ROUTES = {}
+
+
+def route(name, weight):
+    def register(fn):
+        ROUTES[name] = (weight, fn)
+        return fn
+    return register
+
+
+class Fixtures:
+    """Real ids and values sampled from the running app, used to build realistic URLs."""
+
+    def __init__(self):
+        self.event_ids = []
+        self.image_ids = []
+        self.plates = []
+        self.brands = []
+        self.colors = []
+        self.types = []
+        self.cursors = []  # (created_at, image_id) pairs to page the carousel from
+        self.sprite_urls = []  # /api/thumbnail_sprite/<anchor>.jpg URLs from the offset maps
+
+
+@route("health", 1)
+def _health(fx, rng):
+    return "/health"
+
+
+@route("index", 1)
+def _index(fx, rng):
+    return "/"
+
+
+@route("latest_images", 2)
+def _latest_images(fx, rng):
+    return "/api/latest_images?limit=5"
+
+
+@route("recent_thumbnails", 4)
+def _recent_thumbnails(fx, rng):
+    return "/api/recent_thumbnails?limit=7"
+
+
+@route("thumbnail_sprite", 3)
+def _thumbnail_sprite(fx, rng):
+    return "/api/thumbnail_sprite?limit=7"
+
+
+@route("thumbnail_sprite_image", 3)
+def _thumbnail_sprite_image(fx, rng):
+    # Without sprites (no Pillow on the server) this measures the 404
+    return rng.choice(fx.sprite_urls) if fx.sprite_urls else "/api/thumbnail_sprite?limit=7"
+
+
+@route("filter_options", 4)
+def _filter_options(fx, rng):
+    return "/api/filter_options"
+
+
+@route("search_plate", 3)
+def _search_plate(fx, rng):
+    plate = rng.choice(fx.plates) if fx.plates else "AB"
+    return "/api/search_plate?" + urllib.parse.urlencode({"plate": plate[:rng.randint(3, len(plate))]})
+
+
+@route("plate_profile", 2)
+def _plate_profile(fx, rng):
+    plate = rng.choice(fx.plates) if fx.plates else "AB123CD"
+    return "/api/plate_profile?" + urllib.parse.urlencode({"plate": plate})
+
+
+@route("plate_timeline", 2)
+def _plate_timeline(fx, rng):
+    plate = rng.choice(fx.plates) if fx.plates else "AB123CD"
+    return "/api/plate_timeline?" + urllib.parse.urlencode({"plate": plate, "limit": 50})
+
+
+@route("snapshot_search", 2)
+def _snapshot_search(fx, rng):
+    if fx.plates and rng.random() < 0.7:
+        plate = rng.choice(fx.plates)
+        return "/api/snapshot/search?" + urllib.parse.urlencode({"plate": plate[:rng.randint(3, len(plate))]})
+    end = time.time() - rng.randint(0, 30 * 86400)
+    fmt = "%Y-%m-%dT%H:%M:%S"
+    return "/api/snapshot/search?" + urllib.parse.urlencode({
+        "start": time.strftime(fmt, time.gmtime(end - rng.choice([600, 3600]))),
+        "end": time.strftime(fmt, time.gmtime(end)),
+        "limit": 200,
+    })
+
+
+@route("images_by_datetime", 1)
+def _images_by_datetime(fx, rng):
+    end = time.time() - rng.randint(0, 30 * 86400)
+    start = end - rng.choice([3600, 6 * 3600, 86400])
+    fmt = "%Y-%m-%dT%H:%M:%S"
+    return "/api/images_by_datetime?" + urllib.parse.urlencode({
+        "start_datetime": time.strftime(fmt, time.gmtime(start)),
+        "end_datetime": time.strftime(fmt, time.gmtime(end)),
+        "limit": rng.choice([50, 100, 500]),
+    })
+
+
+def _listing_params(fx, rng):
+    params = {"page": rng.choice([1, 1, 1, 2, 3, rng.randint(4, 200)]), "page_size": 30}
+    roll = rng.random()
+    if roll < 0.2 and fx.brands:
+        params["brand_filter"] = ",".join(rng.sample(fx.brands, min(len(fx.brands), rng.randint(1, 2))))
+    elif roll < 0.3 and fx.colors:
+        params["color_filter"] = rng.choice(fx.colors)
+    elif roll < 0.4 and fx.plates:
+        params["search_term"] = rng.choice(fx.plates)[:3]
+    elif roll < 0.5:
+        params["start_date_filter"] = time.strftime("%Y-%m-%d", time.gmtime(time.time() - 7 * 86400))
+    return params
+
+
+@route("all_patents", 10)
+def _all_patents(fx, rng):
+    return "/api/all_patents?" + urllib.parse.urlencode(_listing_params(fx, rng))
+
+
+@route("all_patents_collapsed", 4)
+def _all_patents_collapsed(fx, rng):
+    params = _listing_params(fx, rng)
+    params["collapse"] = 1
+    if rng.random() < 0.3:
+        params["collapse_window"] = rng.choice([30, 300, 3600])
+    return "/api/all_patents?" + urllib.parse.urlencode(params)
+
+
+@route("dashboard", 4)
+def _dashboard(fx, rng):
+    params = _listing_params(fx, rng)
+    params["thumbnails"] = 7
+    return "/api/dashboard?" + urllib.parse.urlencode(params)
+
+
+@route("stats", 6)
+def _stats(fx, rng):
+    if rng.random() < 0.5:
+        return "/api/stats"
+    return "/api/stats?" + urllib.parse.urlencode({
+        "start_date": time.strftime("%Y-%m-%d", time.gmtime(time.time() - rng.choice([1, 7, 30]) * 86400)),
+    })
+
+
+@route("browse_images", 6)
+def _browse_images(fx, rng):
+    params = {"limit": 5, "types": "vehicle_picture"}
+    if fx.cursors and rng.random() < 0.7:
+        ts, image_id = rng.choice(fx.cursors)
+        params.update(cursor_ts=ts, cursor_id=image_id, direction=rng.choice(["forward", "backward"]))
+    return "/api/browse_images?" + urllib.parse.urlencode(params)
+
+
+@route("browse_window", 6)
+def _browse_window(fx, rng):
+    # First window only: cursors are signed per filter set and fetched live
+    return "/api/browse_window?" + urllib.parse.urlencode({"limit": 10, "types": "vehicle_picture"})
+
+
+@route("browse_image", 20)
+def _browse_image(fx, rng):
+    return "/api/browse_image/" + rng.choice(fx.image_ids)
+
+
+@route("image", 3)
+def _image(fx, rng):
+    return "/api/image/" + rng.choice(fx.event_ids)
+
+
+@route("event_images", 4)
+def _event_images(fx, rng):
+    ids = rng.sample(fx.event_ids, min(len(fx.event_ids), 30))
+    return "/api/event_images?event_ids=" + ",".join(ids)
+
+
+@route("export", 1)
+def _export(fx, rng):
+    # One day of rows: a full export would dominate the run
+    day = time.time() - rng.randint(1, 30) * 86400
+    return "/api/export?" + urllib.parse.urlencode({
+        "format": "csv",
+        "start_date_filter": time.strftime("%Y-%m-%d", time.gmtime(day)),
+        "end_date_filter": time.strftime("%Y-%m-%d", time.gmtime(day + 86400)),
+    })
+
+
+@route("jobs_create", 1)
+def _jobs_create(fx, rng):
+    start = time.strftime("%Y-%m-%d", time.gmtime(time.time() - rng.choice([1, 7, 30]) * 86400))
+    return "POST", "/api/jobs", {"kind": "stats", "params": {"start_date": start}}
+
+
+@route("jobs_list", 2)
+def _jobs_list(fx, rng):
+    if rng.random() < 0.5:
+        return "/api/jobs?limit=20"
+    return "/api/jobs?" + urllib.parse.urlencode({"status": rng.choice(["queued", "running", "succeeded"]),
+                                                  "limit": 20})
+
+
+@route("watchlist", 2)
+def _watchlist(fx, rng):
+    return "/api/watchlist?limit=100"
+
+
+@route("watchlist_add", 1)
+def _watchlist_add(fx, rng):
+    plate = rng.choice(fx.plates) if fx.plates else "AB123CD"
+    return "POST", "/api/watchlist", {"plate": plate, "label": "load_driver"}
+
+
+@route("watchlist_hits", 2)
+def _watchlist_hits(fx, rng):
+    return "/api/watchlist/hits?limit=100"
+
+
+@route("metrics", 1)
+def _metrics(fx, rng):
+    return "/api/metrics"
+
+
+class Client:
+    """One logged-in HTTP session (own cookie jar), like one operator's browser."""
+
+    def __init__(self, base_url, user, password, accept_encoding):
+        self.base_url = base_url.rstrip("/")
+        self.headers = {"Accept-Encoding": accept_encoding} if accept_encoding else {}
+        self.opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()))
+        body = urllib.parse.urlencode({"username": user, "password": password}).encode()
+        with self.opener.open(self.base_url + "/login", data=body, timeout=30) as resp:
+            resp.read()
+        status, _ = self.get("/api/metrics")
+        if status == 401:
+            sys.exit("Login failed: check --user/--password. Over plain HTTP the server needs "
+                     "FLASK_DEBUG=true, or the Secure session cookie is never sent back.")
+
+    def get(self, path, timeout=60):
+        """Returns (status, bytes_received)."""
+        return self.request("GET", path, timeout=timeout)
+
+    def request(self, method, path, body=None, timeout=60):
+        """Returns (status, bytes_received); `body` is sent as JSON."""
+        headers = dict(self.headers)
+        data = None
+        if body is not None:
+            data = json.dumps(body).encode()
+            headers["Content-Type"] = "application/json"
+        req = urllib.request.Request(self.base_url + path, data=data, headers=headers, method=method)
+        try:
+            with self.opener.open(req, timeout=timeout) as resp:
+                return resp.status, len(resp.read())
+        except urllib.error.HTTPError as e:
+            return e.code, len(e.read() or b"")
+
+    def get_json(self, path):
+        req = urllib.request.Request(self.base_url + path)
+        with self.opener.open(req, timeout=60) as resp:
+            return json.loads(resp.read())
+
+
+def discover(client):
+    fx = Fixtures()
+    page = client.get_json("/api/all_patents?page=1&page_size=100")
+    for p in page.get("patents", []):
+        fx.event_ids.append(p["event_id"])
+        if p.get("plate_text"):
+            fx.plates.append(p["plate_text"])
+    browse = client.get_json("/api/browse_images?limit=10&types=vehicle_detection,vehicle_picture,plate")
+    for img in browse.get("images", []):
+        fx.image_ids.append(img["image_id"])
+        fx.event_ids.append(img["event_id"])
+        fx.cursors.append((img["created_at"], img["image_id"]))
+    for thumb in client.get_json("/api/recent_thumbnails?limit=20"):
+        fx.image_ids.append(thumb["image_id"])
+    try:
+        url = client.get_json("/api/thumbnail_sprite?limit=7")["url"]
+        fx.sprite_urls.append(url[url.index("/api/"):])  # relative to --base-url, like the routes
+    except (urllib.error.HTTPError, KeyError):
+        pass  # sprites unavailable: thumbnail_sprite_image falls back to the offset map
+    options = client.get_json("/api/filter_options")
+    fx.brands, fx.colors, fx.types = options.get("brands", []), options.get("colors", []), options.get("types", [])
+    if not fx.event_ids or not fx.image_ids:
+        sys.exit("The app returned no events/images; load data with bench/generate_dataset.py first.")
+    return fx
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    k = max(0, min(len(sorted_values) - 1, math.ceil(pct / 100.0 * len(sorted_values)) - 1))
+    return sorted_values[k]
+
+
+def _worker_pids(master_pid):
+    pids = []
+    try:
+        for task in os.listdir(f"/proc/{master_pid}/task"):
+            with open(f"/proc/{master_pid}/task/{task}/children") as f:
+                pids.extend(int(p) for p in f.read().split())
+    except OSError:
+        pass
+    return pids
+
+
+def _rss_kb(pid):
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1])
+    except OSError:
+        return None
+    return None
+
+
+class RssSampler(threading.Thread):
+    """Samples the resident set size of the server processes once per second."""
+
+    def __init__(self, pids, master_pid):
+        super().__init__(daemon=True)
+        self.pids, self.master_pid = list(pids), master_pid
+        self.peak, self.last = {}, {}
+        self.stop_event = threading.Event()
+
+    def run(self):
+        while not self.stop_event.is_set():
+            pids = self.pids + (_worker_pids(self.master_pid) if self.master_pid else [])
+            for pid in pids:
+                rss = _rss_kb(pid)
+                if rss is not None:
+                    self.last[pid] = rss
+                    self.peak[pid] = max(rss, self.peak.get(pid, 0))
+            self.stop_event.wait(1.0)
+
+
+def run(args):
+    selected = args.routes.split(",") if args.routes else list(ROUTES)
+    unknown = [r for r in selected if r not in ROUTES]
+    if unknown:
+        sys.exit(f"Unknown routes: {', '.join(unknown)} (known: {', '.join(ROUTES)})")
+    names = selected
+    weights = [ROUTES[n][0] for n in names]
+
+    print(f"Logging in {args.concurrency} clients at {args.base_url} ...")
+    clients = [Client(args.base_url, args.user, args.password, args.accept_encoding)
+               for _ in range(args.concurrency)]
+    fx = discover(clients[0])
+    print(f"Fixtures: {len(fx.event_ids)} events, {len(fx.image_ids)} images, {len(fx.plates)} plates")
+
+    lock = threading.Lock()
+    samples = {n: [] for n in names}  # route -> [(latency_s, status, bytes)]
+    measuring = threading.Event()
+    deadline = time.monotonic() + args.warmup + args.duration
+
+    def loop(client, seed):
+        rng = random.Random(seed)
+        while time.monotonic() < deadline:
+            name = rng.choices(names, weights)[0]
+            target = ROUTES[name][1](fx, rng)
+            method, path, body = target if isinstance(target, tuple) else ("GET", target, None)
+            t0 = time.perf_counter()
+            try:
+                status, size = client.request(method, path, body)
+            except Exception:
+                status, size = 0, 0
+            elapsed = time.perf_counter() - t0
+            if measuring.is_set():
+                with lock:
+                    samples[name].append((elapsed, status, size))
+
+    sampler = RssSampler(args.pid or [], args.gunicorn_pid)
+    sampler.start()
+    threads = [threading.Thread(target=loop, args=(c, args.seed + i), daemon=True)
+               for i, c in enumerate(clients)]
+    for t in threads:
+        t.start()
+    time.sleep(args.warmup)
+    measuring.set()
+    started = time.monotonic()
+    for t in threads:
+        t.join()
+    wall = time.monotonic() - started
+    sampler.stop_event.set()
+
+    report = {"duration_s": round(wall, 2), "concurrency": args.concurrency, "routes": {}}
+    total = 0
+    header = f"{'route':<24}{'count':>8}{'err':>6}{'req/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'max ms':>9}{'KB/req':>9}"
+    print("\n" + header + "\n" + "-" * len(header))
+    for name in names:
+        rows = samples[name]
+        if not rows:
+            continue
+        lat = sorted(r[0] * 1000 for r in rows)
+        errors = sum(1 for r in rows if r[1] == 0 or r[1] >= 400)
+        stats = {
+            "count": len(rows), "errors": errors, "rps": round(len(rows) / wall, 2),
+            "p50_ms": round(percentile(lat, 50), 2), "p95_ms": round(percentile(lat, 95), 2),
+            "p99_ms": round(percentile(lat, 99), 2), "max_ms": round(lat[-1], 2),
+            "avg_kb": round(sum(r[2] for r in rows) / len(rows) / 1024, 1),
+        }
+        report["routes"][name] = stats
+        total += len(rows)
+        print(f"{name:<24}{stats['count']:>8}{errors:>6}{stats['rps']:>9}{stats['p50_ms']:>9}"
+              f"{stats['p95_ms']:>9}{stats['p99_ms']:>9}{stats['max_ms']:>9}{stats['avg_kb']:>9}")
+    report["throughput_rps"] = round(total / wall, 2)
+    print(f"\nThroughput: {report['throughput_rps']} req/s over {wall:.1f}s")
+
+    if sampler.peak:
+        report["rss_kb"] = {str(pid): {"peak": sampler.peak[pid], "last": sampler.last[pid]}
+                            for pid in sorted(sampler.peak)}
+        for pid in sorted(sampler.peak):
+            print(f"RSS pid {pid}: peak {sampler.peak[pid] / 1024:.1f} MB, last {sampler.last[pid] / 1024:.1f} MB")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Report written to {args.json}")
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--base-url", default="http://127.0.0.1:10000")
+    parser.add_argument("--user", default=os.environ.get("LOGIN_USER", "admin"))
+    parser.add_argument("--password", default=os.environ.get("LOGIN_PASSWORD", ""))
+    parser.add_argument("--duration", type=float, default=30.0, help="measured seconds")
+    parser.add_argument("--warmup", type=float, default=5.0, help="unmeasured seconds before measuring")
+    parser.add_argument("--concurrency", type=int, default=8, help="parallel client sessions")
+    parser.add_argument("--routes", default="", help=f"comma-separated subset of: {', '.join(ROUTES)}")
+    parser.add_argument("--accept-encoding", default="gzip, br", help="Accept-Encoding sent by clients")
+    parser.add_argument("--gunicorn-pid", type=int, default=None, help="gunicorn master pid; samples its workers' RSS")
+    parser.add_argument("--pid", type=int, action="append", help="extra pid(s) whose RSS to sample")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", default=None, help="write the report as JSON to this path")
+    run(parser.parse_args(argv))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,32 @@
+-- Benchmark schema: the subset of the camera pipeline's tables that app.py reads.
+-- Only for local benchmark databases created by bench/generate_dataset.py;
+-- production tables are owned by the ingestion pipeline.
+
+CREATE TABLE IF NOT EXISTS detection_events (
+    id                uuid PRIMARY KEY,
+    camera_plate_text text,
+    camera_confidence double precision,
+    vehicle_brand     text,
+    vehicle_color     text,
+    vehicle_type      text,
+    created_at        timestamptz NOT NULL DEFAULT now()
+);
+
+CREATE TABLE IF NOT EXISTS event_images (
+    id         uuid PRIMARY KEY,
+    event_id   uuid NOT NULL REFERENCES detection_events (id),
+    image_type text NOT NULL,
+    file_name  text,
+    image_data bytea,
+    created_at timestamptz NOT NULL DEFAULT now()
+);
+
+CREATE INDEX IF NOT EXISTS detection_events_created_at_idx ON detection_events (created_at DESC);
+CREATE INDEX IF NOT EXISTS detection_events_plate_idx ON detection_events (camera_plate_text);
+CREATE INDEX IF NOT EXISTS detection_events_plate_key_idx
+    ON detection_events ((upper(regexp_replace(camera_plate_text, '[^[:alnum:]]', '', 'g'))), created_at DESC);
+CREATE INDEX IF NOT EXISTS detection_events_vehicle_brand_idx ON detection_events (vehicle_brand);
+CREATE INDEX IF NOT EXISTS detection_events_vehicle_color_idx ON detection_events (vehicle_color);
+CREATE INDEX IF NOT EXISTS detection_events_vehicle_type_idx ON detection_events (vehicle_type);
+CREATE INDEX IF NOT EXISTS event_images_event_id_idx ON event_images (event_id);
+CREATE INDEX IF NOT EXISTS event_images_type_created_idx ON event_images (image_type, created_at DESC, id DESC);
@@ -0,0 +1,162 @@
+"""
+Content-addressed storage for image blobs moved out of event_images.image_data.
+
+A blob is stored under its SHA-256 (hex) and event_images.image_sha256 keeps
+the reference, so identical images are stored once and a stored blob never
+changes. Backends:
+
+  - LocalBlobStore: files under BLOB_STORE_DIR/ab/cd/<sha256>. Exposes the file
+    path so browse_image can answer with sendfile() instead of copying bytes
+    through Python.
+  - S3BlobStore: any S3-compatible object store (AWS, MinIO, ...) through
+    boto3, which is only needed when this backend is selected. Point
+    BLOB_S3_ENDPOINT_URL at a local MinIO to try it without AWS.
+
+BLOB_STORE selects the backend: "" (default, images stay in Postgres),
+"local" or "s3". Apply migrations/002_event_images_blob_sha256.sql before
+enabling it; migrate_blobs.py moves existing rows.
+"""
+import abc
+import hashlib
+import logging
+import os
+import tempfile
+
+logger = logging.getLogger(__name__)
+
+BLOB_STORE = os.environ.get("BLOB_STORE", "").lower()
+BLOB_STORE_DIR = os.environ.get("BLOB_STORE_DIR", "blobs")
+BLOB_S3_BUCKET = os.environ.get("BLOB_S3_BUCKET", "")
+BLOB_S3_PREFIX = os.environ.get("BLOB_S3_PREFIX", "images/")
+BLOB_S3_ENDPOINT_URL = os.environ.get("BLOB_S3_ENDPOINT_URL") or None
+
+
+class BlobStoreError(Exception):
+    """Raised when the blob backend cannot read or write a blob."""
+
+
+def digest(data):
+    """Content address of `data`."""
+    return hashlib.sha256(data).hexdigest()
+
+
+def _shard(sha256):
+    return f"{sha256[:2]}/{sha256[2:4]}/{sha256}"
+
+
+class BlobStore(abc.ABC):
+    """Interface shared by the backends. Blobs are immutable once stored."""
+
+    # True when path() returns files (the OS page cache already keeps hot blobs)
+    has_paths = False
+
+    @abc.abstractmethod
+    def put(self, data):
+        """Store `data` (idempotent) and return its sha256."""
+
+    @abc.abstractmethod
+    def get(self, sha256):
+        """Blob bytes, or None if it is not stored."""
+
+    def path(self, sha256):
+        """Local file path for zero-copy serving, or None if the backend has none."""
+        return None
+
+
+class LocalBlobStore(BlobStore):
+    has_paths = True
+
+    def __init__(self, root):
+        self.root = os.path.abspath(root)
+
+    def _file(self, sha256):
+        return os.path.join(self.root, *_shard(sha256).split("/"))
+
+    def put(self, data):
+        sha256 = digest(data)
+        target = self._file(sha256)
+        if os.path.exists(target):
+            return sha256
+        directory = os.path.dirname(target)
+        try:
+            os.makedirs(directory, exist_ok=True)
+            # Write-then-rename so readers never see a partial file
+            fd, tmp = tempfile.mkstemp(dir=directory, prefix=".tmp-")
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    f.write(data)
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(tmp, target)
+            except BaseException:
+                os.unlink(tmp)
+                raise
+        except OSError as e:
+            raise BlobStoreError(f"Could not write blob {sha256}: {e}") from e
+        return sha256
+
+    def get(self, sha256):
+        try:
+            with open(self._file(sha256), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+        except OSError as e:
+            raise BlobStoreError(f"Could not read blob {sha256}: {e}") from e
+
+    def path(self, sha256):
+        target = self._file(sha256)
+        return target if os.path.exists(target) else None
+
+
+class S3BlobStore(BlobStore):
+    def __init__(self, bucket, prefix="", endpoint_url=None, client=None):
+        if client is None:
+            try:
+                import boto3
+            except ImportError as e:
+                raise RuntimeError("BLOB_STORE=s3 requires the boto3 package") from e
+            client = boto3.client("s3", endpoint_url=endpoint_url)
+        self.client = client
+        self.bucket = bucket
+        self.prefix = prefix
+
+    def _key(self, sha256):
+        return self.prefix + _shard(sha256)
+
+    def put(self, data):
+        sha256 = digest(data)
+        try:
+            # No ContentType: blobs are not always JPEG, and they are only read back
+            # through the app, which sniffs the type when it serves them
+            self.client.put_object(Bucket=self.bucket, Key=self._key(sha256), Body=data)
+        except Exception as e:
+            raise BlobStoreError(f"Could not write blob {sha256}: {e}") from e
+        return sha256
+
+    def get(self, sha256):
+        try:
+            response = self.client.get_object(Bucket=self.bucket, Key=self._key(sha256))
+            return response["Body"].read()
+        except Exception as e:
+            if getattr(e, "response", {}).get("Error", {}).get("Code") in ("NoSuchKey", "404"):
+                return None
+            raise BlobStoreError(f"Could not read blob {sha256}: {e}") from e
+
+
+def from_env():
+    """The backend selected by BLOB_STORE, or None when blobs stay in Postgres."""
+    if not BLOB_STORE:
+        return None
+    if BLOB_STORE == "local":
+        return LocalBlobStore(BLOB_STORE_DIR)
+    if BLOB_STORE == "s3":
+        if not BLOB_S3_BUCKET:
+            raise RuntimeError("BLOB_STORE=s3 requires BLOB_S3_BUCKET")
+        return S3BlobStore(BLOB_S3_BUCKET, BLOB_S3_PREFIX, BLOB_S3_ENDPOINT_URL)
+    raise RuntimeError(f"Unknown BLOB_STORE {BLOB_STORE!r} (expected local or s3)")
+
+
+store = from_env()
+if store is not None:
+    logger.info("Image blobs stored in %s", type(store).__name__)
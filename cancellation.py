@@ -0,0 +1,221 @@
+"""
+Cancel the running query of a request whose client has gone away.
+
+When the UI aborts a fetch (a new table page or carousel window supersedes
+the previous one) the browser closes its connection, but the worker thread
+stays blocked in the query until Postgres finishes it, holding the pool
+connection and the backend. While a request runs a query, its client socket
+is registered with a watcher thread that polls every CANCEL_POLL_MS; once the
+socket reads EOF, the query is cancelled (psycopg2 connection.cancel(), which
+sends a cancel request on a separate connection). The view then fails with
+DBError like on any other database error and the connection goes back to the
+pool straight away.
+
+The client socket is the one gunicorn (or the Werkzeug dev server) exposes in
+the WSGI environ. Behind a proxy it is the proxy's upstream connection, so
+the proxy must close it when its client aborts (nginx does by default,
+proxy_ignore_client_abort off). CANCEL_ON_DISCONNECT=false disables it.
+
+When the request has no socket registered, watch() costs one thread-local
+lookup.
+"""
+import contextlib
+import logging
+import os
+import select
+import socket
+import threading
+
+import psycopg2
+from flask import request
+
+logger = logging.getLogger(__name__)
+
+CANCEL_ON_DISCONNECT = os.environ.get("CANCEL_ON_DISCONNECT", "true").lower() in {"true", "1", "yes", "on"}
+CANCEL_POLL_MS = float(os.environ.get("CANCEL_POLL_MS", "100"))
+
+_WSGI_SOCKET_KEYS = ("gunicorn.socket", "werkzeug.socket")
+
+_local = threading.local()
+
+
+class _NoopWatch:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NOOP = _NoopWatch()
+
+
+class _Watch:
+    __slots__ = ("watcher", "sock", "conn", "token")
+
+    def __init__(self, watcher, sock, conn):
+        self.watcher = watcher
+        self.sock = sock
+        self.conn = conn
+
+    def __enter__(self):
+        self.token = self.watcher.add(self.sock, self.conn)
+        return self
+
+    def __exit__(self, *exc):
+        self.watcher.remove(self.token)
+        return False
+
+
+class DisconnectWatcher(threading.Thread):
+    """Polls the client sockets of requests running a query and cancels the query on EOF."""
+
+    def __init__(self, interval):
+        super().__init__(daemon=True, name="disconnect-watcher")
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        # token -> (socket, connection)
+        self._watched = {}
+        self._next_token = 0
+        self.cancelled = 0
+
+    def add(self, sock, conn):
+        with self._lock:
+            self._next_token += 1
+            token = self._next_token
+            self._watched[token] = (sock, conn)
+        self._wake.set()
+        return token
+
+    def remove(self, token):
+        with self._lock:
+            self._watched.pop(token, None)
+
+    def run(self):
+        while True:
+            with self._lock:
+                watched = dict(self._watched)
+            if not watched:
+                self._wake.wait()
+                self._wake.clear()
+                continue
+            poller = select.poll()
+            by_fd = {}
+            unusable = []
+            for token, (sock, conn) in watched.items():
+                try:
+                    fd = sock.fileno()
+                except OSError:
+                    fd = -1
+                if fd < 0:
+                    # Closed or detached socket: nothing left to poll
+                    unusable.append(token)
+                    continue
+                by_fd.setdefault(fd, []).append((token, sock, conn))
+                poller.register(fd, select.POLLIN | select.POLLHUP | select.POLLERR)
+            if unusable:
+                with self._lock:
+                    for token in unusable:
+                        self._watched.pop(token, None)
+            if not by_fd:
+                # poll() on nothing returns at once: don't spin until new sockets arrive
+                self._wake.wait(self.interval)
+                self._wake.clear()
+                continue
+            events = poller.poll(self.interval * 1000)
+            for fd, _event in events:
+                for token, sock, conn in by_fd.get(fd, ()):
+                    self._check(token, sock, conn)
+            if events:
+                # Sockets with unread request data stay readable: don't spin on them
+                self._wake.wait(self.interval)
+                self._wake.clear()
+
+    def _check(self, token, sock, conn):
+        try:
+            closed = sock.recv(1, socket.MSG_PEEK | socket.MSG_DONTWAIT) == b""
+        except (BlockingIOError, InterruptedError):
+            return
+        except ConnectionError:
+            closed = True
+        except (OSError, ValueError):
+            # e.g. a TLS socket, which cannot be peeked
+            return
+        if not closed:
+            return
+        # Cancel under the lock: remove() waits for it, so the connection cannot be
+        # back in the pool running another request's query when the cancel lands
+        with self._lock:
+            if self._watched.pop(token, None) is None:
+                return
+            self.cancelled += 1
+            logger.info("Client disconnected, cancelling its query")
+            try:
+                conn.cancel()
+            except psycopg2.Error as e:
+                logger.warning("Query cancellation failed: %s", e)
+
+
+_watcher = None
+_watcher_lock = threading.Lock()
+
+
+def _get_watcher():
+    global _watcher
+    if _watcher is None or not _watcher.is_alive():
+        with _watcher_lock:
+            # Started lazily, so each forked gunicorn worker gets its own thread
+            if _watcher is None or not _watcher.is_alive():
+                _watcher = DisconnectWatcher(CANCEL_POLL_MS / 1000.0)
+                _watcher.start()
+    return _watcher
+
+
+def watch(conn):
+    """Context manager cancelling `conn`'s running query if the current request's client disconnects."""
+    sock = getattr(_local, "socket", None)
+    if sock is None:
+        return _NOOP
+    return _Watch(_get_watcher(), sock, conn)
+
+
+def client_socket():
+    """The current request's client socket, to hand to bind_client() in another thread."""
+    return getattr(_local, "socket", None)
+
+
+@contextlib.contextmanager
+def bind_client(sock):
+    """Make watch() in this thread follow `sock`, e.g. for queries a request fans out to a thread pool."""
+    previous = getattr(_local, "socket", None)
+    _local.socket = sock
+    try:
+        yield
+    finally:
+        _local.socket = previous
+
+
+def metrics():
+    """Queries cancelled in this worker because their client disconnected."""
+    return {"cancelled": _watcher.cancelled if _watcher is not None else 0}
+
+
+def init_app(app):
+    """Expose each request's client socket to watch() for the duration of the request."""
+    if not CANCEL_ON_DISCONNECT:
+        return
+
+    @app.before_request
+    def track_client():
+        for key in _WSGI_SOCKET_KEYS:
+            sock = request.environ.get(key)
+            if sock is not None:
+                _local.socket = sock
+                break
+
+    @app.teardown_request
+    def untrack_client(exc):
+        _local.socket = None
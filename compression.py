@@ -0,0 +1,172 @@
+"""
+HTTP response compression and fingerprinted, precompressed static assets.
+
+Dynamic responses (JSON listings, HTML) are compressed in an after_request hook
+when the client advertises support and the body is above COMPRESS_MIN_SIZE.
+Image payloads are never touched: JPEG is already compressed and re-encoding it
+only burns CPU.
+
+Files under static/ are read, hashed and compressed once at startup. Templates
+keep calling url_for('static', filename=...) and get a `?v=<digest>` query
+string appended automatically; requests carrying the current digest are served
+with an immutable one-year Cache-Control, anything else revalidates by ETag.
+"""
+import gzip
+import hashlib
+import logging
+import mimetypes
+import os
+
+from flask import Response, request
+
+import profiling
+
+try:
+    import brotli
+except ImportError:  # Brotli is optional: fall back to gzip-only
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+COMPRESS_MIN_SIZE = int(os.environ.get("COMPRESS_MIN_SIZE", "1024"))
+COMPRESS_GZIP_LEVEL = int(os.environ.get("COMPRESS_GZIP_LEVEL", "6"))
+COMPRESS_BROTLI_QUALITY = int(os.environ.get("COMPRESS_BROTLI_QUALITY", "5"))
+
+# Static files larger than this are left to Flask's regular send_static_file
+_STATIC_MAX_BYTES = 2 * 1024 * 1024
+_STATIC_IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+
+_COMPRESSIBLE_MIMETYPES = {
+    "application/json",
+    "application/javascript",
+    "text/javascript",
+    "text/html",
+    "text/css",
+    "text/plain",
+    "text/csv",
+    "image/svg+xml",
+}
+
+# filename (relative to static folder, forward slashes) -> _StaticAsset
+_assets = {}
+
+
+def _encodings():
+    """Content-codings we can produce, in server preference order."""
+    return ["br", "gzip"] if brotli is not None else ["gzip"]
+
+
+def _negotiate(available):
+    """Pick the best encoding from `available` that the client accepts, or None for identity."""
+    offered = [enc for enc in _encodings() if enc in available]
+    if not offered:
+        return None
+    return request.accept_encodings.best_match(offered)
+
+
+def _compress(data, encoding, static=False):
+    if encoding == "br":
+        quality = 11 if static else COMPRESS_BROTLI_QUALITY
+        return brotli.compress(data, quality=quality)
+    level = 9 if static else COMPRESS_GZIP_LEVEL
+    return gzip.compress(data, compresslevel=level, mtime=0)
+
+
+class _StaticAsset:
+    """One static file held in memory with its precompressed variants."""
+
+    __slots__ = ("filename", "mimetype", "digest", "variants")
+
+    def __init__(self, filename, raw):
+        self.filename = filename
+        self.mimetype = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+        self.digest = hashlib.sha256(raw).hexdigest()[:12]
+        self.variants = {None: raw}
+        if self.mimetype in _COMPRESSIBLE_MIMETYPES and len(raw) >= COMPRESS_MIN_SIZE:
+            for enc in _encodings():
+                packed = _compress(raw, enc, static=True)
+                if len(packed) < len(raw):
+                    self.variants[enc] = packed
+
+
+def _load_static_assets(static_folder):
+    assets = {}
+    if not static_folder or not os.path.isdir(static_folder):
+        return assets
+    for root, _dirs, files in os.walk(static_folder):
+        for name in files:
+            path = os.path.join(root, name)
+            if os.path.getsize(path) > _STATIC_MAX_BYTES:
+                continue
+            rel = os.path.relpath(path, static_folder).replace(os.sep, "/")
+            with open(path, "rb") as f:
+                assets[rel] = _StaticAsset(rel, f.read())
+    return assets
+
+
+def init_app(app):
+    """Install response compression and the fingerprinted static file handler on `app`."""
+    _assets.clear()
+    _assets.update(_load_static_assets(app.static_folder))
+    logger.info(
+        "Precompressed %d static assets (encodings: %s)",
+        len(_assets), ", ".join(_encodings()),
+    )
+
+    fallback_static = app.view_functions.get("static")
+
+    def serve_static(filename):
+        """Serve a static file from memory, precompressed and cacheable by digest."""
+        asset = _assets.get(filename)
+        if asset is None:
+            return fallback_static(filename=filename)
+        encoding = _negotiate(asset.variants)
+        response = Response(asset.variants[encoding], mimetype=asset.mimetype)
+        if encoding:
+            response.headers["Content-Encoding"] = encoding
+        response.vary.add("Accept-Encoding")
+        response.set_etag(f"{asset.digest}-{encoding or 'identity'}")
+        if request.args.get("v") == asset.digest:
+            response.cache_control.public = True
+            response.cache_control.max_age = _STATIC_IMMUTABLE_MAX_AGE
+            response.cache_control.immutable = True
+        else:
+            response.cache_control.no_cache = True
+        return response.make_conditional(request)
+
+    if fallback_static is not None:
+        app.view_functions["static"] = serve_static
+
+    @app.url_defaults
+    def fingerprint_static_urls(endpoint, values):
+        if endpoint != "static":
+            return
+        asset = _assets.get(values.get("filename"))
+        if asset is not None:
+            values.setdefault("v", asset.digest)
+
+    @app.after_request
+    def compress_response(response):
+        if request.endpoint == "static":
+            return response
+        if response.direct_passthrough or response.is_streamed:
+            return response
+        if response.status_code < 200 or response.status_code in (204, 206, 304):
+            return response
+        if "Content-Encoding" in response.headers:
+            return response
+        if response.mimetype not in _COMPRESSIBLE_MIMETYPES:
+            return response
+
+        response.vary.add("Accept-Encoding")
+        data = response.get_data()
+        if len(data) < COMPRESS_MIN_SIZE:
+            return response
+        encoding = _negotiate(_encodings())
+        if encoding is None:
+            return response
+
+        with profiling.span("compress"):
+            response.set_data(_compress(data, encoding))
+        response.headers["Content-Encoding"] = encoding
+        return response
@@ -0,0 +1,82 @@
+"""
+Everything the index page needs on load, fetched concurrently.
+
+The page used to open with four requests (/api/all_patents, /api/stats, the
+thumbnail strip and /api/filter_options), each one counted by the rate
+limiter and queued by load shedding, and the strip and the dropdowns only
+sent once the table's requests were out. GET /api/dashboard runs the same
+db_utils functions in one request instead: the listing on the request thread
+and the other three on a small per-worker thread pool, each on its own pooled
+connection, so the response takes about as long as the slowest of them.
+
+The pool has DASHBOARD_FANOUT_THREADS threads shared by all requests of the
+worker, which bounds the extra connections fan-out can take: at most that
+many on top of the request threads' own (keep it plus WEB_THREADS within
+DB_POOL_MAX). Its threads follow the request's client socket, so a
+disconnect cancels their queries too (cancellation.py).
+"""
+import concurrent.futures
+import logging
+import os
+import threading
+
+import cancellation
+import db_utils
+from db_utils import DBError
+
+logger = logging.getLogger(__name__)
+
+DASHBOARD_FANOUT_THREADS = int(os.environ.get("DASHBOARD_FANOUT_THREADS", "4"))
+
+_executor = None
+_executor_pid = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor():
+    """This process's thread pool, created on first use (threads do not survive a fork)."""
+    global _executor, _executor_pid
+    if _executor_pid != os.getpid():
+        with _executor_lock:
+            if _executor_pid != os.getpid():
+                _executor = concurrent.futures.ThreadPoolExecutor(
+                    max_workers=DASHBOARD_FANOUT_THREADS, thread_name_prefix="dashboard")
+                _executor_pid = os.getpid()
+    return _executor
+
+
+def _call(sock, fn, kwargs):
+    with cancellation.bind_client(sock):
+        return fn(**kwargs)
+
+
+def bootstrap(listing, stats, thumbnails_limit):
+    """
+    Run the page-load queries concurrently: fetch_all_patents_paginated(**listing),
+    fetch_stats(**stats), fetch_recent_thumbnails(thumbnails_limit) and
+    fetch_filter_options(). Returns ({section: result}, [failed sections]);
+    sections are "patents", "stats", "thumbnails" and "filter_options".
+    """
+    calls = {
+        "stats": (db_utils.fetch_stats, stats),
+        "thumbnails": (db_utils.fetch_recent_thumbnails, {"limit": thumbnails_limit}),
+        "filter_options": (db_utils.fetch_filter_options, {}),
+    }
+    sock = cancellation.client_socket()
+    executor = _get_executor()
+    futures = {name: executor.submit(_call, sock, fn, kwargs) for name, (fn, kwargs) in calls.items()}
+
+    results, failed = {}, []
+    # The listing is usually the slowest query: run it here rather than queue it
+    try:
+        results["patents"] = db_utils.fetch_all_patents_paginated(**listing)
+    except (DBError, RuntimeError) as e:
+        logger.warning("Dashboard section patents failed: %s", e)
+        failed.append("patents")
+    for name, future in futures.items():
+        try:
+            results[name] = future.result()
+        except (DBError, RuntimeError) as e:
+            logger.warning("Dashboard section %s failed: %s", name, e)
+            failed.append(name)
+    return results, failed
@@ -1,10 +1,22 @@
 import logging
 import psycopg2
+import psycopg2.errors
+import psycopg2.extensions
+import psycopg2.extras
 import psycopg2.pool
 import base64
+import collections
+import contextlib
 import os
 import datetime
+import functools
+import threading
 import time
+import blob_store
+import cancellation
+import image_cache
+import profiling
+from json_provider import record_type
 logger = logging.getLogger(__name__)
 
 # Mapeo para normalizar marcas de vehículos
@@ -14,23 +26,103 @@ VEHICLE_BRAND_NORMALIZATION_MAP = {
     "Renau": "Renault",
 }
 
-# Reverse map: normalized_brand -> [raw DB variants that normalize to it]
-_BRAND_RAW_VARIANTS: dict = {}
-for _raw_brand, _norm_brand in VEHICLE_BRAND_NORMALIZATION_MAP.items():
-    _BRAND_RAW_VARIANTS.setdefault(_norm_brand, []).append(_raw_brand)
+# Canonical brand/color/type lookups. Aliases are loaded from the
+# vehicle_dimension_aliases table (migrations/001_vehicle_dimension_aliases.sql)
+# by fetch_filter_options(); VEHICLE_BRAND_NORMALIZATION_MAP is the fallback
+# until then, or when the table does not exist.
+_DIMENSION_COLUMNS = {'brand': 'vehicle_brand', 'color': 'vehicle_color', 'type': 'vehicle_type'}
+# dimension -> {casefolded raw value: canonical value}
+_alias_lookup = {
+    'brand': {raw.casefold(): canonical for raw, canonical in VEHICLE_BRAND_NORMALIZATION_MAP.items()},
+    'color': {},
+    'type': {},
+}
+# dimension -> {canonical value: set of raw spellings observed in detection_events}
+_raw_variants = {'brand': {}, 'color': {}, 'type': {}}
+# Raw spellings as written (= ANY() is case-sensitive) for filters until
+# fetch_filter_options() has filled _raw_variants
+_fallback_variants = {'brand': {}, 'color': {}, 'type': {}}
+for _raw, _canonical in VEHICLE_BRAND_NORMALIZATION_MAP.items():
+    _fallback_variants['brand'].setdefault(_canonical, set()).add(_raw)
+del _raw, _canonical
+
+
+def canonicalize(dimension, value):
+    """Map a raw brand/color/type string to its canonical form with one dict lookup."""
+    if value is None:
+        return None
+    stripped = value.strip()
+    canonical = _alias_lookup[dimension].get(stripped.casefold())
+    if canonical is not None:
+        return canonical
+    # Unknown brands are title-cased like before; colors and types are kept as written
+    return stripped.capitalize() if dimension == 'brand' else stripped
+
 
 def normalize_vehicle_brand(brand):
-    """Normaliza una cadena de marca de vehículo usando un mapeo predefinido."""
+    """Normaliza una cadena de marca de vehículo usando la tabla de alias (búsqueda O(1))."""
     if brand is None:
         return None
-    # Convertir a minúsculas para una comparación insensible a mayúsculas/minúsculas antes de buscar en el mapa
-    # y luego aplicar la corrección si existe, de lo contrario, devolver la marca original con la primera letra en mayúscula
-    normalized_brand_lower = brand.lower()
-    for incorrect, correct in VEHICLE_BRAND_NORMALIZATION_MAP.items():
-        if normalized_brand_lower == incorrect.lower():
-            return correct
-    # Si no se encuentra en el mapa, intentar capitalizar la primera letra (esto es un guess, podría no ser lo mejor)
-    return brand.capitalize()
+    with profiling.span("brand"):
+        return canonicalize('brand', brand)
+
+
+def _expand_filter(dimension, values):
+    """Canonical filter values -> every raw spelling that canonicalizes to them."""
+    expanded = set()
+    variants = _raw_variants[dimension] or _fallback_variants[dimension]
+    for v in values:
+        expanded.add(v)
+        expanded.update(variants.get(v, ()))
+    return sorted(expanded)
+
+
+def _dimension_conditions(conditions, params, brand_filter=None, color_filter=None,
+                          type_filter=None, prefix=""):
+    """Append brand/color/type filter predicates, one `= ANY(array)` per dimension."""
+    for dimension, values in (('brand', brand_filter), ('color', color_filter), ('type', type_filter)):
+        if values:
+            conditions.append(f"{prefix}{_DIMENSION_COLUMNS[dimension]} = ANY(%s)")
+            params.append(_expand_filter(dimension, values))
+
+
+def _b64(data):
+    """Base64-encode image bytes for JSON payloads (timed as 'b64' when profiling)."""
+    with profiling.span("b64"):
+        return base64.b64encode(data).decode('utf-8')
+
+
+def _fetch_records(cur, extra=()):
+    """
+    cur.fetchall() as record objects (json_provider.record_type) with one attribute
+    per result column, plus the `extra` attributes initialized to None.
+    """
+    row_type = record_type(tuple(desc[0] for desc in cur.description) + tuple(extra))
+    if extra:
+        pad = (None,) * len(extra)
+        return [row_type(*row, *pad) for row in cur.fetchall()]
+    return [row_type(*row) for row in cur.fetchall()]
+
+
+# With a blob store, migrated rows have image_data NULL and the blob under image_sha256
+_IMAGE_DATA_COLUMNS = "ei.image_data, ei.image_sha256" if blob_store.store else "ei.image_data"
+
+
+def _load_blob(image_data, sha256=None):
+    """Image bytes from the bytea column or, for migrated rows, from the blob store."""
+    if image_data is not None:
+        return image_data
+    if sha256 and blob_store.store is not None:
+        with profiling.span("blob"):
+            return blob_store.store.get(sha256)
+    return None
+
+
+def _encode_images(records):
+    """Replace image_data on listing records with its base64 form, loading migrated blobs."""
+    for rec in records:
+        data = _load_blob(rec.image_data, getattr(rec, 'image_sha256', None))
+        rec.image_data = _b64(data) if data else None
 
 
 class DBError(Exception):
@@ -53,35 +145,454 @@ DB_NAME = os.environ["DB_NAME"]
 DB_USER = os.environ["DB_USER"]
 DB_PASSWORD = os.environ["DB_PASSWORD"]
 
-# NOTE: `_pool` must remain a bare module-level name.
-# gunicorn.conf.py's post_fork hook rebinds it via `db_utils._pool = ...`
-# after forking each worker. Never cache `_pool` in a local or class variable.
-_pool = psycopg2.pool.ThreadedConnectionPool(
-    minconn=int(os.environ.get("DB_POOL_MIN", "2")),
-    maxconn=int(os.environ.get("DB_POOL_MAX", "10")),
-    host=DB_HOST, database=DB_NAME, user=DB_USER, password=DB_PASSWORD,
-    connect_timeout=10,
-    options="-c statement_timeout=30000",  # 30 000 ms = 30 s
-    keepalives=1,
-    keepalives_idle=30,
-    keepalives_interval=5,
-    keepalives_count=5,
+# Optional streaming replica for read-only dashboard queries.
+# Leave DB_REPLICA_HOST unset to send every query to the primary.
+DB_REPLICA_HOST = os.environ.get("DB_REPLICA_HOST", "")
+DB_REPLICA_NAME = os.environ.get("DB_REPLICA_NAME", DB_NAME)
+DB_REPLICA_USER = os.environ.get("DB_REPLICA_USER", DB_USER)
+DB_REPLICA_PASSWORD = os.environ.get("DB_REPLICA_PASSWORD", DB_PASSWORD)
+# Reads go to the primary while replay lag exceeds this many seconds
+DB_REPLICA_MAX_LAG = float(os.environ.get("DB_REPLICA_MAX_LAG_SECONDS", "30"))
+# After a replica connection failure, wait this long before trying it again
+DB_REPLICA_RETRY = float(os.environ.get("DB_REPLICA_RETRY_SECONDS", "30"))
+_REPLICA_LAG_CHECK_INTERVAL = 5.0
+
+# event_images rows are written moments after their detection_events row, so a
+# range on de.created_at is mirrored onto ei.created_at (widened by this slack)
+# to let Postgres prune event_images partitions too. 0 disables the mirroring.
+PARTITION_PRUNE_SLACK = datetime.timedelta(
+    seconds=int(os.environ.get("PARTITION_PRUNE_SLACK_SECONDS", "86400"))
 )
 
+# Page-load queries every client repeats are served from a per-worker cache for
+# this long (seconds, 0 disables); warmup.py fills them before a worker takes traffic
+FILTER_OPTIONS_CACHE_SECONDS = float(os.environ.get("FILTER_OPTIONS_CACHE_SECONDS", "300"))
+STATS_CACHE_SECONDS = float(os.environ.get("STATS_CACHE_SECONDS", "30"))
+RECENT_THUMBNAILS_CACHE_SECONDS = float(os.environ.get("RECENT_THUMBNAILS_CACHE_SECONDS", "10"))
+# Collapsed listings (collapse=1) merge sightings of the same plate into one
+# "passage" while consecutive sightings are at most this many seconds apart
+DEDUP_WINDOW_SECONDS = int(os.environ.get("DEDUP_WINDOW_SECONDS", "60"))
+DEDUP_MAX_WINDOW_SECONDS = 3600
+# Collapsed listings stop counting passages here (each one costs an index probe);
+# total_registros is then this cap and later passages are reached by filtering
+DEDUP_COUNT_LIMIT = int(os.environ.get("DEDUP_COUNT_LIMIT", "10000"))
+PLATE_PROFILE_CACHE_SECONDS = float(os.environ.get("PLATE_PROFILE_CACHE_SECONDS", "60"))
+PLATE_PROFILE_CACHE_ENTRIES = int(os.environ.get("PLATE_PROFILE_CACHE_ENTRIES", "512"))
+# Local memory-mapped snapshot of detection metadata (snapshot.py) answering
+# plate and time-range lookups when Postgres is slow or unreachable
+PLATE_SNAPSHOT_PATH = os.environ.get("PLATE_SNAPSHOT_PATH", "")
+_SNAPSHOT_CHECK_SECONDS = 5.0
+# In-process columnar copy of the detection metadata (analytics.py), set once it
+# is loaded; stats, listing counts and filter options are answered from it
+columnar_cache = None
+
+
+def _ttl_cached(seconds, max_entries=64):
+    """
+    Cache the decorated function's results per (hashable) arguments for `seconds`,
+    keeping at most `max_entries` argument sets (least recently used dropped first).
+    """
+    def decorator(fn):
+        entries = collections.OrderedDict()
+        lock = threading.Lock()
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if seconds <= 0:
+                return fn(*args, **kwargs)
+            key = (args, tuple(sorted(kwargs.items())))
+            with lock:
+                hit = entries.get(key)
+                if hit is not None and time.monotonic() - hit[0] < seconds:
+                    entries.move_to_end(key)
+                    return hit[1]
+            value = fn(*args, **kwargs)
+            with lock:
+                entries[key] = (time.monotonic(), value)
+                entries.move_to_end(key)
+                while len(entries) > max_entries:
+                    entries.popitem(last=False)
+            return value
+        return wrapper
+    return decorator
+
+
+# statement_timeout of pool connections; queries run through the functions below
+# get the tighter budget of their class instead
+DB_STATEMENT_TIMEOUT_MS = int(os.environ.get("DB_STATEMENT_TIMEOUT_MS", "30000"))
+STATEMENT_TIMEOUTS = {
+    "listing": int(os.environ.get("DB_TIMEOUT_LISTING_MS", "2000")),
+    "count": int(os.environ.get("DB_TIMEOUT_COUNT_MS", "10000")),
+    "stats": int(os.environ.get("DB_TIMEOUT_STATS_MS", "10000")),
+    "image": int(os.environ.get("DB_TIMEOUT_IMAGE_MS", "5000")),
+}
+
+_budget = threading.local()
 
-def _get_conn():
-    """Check out a connection from the pool. Raises RuntimeError on pool exhaustion."""
+
+@contextlib.contextmanager
+def _statement_budget(query_class):
+    """
+    Run the queries of the block (or decorated function) under the statement
+    timeout of `query_class`. Nested budgets win; connections bound with
+    bound_connection() keep their own timeout.
+    """
+    previous = getattr(_budget, "ms", None)
+    _budget.ms = STATEMENT_TIMEOUTS[query_class]
     try:
-        return _pool.getconn()
+        yield
+    finally:
+        _budget.ms = previous
+
+
+class _TimedCursor(psycopg2.extensions.cursor):
+    """
+    Cursor whose execute() time is counted under the 'sql' span when the request is
+    profiled, that applies the current _statement_budget() and whose query is
+    cancelled if the request's client disconnects (cancellation.py).
+    """
+
+    def execute(self, query, vars=None):
+        timeout = getattr(_budget, "ms", None)
+        if (timeout is not None and isinstance(query, str) and self.name is None
+                and not self.connection.autocommit
+                and self.connection is not getattr(_bound, "conn", None)):
+            # Same round trip as the query; the setting ends with the transaction
+            query = f"SET LOCAL statement_timeout = {int(timeout)}; {query}"
+        with profiling.span("sql"), cancellation.watch(self.connection):
+            return super().execute(query, vars)
+
+
+def _make_pool(host, database, user, password):
+    """Build a ThreadedConnectionPool with the app's standard connection options."""
+    return psycopg2.pool.ThreadedConnectionPool(
+        minconn=int(os.environ.get("DB_POOL_MIN", "2")),
+        maxconn=int(os.environ.get("DB_POOL_MAX", "10")),
+        host=host, database=database, user=user, password=password,
+        connect_timeout=10,
+        options=f"-c statement_timeout={DB_STATEMENT_TIMEOUT_MS}",
+        cursor_factory=_TimedCursor,
+        keepalives=1,
+        keepalives_idle=30,
+        keepalives_interval=5,
+        keepalives_count=5,
+    )
+
+
+def _make_replica_pool():
+    """Build the replica pool, or return None if no replica is configured or it is unreachable."""
+    global _replica_down_until
+    if not DB_REPLICA_HOST:
+        return None
+    try:
+        return _make_pool(DB_REPLICA_HOST, DB_REPLICA_NAME, DB_REPLICA_USER, DB_REPLICA_PASSWORD)
+    except psycopg2.Error as e:
+        logger.warning("DB replica unavailable, reads will use the primary: %s", e)
+        _count("replica", "errors")
+        _replica_down_until = time.monotonic() + DB_REPLICA_RETRY
+        return None
+
+
+# Per-pool counters exposed through pool_metrics()
+_metrics_lock = threading.Lock()
+_pool_stats = {
+    "primary": {"checkouts": 0, "errors": 0},
+    "replica": {"checkouts": 0, "errors": 0, "fallbacks": 0, "lag_seconds": None},
+}
+_replica_down_until = 0.0
+_replica_lag_checked_at = 0.0
+_replica_lagging = False
+# id(conn) -> pool it was checked out from, so _put_conn returns it to the right one
+_conn_owner = {}
+
+def _count(pool_name, key, n=1):
+    with _metrics_lock:
+        _pool_stats[pool_name][key] += n
+
+
+def _checkout(pool, pool_name):
+    conn = pool.getconn()
+    with _metrics_lock:
+        _conn_owner[id(conn)] = pool
+        _pool_stats[pool_name]["checkouts"] += 1
+    return conn
+
+
+# The pools are created on first use, in the process that uses them: importing
+# db_utils opens no connection, and a forked gunicorn worker builds its own pools
+# instead of sharing the parent's sockets. Go through _primary_pool() /
+# _current_replica_pool() rather than reading these names directly.
+_pool = None
+_replica_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+# Pools inherited across a fork. Never closed (that would end the parent's
+# sessions) nor garbage collected (which closes them too)
+_inherited_pools = []
+
+
+def _check_pid():
+    """Forget pools created by a parent process. Call with _pool_lock held."""
+    global _pool, _replica_pool, _pool_pid
+    pid = os.getpid()
+    if _pool_pid == pid:
+        return
+    _inherited_pools.extend(p for p in (_pool, _replica_pool) if p is not None)
+    _pool = _replica_pool = None
+    with _metrics_lock:
+        _conn_owner.clear()
+    _pool_pid = pid
+
+
+def _primary_pool():
+    """This process's primary pool, created on first use."""
+    global _pool
+    if _pool is not None and _pool_pid == os.getpid():
+        return _pool
+    with _pool_lock:
+        _check_pid()
+        if _pool is None:
+            _pool = _make_pool(DB_HOST, DB_NAME, DB_USER, DB_PASSWORD)
+        return _pool
+
+
+def _current_replica_pool(create=False):
+    """
+    This process's replica pool, or None. With create=True it is built if it does
+    not exist yet, which stays None when no replica is configured or it is down.
+    """
+    global _replica_pool
+    if _pool_pid == os.getpid() and (_replica_pool is not None or not create):
+        return _replica_pool
+    with _pool_lock:
+        _check_pid()
+        # Checked again under the lock: only one thread builds the pool, and
+        # threads that queued behind a failed attempt do not retry it at once
+        if create and _replica_pool is None and time.monotonic() >= _replica_down_until:
+            _replica_pool = _make_replica_pool()
+        return _replica_pool
+
+
+def _replica_lag_ok(conn):
+    """
+    Re-measure replay lag at most every few seconds (on the connection just checked out).
+    Returns False when the replica is further behind than DB_REPLICA_MAX_LAG.
+    """
+    global _replica_lag_checked_at, _replica_lagging
+    now = time.monotonic()
+    with _metrics_lock:
+        due = now - _replica_lag_checked_at >= _REPLICA_LAG_CHECK_INTERVAL
+        if due:
+            _replica_lag_checked_at = now
+    if due:
+        cur = conn.cursor()
+        try:
+            cur.execute(
+                "SELECT CASE"
+                " WHEN NOT pg_is_in_recovery() THEN 0"
+                " WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0"
+                " ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)"
+                " END"
+            )
+            lag = float(cur.fetchone()[0])
+        finally:
+            cur.close()
+        conn.rollback()
+        _replica_lagging = lag > DB_REPLICA_MAX_LAG
+        with _metrics_lock:
+            _pool_stats["replica"]["lag_seconds"] = round(lag, 3)
+        if _replica_lagging:
+            logger.warning("DB replica lag %.1fs exceeds %.1fs; reading from primary", lag, DB_REPLICA_MAX_LAG)
+    return not _replica_lagging
+
+
+def _get_replica_conn():
+    """Check out a replica connection, or return None to make the caller use the primary."""
+    global _replica_down_until
+    if not DB_REPLICA_HOST or time.monotonic() < _replica_down_until:
+        return None
+    pool = _current_replica_pool(create=True)
+    if pool is None:
+        return None
+    conn = None
+    try:
+        conn = _checkout(pool, "replica")
+        if _replica_lag_ok(conn):
+            return conn
+        _put_conn(conn)
+        return None
+    except psycopg2.pool.PoolError:
+        # Replica pool busy: spill over to the primary rather than failing the request
+        return None
+    except psycopg2.Error as e:
+        logger.warning("DB replica failed, reads will use the primary for %.0fs: %s", DB_REPLICA_RETRY, e)
+        _count("replica", "errors")
+        _replica_down_until = time.monotonic() + DB_REPLICA_RETRY
+        if conn is not None:
+            _put_conn(conn, close=True)
+        return None
+
+
+def connect_direct(statement_timeout_ms=DB_STATEMENT_TIMEOUT_MS, autocommit=False):
+    """
+    A standalone connection to the primary, outside the pools, for long-lived or
+    long-running work (background jobs, maintenance scripts). 0 disables the timeout.
+    """
+    conn = psycopg2.connect(
+        host=DB_HOST, database=DB_NAME, user=DB_USER, password=DB_PASSWORD,
+        connect_timeout=10,
+        options=f"-c statement_timeout={int(statement_timeout_ms)}",
+        cursor_factory=_TimedCursor,
+        keepalives=1,
+        keepalives_idle=30,
+        keepalives_interval=5,
+        keepalives_count=5,
+    )
+    conn.autocommit = autocommit
+    return conn
+
+
+# Connection bound to the current thread by bound_connection(), used instead of the pools
+_bound = threading.local()
+
+
+@contextlib.contextmanager
+def bound_connection(conn):
+    """
+    Run the db_utils calls made by this thread inside the block on `conn` instead of
+    a pooled connection, e.g. a background job's connection with a longer
+    statement_timeout. The connection is rolled back, not closed, after each call.
+    """
+    previous = getattr(_bound, "conn", None)
+    _bound.conn = conn
+    try:
+        yield conn
+    finally:
+        _bound.conn = previous
+
+
+def _get_conn(readonly=False):
+    """
+    Check out a connection. Raises RuntimeError on pool exhaustion.
+    readonly=True routes to the replica when one is configured, healthy and caught up,
+    and falls back to the primary otherwise.
+    """
+    bound = getattr(_bound, "conn", None)
+    if bound is not None:
+        return bound
+    if readonly and DB_REPLICA_HOST:
+        conn = _get_replica_conn()
+        if conn is not None:
+            return conn
+        _count("replica", "fallbacks")
+    try:
+        return _checkout(_primary_pool(), "primary")
     except psycopg2.pool.PoolError as e:
         logger.error("DB connection pool exhausted: %s", e)
+        _count("primary", "errors")
         raise RuntimeError("DB connection pool exhausted") from e
 
 
-def _put_conn(conn):
-    """Return a connection to the pool."""
-    if conn:
-        _pool.putconn(conn)
+def _put_conn(conn, close=False):
+    """Return a connection to the pool it came from. Broken connections are discarded."""
+    global _replica_down_until
+    if not conn:
+        return
+    if conn is getattr(_bound, "conn", None):
+        if not conn.closed:
+            conn.rollback()
+        return
+    with _metrics_lock:
+        pool = _conn_owner.pop(id(conn), None)
+    if pool is None:
+        # Checked out before the pools were replaced (close_pools or a fork)
+        conn.close()
+        return
+    if pool is _replica_pool and conn.closed and not close:
+        logger.warning("DB replica connection lost, reads will use the primary for %.0fs", DB_REPLICA_RETRY)
+        _count("replica", "errors")
+        _replica_down_until = time.monotonic() + DB_REPLICA_RETRY
+    try:
+        pool.putconn(conn, close=close or bool(conn.closed))
+    except psycopg2.pool.PoolError:
+        # The pool was replaced (e.g. post_fork) after this connection was checked out
+        conn.close()
+
+
+def pool_metrics():
+    """Snapshot of per-pool usage counters and sizes, for the /api/metrics endpoint."""
+    with _metrics_lock:
+        stats = {name: dict(values) for name, values in _pool_stats.items()}
+    stats["primary"]["configured"] = True
+    stats["replica"]["configured"] = bool(DB_REPLICA_HOST)
+    if _pool_pid != os.getpid():
+        return stats
+    for name, pool in (("primary", _pool), ("replica", _replica_pool)):
+        if pool is not None:
+            stats[name]["in_use"] = len(pool._used)
+            stats[name]["idle"] = len(pool._pool)
+            stats[name]["max"] = pool.maxconn
+    if DB_REPLICA_HOST:
+        stats["replica"]["available"] = (
+            _replica_pool is not None
+            and time.monotonic() >= _replica_down_until
+            and not _replica_lagging
+        )
+    return stats
+
+def close_pools():
+    """
+    Close this process's primary and replica pools, e.g. in the gunicorn master
+    before forking. They are created again on next use.
+    """
+    global _pool, _replica_pool
+    with _pool_lock:
+        _check_pid()
+        pools = (_pool, _replica_pool)
+        _pool = _replica_pool = None
+        with _metrics_lock:
+            _conn_owner.clear()
+    for pool in pools:
+        if pool is None:
+            continue
+        try:
+            pool.closeall()
+        except Exception:
+            pass
+
+
+def warm_pool():
+    """
+    Run a trivial query over every idle pooled connection so each backend has
+    loaded the catalog entries for the main tables before real traffic arrives.
+    Returns the number of connections warmed.
+    """
+    try:
+        pools = ((_primary_pool(), "primary"), (_current_replica_pool(create=True), "replica"))
+    except psycopg2.Error as e:
+        raise DBError("Could not open the DB pool") from e
+    warmed = 0
+    for pool, pool_name in pools:
+        if pool is None:
+            continue
+        conns = []
+        try:
+            for _ in range(pool.minconn):
+                conns.append(_checkout(pool, pool_name))
+            for conn in conns:
+                cur = conn.cursor()
+                cur.execute("SELECT 1 FROM detection_events LIMIT 0")
+                cur.execute("SELECT 1 FROM event_images LIMIT 0")
+                cur.close()
+                conn.rollback()
+                warmed += 1
+        except (psycopg2.Error, psycopg2.pool.PoolError) as e:
+            logger.warning("Could not warm %s pool: %s", pool_name, e)
+        finally:
+            for conn in conns:
+                _put_conn(conn)
+    return warmed
+
 
 def ping_db():
     """
@@ -105,6 +616,7 @@ def ping_db():
         _put_conn(conn)
 
 
+@_statement_budget("listing")
 def fetch_latest_images(limit=5): # Reducido el límite para depuración
     """
     Recupera las últimas imágenes y sus datos de detección de patente.
@@ -112,7 +624,7 @@ def fetch_latest_images(limit=5): # Reducido el límite para depuración
     """
     conn = None
     try:
-        conn = _get_conn()
+        conn = _get_conn(readonly=True)
         cur = conn.cursor()
 
         query = """
@@ -120,7 +632,7 @@ def fetch_latest_images(limit=5): # Reducido el límite para depuración
             de.id AS event_id,
             ei.id AS image_id,
             ei.created_at,
-            ei.image_data,
+            """ + _IMAGE_DATA_COLUMNS + """,
             ei.image_type,
             ei.file_name,
             de.camera_plate_text AS plate_text,
@@ -135,16 +647,8 @@ def fetch_latest_images(limit=5): # Reducido el límite para depuración
         """
         cur.execute(query, (limit,))
 
-        columns = [desc[0] for desc in cur.description]
-        results = []
-        rows = cur.fetchall()
-        for row in rows:
-            row_dict = dict(zip(columns, row))
-            if 'vehicle_brand' in row_dict: # Asegurarse de que el campo exista
-                row_dict['vehicle_brand'] = normalize_vehicle_brand(row_dict['vehicle_brand'])
-            if row_dict['image_data']:
-                row_dict['image_data'] = base64.b64encode(row_dict['image_data']).decode('utf-8')
-            results.append(row_dict)
+        results = _fetch_records(cur)
+        _encode_images(results)
         
         cur.close()
         return results
@@ -177,7 +681,7 @@ def fetch_new_images_for_download(last_timestamp=None):
             de.id AS event_id,
             ei.id AS image_id,
             ei.created_at,
-            ei.image_data,
+            """ + _IMAGE_DATA_COLUMNS + """,
             ei.image_type,
             ei.file_name,
             de.camera_plate_text AS plate_text,
@@ -186,18 +690,26 @@ def fetch_new_images_for_download(last_timestamp=None):
             detection_events de
         JOIN
             event_images ei ON de.id = ei.event_id
-        WHERE
-            (%s IS NULL OR de.created_at > %s)
-        ORDER BY
-            de.created_at ASC;
         """
-        cur.execute(query, (last_timestamp, last_timestamp))
+        # Only emit the watermark predicate when there is one: `%s IS NULL OR ...`
+        # cannot be used for partition pruning or index range scans
+        conditions = []
+        params = []
+        if last_timestamp is not None:
+            conditions.append("de.created_at > %s")
+            params.append(last_timestamp)
+            _mirror_time_bounds(conditions, params, "ei.created_at", start=last_timestamp)
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        query += " ORDER BY de.created_at ASC;"
+        cur.execute(query, params)
         
         columns = [desc[0] for desc in cur.description]
         results = []
         for row in cur.fetchall():
             row_dict = dict(zip(columns, row))
             # image_data se deja en formato bytes para guardar directamente
+            row_dict['image_data'] = _load_blob(row_dict['image_data'], row_dict.get('image_sha256'))
             results.append(row_dict)
         
         cur.close()
@@ -215,6 +727,7 @@ def fetch_new_images_for_download(last_timestamp=None):
         if conn:
             _put_conn(conn)
 
+@_statement_budget("image")
 def fetch_images_by_datetime_range(start_datetime_str, end_datetime_str, limit=500):
     """
     Recupera imágenes y sus datos de detección de patente dentro de un rango de fecha y hora.
@@ -222,7 +735,7 @@ def fetch_images_by_datetime_range(start_datetime_str, end_datetime_str, limit=5
     """
     conn = None
     try:
-        conn = _get_conn()
+        conn = _get_conn(readonly=True)
         cur = conn.cursor()
 
         # Convertir cadenas a objetos datetime para la consulta
@@ -236,7 +749,7 @@ def fetch_images_by_datetime_range(start_datetime_str, end_datetime_str, limit=5
             de.id AS event_id,
             ei.id AS image_id,
             ei.created_at,
-            ei.image_data,
+            """ + _IMAGE_DATA_COLUMNS + """,
             ei.image_type,
             ei.file_name,
             de.camera_plate_text AS plate_text,
@@ -247,23 +760,18 @@ def fetch_images_by_datetime_range(start_datetime_str, end_datetime_str, limit=5
             event_images ei ON de.id = ei.event_id
         WHERE
             de.created_at >= %s AND de.created_at <= %s
-        ORDER BY
-            de.created_at DESC
-        LIMIT %s;
         """
-        cur.execute(query, (start_dt, end_dt, limit))
+        params = [start_dt, end_dt]
+        conditions = []
+        _mirror_time_bounds(conditions, params, "ei.created_at", start=start_dt, end=end_dt)
+        for condition in conditions:
+            query += " AND " + condition
+        query += " ORDER BY de.created_at DESC LIMIT %s;"
+        params.append(limit)
+        cur.execute(query, params)
         
-        columns = [desc[0] for desc in cur.description]
-        results = []
-        rows = cur.fetchall()
-
-        for row in rows:
-            row_dict = dict(zip(columns, row))
-            if 'vehicle_brand' in row_dict: # Asegurarse de que el campo exista
-                row_dict['vehicle_brand'] = normalize_vehicle_brand(row_dict['vehicle_brand'])
-            if row_dict['image_data']:
-                row_dict['image_data'] = base64.b64encode(row_dict['image_data']).decode('utf-8')
-            results.append(row_dict)
+        results = _fetch_records(cur)
+        _encode_images(results)
 
         cur.close()
         return results
@@ -283,6 +791,7 @@ def fetch_images_by_datetime_range(start_datetime_str, end_datetime_str, limit=5
         if conn:
             _put_conn(conn)
 
+@_statement_budget("listing")
 def search_by_plate_text(plate_text, limit=50):
     """
     Busca imágenes y datos de detección de patente por el texto de la patente.
@@ -290,7 +799,7 @@ def search_by_plate_text(plate_text, limit=50):
     """
     conn = None
     try:
-        conn = _get_conn()
+        conn = _get_conn(readonly=True)
         cur = conn.cursor()
 
         query = """
@@ -298,7 +807,7 @@ def search_by_plate_text(plate_text, limit=50):
             de.id AS event_id,
             ei.id AS image_id,
             ei.created_at,
-            ei.image_data,
+            """ + _IMAGE_DATA_COLUMNS + """,
             ei.image_type,
             ei.file_name,
             de.camera_plate_text AS plate_text,
@@ -315,15 +824,8 @@ def search_by_plate_text(plate_text, limit=50):
         """
         cur.execute(query, (f'%{plate_text}%', limit))
         
-        columns = [desc[0] for desc in cur.description]
-        results = []
-        for row in cur.fetchall():
-            row_dict = dict(zip(columns, row))
-            if 'vehicle_brand' in row_dict: # Asegurarse de que el campo exista
-                row_dict['vehicle_brand'] = normalize_vehicle_brand(row_dict['vehicle_brand'])
-            if row_dict['image_data']:
-                row_dict['image_data'] = base64.b64encode(row_dict['image_data']).decode('utf-8')
-            results.append(row_dict)
+        results = _fetch_records(cur)
+        _encode_images(results)
         
         cur.close()
         return results
@@ -340,6 +842,216 @@ def search_by_plate_text(plate_text, limit=50):
         if conn:
             _put_conn(conn)
 
+# Plate text with case and separators ignored ("ab-123 cd" -> "AB123CD"). Must stay
+# identical to the expression of detection_events_plate_key_idx (migrations/004).
+_PLATE_KEY_EXPR = "upper(regexp_replace({}camera_plate_text, '[^[:alnum:]]', '', 'g'))"
+_PLATE_KEY_SQL = _PLATE_KEY_EXPR.format("de.")
+
+
+def normalize_plate(plate_text):
+    """
+    The lookup key for a plate as typed or as read by the camera, or None if empty.
+    Not truncated: it must equal _PLATE_KEY_SQL for plates of any length.
+    """
+    key = "".join(ch for ch in (plate_text or "") if ch.isalnum()).upper()
+    return key or None
+
+
+def _dominant(counts, dimension):
+    """Most frequent canonical value of `dimension` among {raw value: sightings}."""
+    totals = {}
+    for raw, n in counts.items():
+        value = canonicalize(dimension, raw) if raw else None
+        if value:
+            totals[value] = totals.get(value, 0) + n
+    if not totals:
+        return None
+    return max(totals.items(), key=lambda item: (item[1], item[0]))[0]
+
+
+@_ttl_cached(PLATE_PROFILE_CACHE_SECONDS, max_entries=PLATE_PROFILE_CACHE_ENTRIES)
+@_statement_budget("stats")
+def fetch_plate_profile(plate_key):
+    """
+    Aggregated history of one normalized plate (see normalize_plate): first and
+    last seen, total sightings, sightings per day, dominant brand/color/type and
+    the raw spellings read by the cameras. None if the plate was never seen.
+    Raises DBError on DB failure.
+    """
+    conn = None
+    try:
+        conn = _get_conn(readonly=True)
+        cur = conn.cursor()
+        cur.execute(
+            f"""
+            SELECT de.camera_plate_text, de.vehicle_brand, de.vehicle_color, de.vehicle_type,
+                   COUNT(*), MIN(de.created_at), MAX(de.created_at), AVG(de.camera_confidence)
+            FROM detection_events de
+            WHERE {_PLATE_KEY_SQL} = %s
+            GROUP BY 1, 2, 3, 4
+            """,
+            (plate_key,),
+        )
+        groups = cur.fetchall()
+        if not groups:
+            cur.close()
+            return None
+
+        total = sum(g[4] for g in groups)
+        by_dimension = {'plate': {}, 'brand': {}, 'color': {}, 'type': {}}
+        for plate_text, brand, color, vehicle_type, n, _, _, _ in groups:
+            for dimension, raw in zip(by_dimension, (plate_text, brand, color, vehicle_type)):
+                by_dimension[dimension][raw] = by_dimension[dimension].get(raw, 0) + n
+        confidence = sum((g[7] or 0) * g[4] for g in groups) / total
+
+        cur.execute(
+            f"""
+            SELECT de.created_at::date AS day, COUNT(*) AS sightings
+            FROM detection_events de
+            WHERE {_PLATE_KEY_SQL} = %s
+            GROUP BY 1 ORDER BY 1
+            """,
+            (plate_key,),
+        )
+        per_day = _fetch_records(cur)
+        cur.close()
+        return {
+            'plate': plate_key,
+            'plate_variants': sorted(p for p in by_dimension['plate'] if p),
+            'total_sightings': total,
+            'first_seen': min(g[5] for g in groups),
+            'last_seen': max(g[6] for g in groups),
+            'avg_confidence': round(float(confidence), 4),
+            'days_seen': len(per_day),
+            'sightings_per_day': per_day,
+            'dominant_brand': _dominant(by_dimension['brand'], 'brand'),
+            'dominant_color': _dominant(by_dimension['color'], 'color'),
+            'dominant_type': _dominant(by_dimension['type'], 'type'),
+        }
+    except psycopg2.Error as e:
+        logger.error("Error fetching plate profile: %s", e)
+        raise DBError("Database operation failed") from e
+    except RuntimeError:
+        raise
+    except Exception as e:
+        logger.error("Error fetching plate profile: %s", e)
+        raise DBError("Database operation failed") from e
+    finally:
+        if conn:
+            _put_conn(conn)
+
+
+@_ttl_cached(PLATE_PROFILE_CACHE_SECONDS, max_entries=PLATE_PROFILE_CACHE_ENTRIES)
+@_statement_budget("listing")
+def fetch_plate_timeline(plate_key, cursor_ts=None, cursor_id=None, limit=50):
+    """
+    Sightings of one normalized plate, newest first, keyset-paginated on
+    (created_at, id). Image ids and types only, no image_data: bytes come from
+    /api/browse_image/<image_id>. Raises DBError on DB failure.
+    """
+    conn = None
+    try:
+        conn = _get_conn(readonly=True)
+        cur = conn.cursor()
+        conditions = [f"{_PLATE_KEY_SQL} = %s"]
+        params = [plate_key]
+        cursor_ts = _validate_date(cursor_ts)
+        if cursor_ts and cursor_id:
+            conditions.append("(de.created_at, de.id) < (%s, %s) AND de.created_at <= %s")
+            params.extend([cursor_ts, cursor_id, cursor_ts])
+        params.append(limit)
+        cur.execute(
+            """
+            SELECT de.id AS event_id, de.created_at, de.camera_plate_text AS plate_text,
+                   de.camera_confidence AS plate_confidence, de.vehicle_brand,
+                   de.vehicle_color, de.vehicle_type,
+                   ARRAY(SELECT ei.id::text FROM event_images ei
+                         WHERE ei.event_id = de.id ORDER BY ei.image_type) AS image_ids,
+                   ARRAY(SELECT ei.image_type FROM event_images ei
+                         WHERE ei.event_id = de.id ORDER BY ei.image_type) AS image_types
+            FROM detection_events de
+            WHERE """ + " AND ".join(conditions) + """
+            ORDER BY de.created_at DESC, de.id DESC
+            LIMIT %s
+            """,
+            params,
+        )
+        results = _fetch_records(cur)
+        for r in results:
+            r.vehicle_brand = canonicalize('brand', r.vehicle_brand)
+            r.vehicle_color = canonicalize('color', r.vehicle_color)
+            r.vehicle_type = canonicalize('type', r.vehicle_type)
+        cur.close()
+        return results
+    except psycopg2.Error as e:
+        logger.error("Error fetching plate timeline: %s", e)
+        raise DBError("Database operation failed") from e
+    except RuntimeError:
+        raise
+    except Exception as e:
+        logger.error("Error fetching plate timeline: %s", e)
+        raise DBError("Database operation failed") from e
+    finally:
+        if conn:
+            _put_conn(conn)
+
+_snapshot_lock = threading.Lock()
+_snapshot = None
+_snapshot_checked_at = 0.0
+
+
+def _plate_snapshot():
+    """
+    The snapshot at PLATE_SNAPSHOT_PATH, reopened at most every few seconds when
+    a refresh has replaced the file. Raises RuntimeError when none is available.
+    """
+    global _snapshot, _snapshot_checked_at
+    if not PLATE_SNAPSHOT_PATH:
+        raise RuntimeError("No plate snapshot configured (PLATE_SNAPSHOT_PATH)")
+    # snapshot.py imports this module for its builder
+    import snapshot
+    with _snapshot_lock:
+        now = time.monotonic()
+        if _snapshot is None or now - _snapshot_checked_at >= _SNAPSHOT_CHECK_SECONDS:
+            _snapshot_checked_at = now
+            try:
+                current = os.stat(PLATE_SNAPSHOT_PATH)
+                if _snapshot is None or (current.st_ino, current.st_mtime_ns) != (
+                        _snapshot.stat.st_ino, _snapshot.stat.st_mtime_ns):
+                    # The old map is left to the garbage collector: other threads may still read it
+                    _snapshot = snapshot.Snapshot(PLATE_SNAPSHOT_PATH)
+            except (OSError, ValueError) as e:
+                if _snapshot is None:
+                    raise RuntimeError(f"Plate snapshot unavailable: {e}") from e
+                logger.warning("Plate snapshot could not be reopened, keeping the loaded one: %s", e)
+        return _snapshot
+
+
+def snapshot_plate_timeline(plate_key, cursor_ts=None, cursor_id=None, limit=50):
+    """
+    fetch_plate_timeline() from the local snapshot, without image ids, and the
+    time the snapshot was built. Raises RuntimeError when there is no snapshot.
+    """
+    snap = _plate_snapshot()
+    events = snap.plate_events(plate_key, cursor_ts=_validate_date(cursor_ts),
+                               cursor_id=cursor_id, limit=limit)
+    row_type = record_type(tuple(events[0]) + ('image_ids', 'image_types')) if events else None
+    return [row_type(**e, image_ids=[], image_types=[]) for e in events], snap.built_at
+
+
+def snapshot_search(plate_text=None, start=None, end=None, limit=50):
+    """
+    Sightings from the local snapshot: the newest of the plates starting with
+    `plate_text` (normalized), or else those between `start` and `end`, oldest first.
+    """
+    snap = _plate_snapshot()
+    if plate_text:
+        events = snap.search(plate_text, limit=limit)
+    else:
+        events = snap.between(_validate_date(start), _validate_date(end), limit=limit)
+    return events, snap.built_at
+
+
 def _validate_date(value):
     """Validate and return an ISO date/datetime string, or None if invalid."""
     if not value:
@@ -350,72 +1062,206 @@ def _validate_date(value):
     except (ValueError, TypeError):
         return None
 
-def _build_where_clause(search_term=None, brand_filter=None, color_filter=None,
-                        type_filter=None, start_date_filter=None, end_date_filter=None,
-                        min_confidence_filter=None):
-    """Builds a shared WHERE clause and params list for detection_events queries."""
+def _mirror_time_bounds(conditions, params, column, start=None, end=None):
+    """
+    Append bounds on `column` (ei.created_at or de.created_at) mirroring a range on
+    the other table's created_at, widened by PARTITION_PRUNE_SLACK. Redundant for
+    the result, but a direct predicate on each table's partition key is what lets
+    the planner skip that table's partitions outside the range.
+    """
+    if not PARTITION_PRUNE_SLACK:
+        return
+    if start is not None:
+        conditions.append(f"{column} >= %s::timestamptz - %s")
+        params.extend([start, PARTITION_PRUNE_SLACK])
+    if end is not None:
+        conditions.append(f"{column} <= %s::timestamptz + %s")
+        params.extend([end, PARTITION_PRUNE_SLACK])
+
+
+def _dedup_window(window):
+    """Collapse window clamped to 1..DEDUP_MAX_WINDOW_SECONDS, or None when not collapsing."""
+    if not window:
+        return None
+    return max(1, min(DEDUP_MAX_WINDOW_SECONDS, int(window)))
+
+
+def _passage_start_condition(conditions, params, window, **filters):
+    """
+    Keep only the first sighting of each passage: events whose plate was not seen
+    in the `window` seconds before them. Earlier sightings count only when they
+    match the listing's `filters` (_detection_conditions() arguments) too, so a
+    passage starts at its first sighting the listing can show. Plates without
+    letters or digits are never collapsed. One probe of
+    detection_events_plate_key_idx per row, so keyset pagination and partition
+    pruning work unchanged.
+    """
+    prev_conditions, prev_params = _detection_conditions(prefix="prev.", **filters)
+    # A scalar subquery rather than NOT EXISTS: Postgres would turn NOT EXISTS into
+    # an anti-join that hashes the whole table even when only a page is needed
+    conditions.append(
+        f"({_PLATE_KEY_SQL} = '' OR (SELECT 1 FROM detection_events prev"
+        f" WHERE {_PLATE_KEY_EXPR.format('prev.')} = {_PLATE_KEY_SQL}"
+        # (created_at, id) order, as in _PASSAGE_STATS_QUERY, so of two sightings with
+        # the same timestamp only one starts the passage
+        " AND prev.created_at <= de.created_at AND (prev.created_at, prev.id) < (de.created_at, de.id)"
+        " AND prev.created_at >= de.created_at - make_interval(secs => %s)"
+        + "".join(" AND " + c for c in prev_conditions)
+        + " LIMIT 1) IS NULL)"
+    )
+    params.append(window)
+    params.extend(prev_params)
+
+
+def _detection_conditions(prefix="", search_term=None, brand_filter=None, color_filter=None,
+                          type_filter=None, start_date_filter=None, end_date_filter=None,
+                          min_confidence_filter=None):
+    """Filter predicates on detection_events columns (qualified with `prefix`) and their params."""
     conditions = []
     params = []
     if search_term:
-        conditions.append("camera_plate_text ILIKE %s")
+        conditions.append(f"{prefix}camera_plate_text ILIKE %s")
         params.append(f'%{search_term}%')
-    if brand_filter:
-        expanded_brands = []
-        for b in brand_filter:
-            expanded_brands.append(b)
-            expanded_brands.extend(_BRAND_RAW_VARIANTS.get(b, []))
-        placeholders = ','.join(['%s'] * len(expanded_brands))
-        conditions.append(f"vehicle_brand IN ({placeholders})")
-        params.extend(expanded_brands)
-    if color_filter:
-        placeholders = ','.join(['%s'] * len(color_filter))
-        conditions.append(f"vehicle_color IN ({placeholders})")
-        params.extend(color_filter)
-    if type_filter:
-        placeholders = ','.join(['%s'] * len(type_filter))
-        conditions.append(f"vehicle_type IN ({placeholders})")
-        params.extend(type_filter)
+    _dimension_conditions(conditions, params, brand_filter, color_filter, type_filter, prefix=prefix)
     start_date_filter = _validate_date(start_date_filter)
     if start_date_filter:
-        conditions.append("created_at >= %s")
+        conditions.append(f"{prefix}created_at >= %s")
         params.append(start_date_filter)
     end_date_filter = _validate_date(end_date_filter)
     if end_date_filter:
-        conditions.append("created_at <= %s")
+        conditions.append(f"{prefix}created_at <= %s")
         params.append(end_date_filter)
     if min_confidence_filter is not None:
         min_confidence_filter = max(0.0, min(1.0, float(min_confidence_filter)))
-        conditions.append("camera_confidence >= %s")
+        conditions.append(f"{prefix}camera_confidence >= %s")
         params.append(min_confidence_filter)
+    return conditions, params
+
+
+def _build_where_clause(search_term=None, brand_filter=None, color_filter=None,
+                        type_filter=None, start_date_filter=None, end_date_filter=None,
+                        min_confidence_filter=None):
+    """Builds a shared WHERE clause and params list for detection_events queries."""
+    conditions, params = _detection_conditions(
+        "", search_term, brand_filter, color_filter, type_filter,
+        start_date_filter, end_date_filter, min_confidence_filter,
+    )
     clause = ""
     if conditions:
         clause = " WHERE " + " AND ".join(conditions)
     return clause, params
 
+# Gaps-and-islands over the sightings of the plates on one page: a sighting starts
+# a new passage when the previous sighting of its plate is more than the window
+# before it. Only sightings from the page's oldest passage start onwards that
+# match the listing's filters are read, through detection_events_plate_key_idx.
+_PASSAGE_STATS_QUERY = """
+WITH marked AS (
+    SELECT de.id, de.created_at, """ + _PLATE_KEY_SQL + """ AS plate_key,
+           CASE WHEN de.created_at - lag(de.created_at) OVER w <= make_interval(secs => %s)
+                THEN 0 ELSE 1 END AS is_start
+    FROM detection_events de
+    WHERE """ + _PLATE_KEY_SQL + """ = ANY(%s) AND de.created_at >= %s{filters}
+    WINDOW w AS (PARTITION BY """ + _PLATE_KEY_SQL + """ ORDER BY de.created_at, de.id)
+), numbered AS (
+    SELECT *, SUM(is_start) OVER (PARTITION BY plate_key ORDER BY created_at, id) AS passage
+    FROM marked
+)
+SELECT (array_agg(id ORDER BY created_at, id))[1] AS start_id, COUNT(*), MAX(created_at)
+FROM numbered
+GROUP BY plate_key, passage
+"""
+
+
+def _add_passage_stats(cur, patents, window, filters):
+    """
+    Set passage_sightings, first_seen and last_seen on passage-start records, and
+    replace sightings with the number of passages of each plate, counting only
+    sightings that match `filters` like the listing does.
+    """
+    keyed = [(normalize_plate(p.plate_text), p) for p in patents]
+    keys = list({k for k, _ in keyed if k})
+    stats, passages = {}, {}
+    if keys:
+        filter_conditions, filter_params = _detection_conditions(prefix="de.", **filters)
+        cur.execute(
+            _PASSAGE_STATS_QUERY.format(filters="".join(" AND " + c for c in filter_conditions)),
+            [window, keys, min(p.created_at for p in patents)] + filter_params,
+        )
+        stats = {str(start_id): (n, last_seen) for start_id, n, last_seen in cur.fetchall()}
+        conditions, params = [f"{_PLATE_KEY_SQL} = ANY(%s)"] + filter_conditions, [keys] + filter_params
+        _passage_start_condition(conditions, params, window, **filters)
+        cur.execute(
+            f"SELECT {_PLATE_KEY_SQL}, COUNT(*) FROM detection_events de WHERE "
+            + " AND ".join(conditions) + " GROUP BY 1",
+            params,
+        )
+        passages = dict(cur.fetchall())
+    for key, p in keyed:
+        n, last_seen = stats.get(str(p.event_id), (1, p.created_at))
+        p.passage_sightings = n
+        p.first_seen = p.created_at
+        p.last_seen = last_seen
+        p.sightings = passages.get(key, 1) if key else 1
+
+
+@_statement_budget("listing")
 def fetch_all_patents_paginated(page=1, page_size=10, search_term=None, brand_filter=None,
                                 color_filter=None, type_filter=None, start_date_filter=None,
-                                end_date_filter=None, min_confidence_filter=None):
+                                end_date_filter=None, min_confidence_filter=None,
+                                collapse_window=None):
     """
     Recupera todos los datos de patente de detection_events con paginación, búsqueda y filtros.
     Incluye conteo de avistamientos por patente (sightings) via window function.
+    With collapse_window (seconds), repeated sightings of a plate are collapsed into
+    passages: one row per passage (its first sighting) with passage_sightings,
+    first_seen and last_seen; sightings and total_registros count passages
+    (total_registros at most DEDUP_COUNT_LIMIT).
     Retorna una tupla (lista_de_patentes, total_registros).
     """
     conn = None
     patents = []
     total_count = 0
     try:
-        conn = _get_conn()
+        conn = _get_conn(readonly=True)
         cur = conn.cursor()
 
         offset = (page - 1) * page_size
-        where_clause, query_params = _build_where_clause(
-            search_term, brand_filter, color_filter, type_filter,
-            start_date_filter, end_date_filter, min_confidence_filter
+        filters = dict(
+            search_term=search_term, brand_filter=brand_filter, color_filter=color_filter,
+            type_filter=type_filter, start_date_filter=start_date_filter,
+            end_date_filter=end_date_filter, min_confidence_filter=min_confidence_filter,
         )
+        where_clause, query_params = _build_where_clause(**filters)
+
+        window = _dedup_window(collapse_window)
+        if window:
+            # Only passage starts are listed and counted
+            conditions = [where_clause[len(" WHERE "):]] if where_clause else []
+            query_params = list(query_params)
+            _passage_start_condition(conditions, query_params, window, **filters)
+            where_clause = " WHERE " + " AND ".join(conditions)
 
         # Consulta de conteo
-        cur.execute("SELECT COUNT(*) FROM detection_events" + where_clause, query_params)
-        total_count = cur.fetchone()[0]
+        cache = columnar_cache
+        if not window and cache is not None and cache.supports(search_term):
+            cache.refresh()
+            total_count = cache.count(
+                search_term=search_term, brand_filter=brand_filter, color_filter=color_filter,
+                type_filter=type_filter, start_date_filter=start_date_filter,
+                end_date_filter=end_date_filter, min_confidence_filter=min_confidence_filter,
+            )
+        else:
+            count_query = "SELECT COUNT(*) FROM detection_events de" + where_clause
+            count_params = query_params
+            if window:
+                # The passage-start probe runs per candidate row: stop at the cap
+                count_query = ("SELECT COUNT(*) FROM (SELECT 1 FROM detection_events de"
+                               + where_clause + " LIMIT %s) passages")
+                count_params = list(query_params) + [DEDUP_COUNT_LIMIT]
+            with _statement_budget("count"):
+                cur.execute(count_query, count_params)
+            total_count = cur.fetchone()[0]
 
         # Fetch page of patents (no window function)
         patents_query = """
@@ -428,21 +1274,27 @@ def fetch_all_patents_paginated(page=1, page_size=10, search_term=None, brand_fi
             camera_confidence AS plate_confidence,
             created_at
         FROM
-            detection_events
+            detection_events de
         """ + where_clause + " ORDER BY created_at DESC LIMIT %s OFFSET %s;"
 
         page_params = list(query_params) + [page_size, offset]
         cur.execute(patents_query, page_params)
 
-        columns = [desc[0] for desc in cur.description]
-        for row in cur.fetchall():
-            row_dict = dict(zip(columns, row))
-            if 'vehicle_brand' in row_dict:
-                row_dict['vehicle_brand'] = normalize_vehicle_brand(row_dict['vehicle_brand'])
-            patents.append(row_dict)
+        extra = ('sightings', 'passage_sightings', 'first_seen', 'last_seen') if window else ('sightings',)
+        patents = _fetch_records(cur, extra=extra)
+        for rec in patents:
+            rec.vehicle_brand = normalize_vehicle_brand(rec.vehicle_brand)
+            # Same canonical values the filter dropdowns offer
+            rec.vehicle_color = canonicalize('color', rec.vehicle_color)
+            rec.vehicle_type = canonicalize('type', rec.vehicle_type)
+
+        if window:
+            _add_passage_stats(cur, patents, window, filters)
+            cur.close()
+            return patents, total_count
 
         # Per-page sightings: count occurrences of plates on this page
-        plate_texts = list({p['plate_text'] for p in patents if p.get('plate_text')})
+        plate_texts = list({p.plate_text for p in patents if p.plate_text})
         sightings_map = {}
         if plate_texts:
             placeholders = ','.join(['%s'] * len(plate_texts))
@@ -455,7 +1307,7 @@ def fetch_all_patents_paginated(page=1, page_size=10, search_term=None, brand_fi
             for plate, count in cur.fetchall():
                 sightings_map[plate] = count
         for p in patents:
-            p['sightings'] = sightings_map.get(p.get('plate_text'), 0)
+            p.sightings = sightings_map.get(p.plate_text, 0)
 
         cur.close()
         return patents, total_count
@@ -475,14 +1327,35 @@ def fetch_all_patents_paginated(page=1, page_size=10, search_term=None, brand_fi
         if conn:
             _put_conn(conn)
 
+def _add_detection_rate(result):
+    """Add detections_per_hour to a fetch_stats() result."""
+    if result['first_detection_at'] and result['last_detection_at'] and result['total'] > 0:
+        span = result['last_detection_at'] - result['first_detection_at']
+        hours = span.total_seconds() / 3600
+        result['detections_per_hour'] = round(result['total'] / max(hours, 1), 1)
+    else:
+        result['detections_per_hour'] = 0
+    return result
+
+
+@_ttl_cached(STATS_CACHE_SECONDS)
+@_statement_budget("stats")
 def fetch_stats(start_date_filter=None, end_date_filter=None):
     """
     Recupera estadísticas agregadas de detection_events.
     Retorna un diccionario con métricas clave.
     """
+    cache = columnar_cache
+    if cache is not None and cache.ready:
+        cache.refresh()
+        try:
+            return _add_detection_rate(cache.stats(start_date_filter, end_date_filter))
+        except (ValueError, TypeError) as e:
+            logger.error("Error al obtener estadísticas: %s", e)
+            raise DBError("Database operation failed") from e
     conn = None
     try:
-        conn = _get_conn()
+        conn = _get_conn(readonly=True)
         cur = conn.cursor()
 
         where_clause, params = _build_where_clause(
@@ -507,23 +1380,9 @@ def fetch_stats(start_date_filter=None, end_date_filter=None):
         row = cur.fetchone()
         columns = [desc[0] for desc in cur.description]
         result = dict(zip(columns, row))
-
-        # Compute detections per hour
-        if result['first_detection_at'] and result['last_detection_at'] and result['total'] > 0:
-            span = result['last_detection_at'] - result['first_detection_at']
-            hours = span.total_seconds() / 3600
-            result['detections_per_hour'] = round(result['total'] / max(hours, 1), 1)
-        else:
-            result['detections_per_hour'] = 0
-
-        # Serialize datetimes
-        for key in ('last_detection_at', 'first_detection_at'):
-            if result[key]:
-                result[key] = result[key].isoformat()
-
         result['avg_confidence'] = round(float(result['avg_confidence']), 4)
         cur.close()
-        return result
+        return _add_detection_rate(result)
 
     except psycopg2.Error as e:
         logger.error("Error al obtener estadísticas: %s", e)
@@ -537,6 +1396,8 @@ def fetch_stats(start_date_filter=None, end_date_filter=None):
         if conn:
             _put_conn(conn)
 
+@_ttl_cached(RECENT_THUMBNAILS_CACHE_SECONDS)
+@_statement_budget("listing")
 def fetch_recent_thumbnails(limit=8):
     """
     Fetches the most recent vehicle_picture thumbnails.
@@ -544,7 +1405,7 @@ def fetch_recent_thumbnails(limit=8):
     """
     conn = None
     try:
-        conn = _get_conn()
+        conn = _get_conn(readonly=True)
         cur = conn.cursor()
         query = """
         SELECT
@@ -558,7 +1419,7 @@ def fetch_recent_thumbnails(limit=8):
         WHERE
             ei.image_type = 'vehicle_picture'
         ORDER BY
-            ei.created_at DESC
+            ei.created_at DESC, ei.id DESC
         LIMIT %s;
         """
         cur.execute(query, (limit,))
@@ -584,49 +1445,70 @@ def fetch_recent_thumbnails(limit=8):
         if conn:
             _put_conn(conn)
 
-# In-process cache for filter options (invalidated after 300 s)
-_filter_options_cache = None
-_filter_options_cache_ts = 0.0
-
+def _load_dimension_aliases(conn, cur):
+    """
+    Read vehicle_dimension_aliases into {dimension: {casefolded raw: canonical}}.
+    Returns None when the table has not been created yet (built-in map stays in use).
+    """
+    try:
+        cur.execute("SELECT dimension, raw_value, canonical FROM vehicle_dimension_aliases")
+    except psycopg2.errors.UndefinedTable:
+        conn.rollback()
+        return None
+    aliases = {
+        'brand': {raw.casefold(): canonical for raw, canonical in VEHICLE_BRAND_NORMALIZATION_MAP.items()},
+        'color': {},
+        'type': {},
+    }
+    for dimension, raw, canonical in cur.fetchall():
+        if dimension in aliases:
+            aliases[dimension][raw.strip().casefold()] = canonical
+    return aliases
+
+
+@_ttl_cached(FILTER_OPTIONS_CACHE_SECONDS)
+@_statement_budget("stats")
 def fetch_filter_options():
     """
     Returns unique sorted values for vehicle_brand, vehicle_color, vehicle_type.
-    Results are cached for 300 seconds to avoid hammering the DB on every page load.
-    Raises DBError on DB failure.
+    Results are cached (FILTER_OPTIONS_CACHE_SECONDS, default 300) to avoid hammering
+    the DB on every page load. Raises DBError on DB failure.
     """
-    global _filter_options_cache, _filter_options_cache_ts
-    if _filter_options_cache is not None and (time.time() - _filter_options_cache_ts) < 300:
-        return _filter_options_cache
-
     conn = None
     try:
-        conn = _get_conn()
+        conn = _get_conn(readonly=True)
         cur = conn.cursor()
 
-        cur.execute(
-            "SELECT DISTINCT vehicle_brand FROM detection_events "
-            "WHERE vehicle_brand IS NOT NULL AND vehicle_brand <> ''"
-        )
-        raw_brands = [row[0] for row in cur.fetchall()]
-        brands = sorted({normalize_vehicle_brand(b) for b in raw_brands if b})
-
-        cur.execute(
-            "SELECT DISTINCT vehicle_color FROM detection_events "
-            "WHERE vehicle_color IS NOT NULL AND vehicle_color <> ''"
-        )
-        colors = sorted({row[0].strip() for row in cur.fetchall() if row[0] and row[0].strip()})
-
-        cur.execute(
-            "SELECT DISTINCT vehicle_type FROM detection_events "
-            "WHERE vehicle_type IS NOT NULL AND vehicle_type <> ''"
-        )
-        types = sorted({row[0].strip() for row in cur.fetchall() if row[0] and row[0].strip()})
+        aliases = _load_dimension_aliases(conn, cur)
+
+        raw_values = {}
+        cache = columnar_cache
+        if cache is not None and cache.ready:
+            cache.refresh()
+        for dimension, column in _DIMENSION_COLUMNS.items():
+            if cache is not None and cache.ready:
+                raw_values[dimension] = cache.distinct_values(dimension)
+                continue
+            cur.execute(
+                f"SELECT DISTINCT {column} FROM detection_events "
+                f"WHERE {column} IS NOT NULL AND {column} <> ''"
+            )
+            raw_values[dimension] = [row[0] for row in cur.fetchall() if row[0] and row[0].strip()]
+
+        if aliases is not None:
+            for dimension in _DIMENSION_COLUMNS:
+                _alias_lookup[dimension] = aliases[dimension]
+        options = {}
+        for dimension, raws in raw_values.items():
+            variants = {}
+            for raw in raws:
+                variants.setdefault(canonicalize(dimension, raw), set()).add(raw)
+            _raw_variants[dimension] = variants
+            options[dimension] = sorted(variants)
+        brands, colors, types = options['brand'], options['color'], options['type']
 
         cur.close()
-        result = {"brands": brands, "colors": colors, "types": types}
-        _filter_options_cache = result
-        _filter_options_cache_ts = time.time()
-        return result
+        return {"brands": brands, "colors": colors, "types": types}
 
     except RuntimeError:
         raise
@@ -640,12 +1522,73 @@ def fetch_filter_options():
         if conn:
             _put_conn(conn)
 
+@_statement_budget("image")
+def fetch_sprite_images(anchor_image_id, limit=8):
+    """
+    The `limit` most recent vehicle_picture images up to and including
+    `anchor_image_id`, newest first, in the order of fetch_recent_thumbnails().
+    Returns a list of dicts with image_id, event_id, plate_text and image_data
+    (bytes, or None when the blob is missing); empty if the anchor does not exist.
+    """
+    conn = None
+    try:
+        conn = _get_conn(readonly=True)
+        cur = conn.cursor()
+        query = """
+        SELECT
+            ei.id AS image_id,
+            de.id AS event_id,
+            de.camera_plate_text AS plate_text,
+            """ + _IMAGE_DATA_COLUMNS + """
+        FROM
+            event_images ei
+        JOIN
+            detection_events de ON de.id = ei.event_id
+        CROSS JOIN
+            (SELECT created_at, id FROM event_images WHERE id = %s) anchor
+        WHERE
+            ei.image_type = 'vehicle_picture'
+            AND (ei.created_at, ei.id) <= (anchor.created_at, anchor.id)
+            AND ei.created_at <= anchor.created_at
+        ORDER BY
+            ei.created_at DESC, ei.id DESC
+        LIMIT %s;
+        """
+        cur.execute(query, (str(anchor_image_id), limit))
+        rows = cur.fetchall()
+        cur.close()
+        _put_conn(conn)
+        conn = None
+        results = []
+        for image_id, event_id, plate_text, image_data, *sha256 in rows:
+            data = _load_blob(image_data, sha256[0] if sha256 else None)
+            results.append({'image_id': str(image_id), 'event_id': str(event_id),
+                            'plate_text': plate_text, 'image_data': bytes(data) if data else None})
+        return results
+    except psycopg2.Error as e:
+        logger.error("Error fetching sprite images: %s", e)
+        raise DBError("Database operation failed") from e
+    except RuntimeError:
+        raise
+    except Exception as e:
+        logger.error("Unexpected error fetching sprite images: %s", e)
+        raise DBError("Database operation failed") from e
+    finally:
+        if conn:
+            _put_conn(conn)
+
+@_statement_budget("count")
 def count_browsable_images(types, start_date=None, end_date=None, search_term=None,
-                           brand_filter=None, color_filter=None, vehicle_type_filter=None):
-    """Count browsable images filtered by type, date range, plate search, brand, color, and vehicle type."""
+                           brand_filter=None, color_filter=None, vehicle_type_filter=None,
+                           collapse_window=None):
+    """
+    Count browsable images filtered by type, date range, plate search, brand, color, and vehicle type.
+    With collapse_window (seconds), only images of the first sighting of each passage
+    count, up to DEDUP_COUNT_LIMIT.
+    """
     conn = None
     try:
-        conn = _get_conn()
+        conn = _get_conn(readonly=True)
         cur = conn.cursor()
         conditions = []
         params = []
@@ -662,29 +1605,28 @@ def count_browsable_images(types, start_date=None, end_date=None, search_term=No
         if end_date:
             conditions.append("de.created_at <= %s")
             params.append(end_date)
+        _mirror_time_bounds(conditions, params, "ei.created_at", start=start_date, end=end_date)
         if search_term:
             conditions.append("de.camera_plate_text ILIKE %s")
             params.append(f'%{search_term}%')
-        if brand_filter:
-            expanded_brands = []
-            for b in brand_filter:
-                expanded_brands.append(b)
-                expanded_brands.extend(_BRAND_RAW_VARIANTS.get(b, []))
-            placeholders = ','.join(['%s'] * len(expanded_brands))
-            conditions.append(f"de.vehicle_brand IN ({placeholders})")
-            params.extend(expanded_brands)
-        if color_filter:
-            placeholders = ','.join(['%s'] * len(color_filter))
-            conditions.append(f"de.vehicle_color IN ({placeholders})")
-            params.extend(color_filter)
-        if vehicle_type_filter:
-            placeholders = ','.join(['%s'] * len(vehicle_type_filter))
-            conditions.append(f"de.vehicle_type IN ({placeholders})")
-            params.extend(vehicle_type_filter)
+        _dimension_conditions(conditions, params, brand_filter, color_filter,
+                              vehicle_type_filter, prefix="de.")
+        window = _dedup_window(collapse_window)
+        if window:
+            _passage_start_condition(
+                conditions, params, window, search_term=search_term, brand_filter=brand_filter,
+                color_filter=color_filter, type_filter=vehicle_type_filter,
+                start_date_filter=start_date, end_date_filter=end_date,
+            )
 
         where = " WHERE " + " AND ".join(conditions)
         query = ("SELECT COUNT(*) FROM event_images ei "
                  "JOIN detection_events de ON de.id = ei.event_id" + where)
+        if window:
+            # The passage-start probe runs per candidate row: stop at the cap
+            query = ("SELECT COUNT(*) FROM (SELECT 1 FROM event_images ei "
+                     "JOIN detection_events de ON de.id = ei.event_id" + where + " LIMIT %s) passages")
+            params.append(DEDUP_COUNT_LIMIT)
         cur.execute(query, params)
         count = cur.fetchone()[0]
         cur.close()
@@ -702,13 +1644,18 @@ def count_browsable_images(types, start_date=None, end_date=None, search_term=No
             _put_conn(conn)
 
 
+@_statement_budget("listing")
 def fetch_browsable_images(cursor_ts=None, cursor_id=None, limit=5, direction='forward',
                            types=None, start_date=None, end_date=None, search_term=None,
-                           brand_filter=None, color_filter=None, vehicle_type_filter=None):
-    """Keyset-paginated image metadata (no image_data). Returns list of dicts. Supports filtering by type, date range, plate search, brand, color, and vehicle type."""
+                           brand_filter=None, color_filter=None, vehicle_type_filter=None,
+                           collapse_window=None):
+    """
+    Keyset-paginated image metadata (no image_data). Returns list of dicts. Supports filtering by type, date range, plate search, brand, color, and vehicle type.
+    With collapse_window (seconds), repeated sightings are skipped: only the images of the first sighting of each passage are listed.
+    """
     conn = None
     try:
-        conn = _get_conn()
+        conn = _get_conn(readonly=True)
         cur = conn.cursor()
         conditions = []
         params = []
@@ -719,11 +1666,16 @@ def fetch_browsable_images(cursor_ts=None, cursor_id=None, limit=5, direction='f
             params.extend(types)
 
         if cursor_ts and cursor_id:
+            # The plain created_at bound is implied by the row comparison, but only
+            # a direct predicate on the partition key prunes older/newer partitions
             if direction == 'forward':
-                conditions.append("(ei.created_at, ei.id) < (%s, %s)")
+                conditions.append("(ei.created_at, ei.id) < (%s, %s) AND ei.created_at <= %s")
+                params.extend([cursor_ts, cursor_id, cursor_ts])
+                _mirror_time_bounds(conditions, params, "de.created_at", end=cursor_ts)
             else:
-                conditions.append("(ei.created_at, ei.id) > (%s, %s)")
-            params.extend([cursor_ts, cursor_id])
+                conditions.append("(ei.created_at, ei.id) > (%s, %s) AND ei.created_at >= %s")
+                params.extend([cursor_ts, cursor_id, cursor_ts])
+                _mirror_time_bounds(conditions, params, "de.created_at", start=cursor_ts)
 
         start_date = _validate_date(start_date)
         if start_date:
@@ -733,25 +1685,19 @@ def fetch_browsable_images(cursor_ts=None, cursor_id=None, limit=5, direction='f
         if end_date:
             conditions.append("de.created_at <= %s")
             params.append(end_date)
+        _mirror_time_bounds(conditions, params, "ei.created_at", start=start_date, end=end_date)
         if search_term:
             conditions.append("de.camera_plate_text ILIKE %s")
             params.append(f'%{search_term}%')
-        if brand_filter:
-            expanded_brands = []
-            for b in brand_filter:
-                expanded_brands.append(b)
-                expanded_brands.extend(_BRAND_RAW_VARIANTS.get(b, []))
-            placeholders = ','.join(['%s'] * len(expanded_brands))
-            conditions.append(f"de.vehicle_brand IN ({placeholders})")
-            params.extend(expanded_brands)
-        if color_filter:
-            placeholders = ','.join(['%s'] * len(color_filter))
-            conditions.append(f"de.vehicle_color IN ({placeholders})")
-            params.extend(color_filter)
-        if vehicle_type_filter:
-            placeholders = ','.join(['%s'] * len(vehicle_type_filter))
-            conditions.append(f"de.vehicle_type IN ({placeholders})")
-            params.extend(vehicle_type_filter)
+        _dimension_conditions(conditions, params, brand_filter, color_filter,
+                              vehicle_type_filter, prefix="de.")
+        window = _dedup_window(collapse_window)
+        if window:
+            _passage_start_condition(
+                conditions, params, window, search_term=search_term, brand_filter=brand_filter,
+                color_filter=color_filter, type_filter=vehicle_type_filter,
+                start_date_filter=start_date, end_date_filter=end_date,
+            )
 
         where = ""
         if conditions:
@@ -772,15 +1718,7 @@ def fetch_browsable_images(cursor_ts=None, cursor_id=None, limit=5, direction='f
         params.append(limit)
         cur.execute(query, params)
 
-        columns = [desc[0] for desc in cur.description]
-        results = []
-        for row in cur.fetchall():
-            row_dict = dict(zip(columns, row))
-            if row_dict.get('created_at'):
-                row_dict['created_at'] = row_dict['created_at'].isoformat()
-            row_dict['image_id'] = str(row_dict['image_id'])
-            row_dict['event_id'] = str(row_dict['event_id'])
-            results.append(row_dict)
+        results = _fetch_records(cur)
 
         # Backward fetch returns ASC order, reverse to get DESC
         if direction == 'backward':
@@ -801,17 +1739,46 @@ def fetch_browsable_images(cursor_ts=None, cursor_id=None, limit=5, direction='f
             _put_conn(conn)
 
 
+@_statement_budget("image")
 def fetch_browse_image_by_id(image_id):
-    """Fetch raw image bytes and type for a single image by ID."""
+    """
+    Fetch one image by ID for serving. Returns None if it does not exist, else a
+    dict with image_type and either image_path (a file in the local blob store, to
+    be sent with sendfile) or image_data (bytes, served from image_cache when possible).
+    """
+    key = str(image_id).lower()
+    cached = image_cache.cache.get(key)
+    if cached is not None:
+        return {'image_data': cached[0], 'image_type': cached[1]}
+    ref = image_cache.refs.get(key)
+    if ref is not None:
+        path = blob_store.store.path(ref[0])
+        if path:
+            return {'image_path': path, 'image_sha256': ref[0], 'image_type': ref[1]}
     conn = None
     try:
-        conn = _get_conn()
+        conn = _get_conn(readonly=True)
         cur = conn.cursor()
-        cur.execute("SELECT image_data, image_type FROM event_images WHERE id = %s", (str(image_id),))
+        columns = "image_data, image_type, image_sha256" if blob_store.store else "image_data, image_type"
+        cur.execute(f"SELECT {columns} FROM event_images WHERE id = %s", (key,))
         row = cur.fetchone()
         cur.close()
-        if row and row[0]:
-            return {'image_data': bytes(row[0]), 'image_type': row[1]}
+        _put_conn(conn)
+        conn = None
+        if not row:
+            return None
+        image_data, image_type = row[0], row[1]
+        sha256 = row[2] if len(row) > 2 else None
+        if image_data is None and sha256:
+            image_cache.refs.put(key, sha256, image_type)
+            path = blob_store.store.path(sha256)
+            if path:
+                return {'image_path': path, 'image_sha256': sha256, 'image_type': image_type}
+        data = _load_blob(image_data, sha256)
+        if data:
+            data = bytes(data)
+            image_cache.cache.put(key, data, image_type)
+            return {'image_data': data, 'image_type': image_type}
         return None
     except psycopg2.Error as e:
         logger.error("Error fetching browse image by id: %s", e)
@@ -826,6 +1793,7 @@ def fetch_browse_image_by_id(image_id):
             _put_conn(conn)
 
 
+@_statement_budget("image")
 def fetch_image_by_event_id(event_id):
     """
     Recupera todas las imágenes (image_data y image_type) para un event_id dado.
@@ -833,13 +1801,14 @@ def fetch_image_by_event_id(event_id):
     """
     conn = None
     try:
-        conn = _get_conn()
+        conn = _get_conn(readonly=True)
         cur = conn.cursor()
         try:
+            # Ids first: blobs already in image_cache are not read (or detoasted) again
             query = """
             SELECT
-                image_data,
-                image_type
+                id,
+                image_type""" + (", image_sha256" if blob_store.store else ", NULL") + """
             FROM
                 event_images
             WHERE
@@ -853,13 +1822,39 @@ def fetch_image_by_event_id(event_id):
                 END;
             """
             cur.execute(query, (str(event_id),))
+            images = cur.fetchall()
+
+            blobs = {}
+            missing = []
+            for image_id, image_type, sha256 in images:
+                cached = image_cache.cache.get(image_id)
+                if cached is not None:
+                    blobs[image_id] = cached[0]
+                elif sha256:
+                    data = _load_blob(None, sha256)
+                    if data:
+                        blobs[image_id] = data
+                        if not blob_store.store.has_paths:
+                            image_cache.cache.put(image_id, data, image_type)
+                else:
+                    missing.append(image_id)
+            if missing:
+                cur.execute(
+                    "SELECT id, image_data FROM event_images WHERE id = ANY(%s::uuid[])",
+                    (missing,),
+                )
+                types = {image_id: image_type for image_id, image_type, _sha in images}
+                for image_id, image_data in cur.fetchall():
+                    if image_data:
+                        data = bytes(image_data)
+                        blobs[image_id] = data
+                        image_cache.cache.put(image_id, data, types[image_id])
 
             results = []
-            for row in cur.fetchall():
-                image_data, image_type = row
-                if image_data:
+            for image_id, image_type, _sha in images:
+                if blobs.get(image_id):
                     results.append({
-                        'image_data': base64.b64encode(image_data).decode('utf-8'),
+                        'image_data': _b64(blobs[image_id]),
                         'image_type': image_type
                     })
             return results
@@ -876,4 +1871,107 @@ def fetch_image_by_event_id(event_id):
         raise DBError("Database operation failed") from e
     finally:
         if conn:
-            _put_conn(conn)
\ No newline at end of file
+            _put_conn(conn)
+
+@_statement_budget("listing")
+def fetch_image_ids_by_event_ids(event_ids):
+    """
+    Fetch image ids and types (no image_data) for several events in a single query.
+    Returns a dict event_id -> list of {'image_id', 'image_type'} in carousel order;
+    events without images are omitted.
+    """
+    if not event_ids:
+        return {}
+    conn = None
+    try:
+        conn = _get_conn(readonly=True)
+        cur = conn.cursor()
+        try:
+            query = """
+            SELECT
+                event_id,
+                id,
+                image_type
+            FROM
+                event_images
+            WHERE
+                event_id = ANY(%s::uuid[])
+            ORDER BY
+                event_id,
+                CASE image_type
+                    WHEN 'vehicle_detection' THEN 1
+                    WHEN 'vehicle_picture' THEN 2
+                    WHEN 'plate' THEN 3
+                    ELSE 4
+                END,
+                id;
+            """
+            cur.execute(query, ([str(e) for e in event_ids],))
+
+            results = {}
+            for event_id_val, image_id_val, image_type in cur.fetchall():
+                results.setdefault(str(event_id_val), []).append({
+                    'image_id': str(image_id_val),
+                    'image_type': image_type
+                })
+            return results
+        finally:
+            cur.close()
+
+    except psycopg2.Error as e:
+        logger.error("Error fetching image ids by event ids: %s", e)
+        raise DBError("Database operation failed") from e
+    except RuntimeError:
+        raise
+    except Exception as e:
+        logger.error("Error fetching image ids by event ids: %s", e)
+        raise DBError("Database operation failed") from e
+    finally:
+        if conn:
+            _put_conn(conn)
+
+
+def migrate_blob_batch(batch_size=100, clear_image_data=True):
+    """
+    Move up to batch_size event_images blobs from image_data to the blob store.
+
+    Rows are locked with SKIP LOCKED so several migrators can run side by side.
+    image_sha256 is only set after the blob is stored, and image_data is cleared
+    in the same transaction unless clear_image_data is False. Returns
+    (rows migrated, bytes moved). Raises DBError on DB or blob store failure.
+    """
+    if blob_store.store is None:
+        raise RuntimeError("No blob store configured (set BLOB_STORE)")
+    conn = None
+    try:
+        conn = _get_conn()
+        cur = conn.cursor()
+        cur.execute(
+            """
+            SELECT id, image_data FROM event_images
+            WHERE image_sha256 IS NULL AND image_data IS NOT NULL
+            ORDER BY created_at
+            LIMIT %s
+            FOR UPDATE SKIP LOCKED
+            """,
+            (batch_size,),
+        )
+        updates = []
+        moved = 0
+        for image_id, image_data in cur.fetchall():
+            updates.append((blob_store.store.put(bytes(image_data)), image_id))
+            moved += len(image_data)
+        if updates:
+            assignment = "image_sha256 = %s, image_data = NULL" if clear_image_data else "image_sha256 = %s"
+            psycopg2.extras.execute_batch(
+                cur, f"UPDATE event_images SET {assignment} WHERE id = %s", updates,
+            )
+        conn.commit()
+        cur.close()
+        return len(updates), moved
+    except (psycopg2.Error, blob_store.BlobStoreError) as e:
+        logger.error("Error migrating image blobs: %s", e)
+        raise DBError("Blob migration failed") from e
+    finally:
+        if conn:
+            _put_conn(conn)
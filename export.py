@@ -0,0 +1,307 @@
+"""
+Bulk export of detection metadata as CSV or Parquet.
+
+/api/all_patents pages are for the UI: every call pays for a COUNT(*) and an
+OFFSET scan. An export instead reads the rows matching the same filters
+(db_utils._build_where_clause) in one pass, in (created_at, id) order, through
+a server-side cursor, and streams them out EXPORT_BATCH_ROWS at a time, so
+memory stays constant whatever the size of the extract.
+
+Exports are incremental: the rows after a watermark (since, since_id) up to
+the newest matching row older than EXPORT_LAG_SECONDS are exported from one
+REPEATABLE READ snapshot, and that last row is the next watermark. It is
+returned in the X-Export-Watermark / X-Export-Watermark-Id headers by
+GET /api/export and printed by the CLI:
+
+    python export.py --format parquet -o detections.parquet --brand Toyota
+    python export.py --since 2026-01-31T00:00:00+00:00 --since-id <uuid> > new.csv
+
+Brand, color and type are canonicalized like in the API. CSV with --raw skips
+that and streams Postgres' own COPY ... TO STDOUT output, the fastest path
+for very large extracts. Parquet needs the optional pyarrow package.
+"""
+import argparse
+import csv
+import io
+import logging
+import os
+import sys
+
+import psycopg2
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+import db_utils
+from db_utils import DBError
+
+# pyarrow is optional and only Parquet exports need it: imported by
+# _import_pyarrow() on the first one, since loading it is slower than the app
+pyarrow = None
+
+logger = logging.getLogger(__name__)
+
+EXPORT_BATCH_ROWS = int(os.environ.get("EXPORT_BATCH_ROWS", "10000"))
+# 0 disables the statement timeout on export connections
+EXPORT_STATEMENT_TIMEOUT_MS = int(os.environ.get("EXPORT_STATEMENT_TIMEOUT_MS", "600000"))
+# Rows younger than this are left for the next export, so rows committed
+# slightly out of created_at order are not skipped by the watermark
+EXPORT_LAG_SECONDS = float(os.environ.get("EXPORT_LAG_SECONDS", "2"))
+
+FORMATS = ("csv", "parquet")
+MIMETYPES = {"csv": "text/csv", "parquet": "application/vnd.apache.parquet"}
+_NIL_UUID = "00000000-0000-0000-0000-000000000000"
+
+COLUMNS = ("event_id", "plate_text", "vehicle_brand", "vehicle_color", "vehicle_type",
+           "plate_confidence", "created_at")
+_SELECT = """
+    SELECT id AS event_id, camera_plate_text AS plate_text, vehicle_brand, vehicle_color,
+           vehicle_type, camera_confidence AS plate_confidence, created_at
+    FROM detection_events"""
+
+
+def _import_pyarrow():
+    """Import pyarrow into this module. False if it is not installed."""
+    global pyarrow
+    if pyarrow is None:
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            return False
+    return True
+
+
+def _parquet_schema():
+    return pyarrow.schema([
+        ("event_id", pyarrow.string()),
+        ("plate_text", pyarrow.string()),
+        ("vehicle_brand", pyarrow.string()),
+        ("vehicle_color", pyarrow.string()),
+        ("vehicle_type", pyarrow.string()),
+        ("plate_confidence", pyarrow.float64()),
+        ("created_at", pyarrow.timestamp("us", tz="UTC")),
+    ])
+
+
+class _ChunkSink(io.RawIOBase):
+    """Write-only file that hands what was written so far to the caller, for streaming."""
+
+    def __init__(self):
+        super().__init__()
+        self._chunks = []
+        self._position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        data = bytes(data)
+        self._chunks.append(data)
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def drain(self):
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+class Export:
+    """
+    One export: the rows matching `filters` (keyword arguments of
+    db_utils._build_where_clause) after the (since, since_id) watermark, read
+    from a single snapshot. Opening it fixes `watermark`, the (created_at, id)
+    of the last row it will produce, or None when there is nothing new.
+    """
+
+    def __init__(self, filters=None, since=None, since_id=None, conn=None):
+        self.filters = dict(filters or {})
+        if isinstance(since, str) and not db_utils._validate_date(since):
+            raise ValueError("since must be an ISO timestamp")
+        self.since = since
+        self.since_id = since_id or _NIL_UUID
+        self.watermark = None
+        self._conn = conn
+        self._owns_conn = conn is None
+        self._where = ""
+        self._params = []
+
+    def open(self):
+        try:
+            if self._conn is None:
+                self._conn = db_utils.connect_direct(statement_timeout_ms=EXPORT_STATEMENT_TIMEOUT_MS)
+            self._conn.set_session(isolation_level="REPEATABLE READ", readonly=True)
+            where, params = db_utils._build_where_clause(**self.filters)
+            conditions = [where[len(" WHERE "):]] if where else []
+            params = list(params)
+            conditions.append("created_at < now() - make_interval(secs => %s)")
+            params.append(EXPORT_LAG_SECONDS)
+            if self.since:
+                conditions.append("(created_at, id) > (%s, %s::uuid) AND created_at >= %s")
+                params.extend([self.since, self.since_id, self.since])
+            with self._conn.cursor() as cur:
+                cur.execute(
+                    "SELECT created_at, id FROM detection_events WHERE " + " AND ".join(conditions)
+                    + " ORDER BY created_at DESC, id DESC LIMIT 1",
+                    params,
+                )
+                self.watermark = cur.fetchone()
+            if self.watermark:
+                conditions.append("(created_at, id) <= (%s, %s::uuid) AND created_at <= %s")
+                params.extend([self.watermark[0], self.watermark[1], self.watermark[0]])
+            self._where = " WHERE " + " AND ".join(conditions)
+            self._params = params
+        except psycopg2.Error as e:
+            logger.error("Export could not start: %s", e)
+            self.close()
+            raise DBError("Export could not start") from e
+        return self
+
+    def close(self):
+        if self._conn is not None and not self._conn.closed:
+            if self._owns_conn:
+                self._conn.close()
+            else:
+                self._conn.rollback()
+        if self._owns_conn:
+            self._conn = None
+
+    def __enter__(self):
+        return self.open()
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _query(self):
+        return _SELECT + self._where + " ORDER BY created_at, id"
+
+    def batches(self):
+        """Lists of up to EXPORT_BATCH_ROWS rows (tuples in COLUMNS order), canonicalized."""
+        if self.watermark is None:
+            return
+        try:
+            with self._conn.cursor(name="export") as cur:
+                cur.itersize = EXPORT_BATCH_ROWS
+                cur.execute(self._query(), self._params)
+                while True:
+                    rows = cur.fetchmany(EXPORT_BATCH_ROWS)
+                    if not rows:
+                        break
+                    # Few distinct values per batch: canonicalize each once
+                    brands = {v: db_utils.normalize_vehicle_brand(v) for v in {r[2] for r in rows}}
+                    colors = {v: db_utils.canonicalize('color', v) for v in {r[3] for r in rows}}
+                    types = {v: db_utils.canonicalize('type', v) for v in {r[4] for r in rows}}
+                    yield [
+                        (event_id, plate_text, brands[brand], colors[color], types[vtype],
+                         confidence, created_at)
+                        for event_id, plate_text, brand, color, vtype, confidence, created_at in rows
+                    ]
+        except psycopg2.Error as e:
+            logger.error("Export failed: %s", e)
+            raise DBError("Export failed") from e
+
+    def csv_chunks(self):
+        """CSV bytes, a header and then one chunk per batch."""
+        buffer = io.StringIO()
+        writer = csv.writer(buffer, lineterminator="\n")
+        writer.writerow(COLUMNS)
+        for rows in self.batches():
+            # Same ISO 8601 timestamps as the JSON API
+            writer.writerows(row[:-1] + (row[-1].isoformat(),) for row in rows)
+            yield buffer.getvalue().encode()
+            buffer.seek(0)
+            buffer.truncate()
+        if buffer.tell():
+            yield buffer.getvalue().encode()
+
+    def parquet_chunks(self):
+        """Parquet bytes, one row group per batch and the footer last."""
+        schema = _parquet_schema()
+        sink = _ChunkSink()
+        writer = pyarrow.parquet.ParquetWriter(sink, schema, compression="zstd")
+        try:
+            for rows in self.batches():
+                columns = list(zip(*rows))
+                writer.write_table(pyarrow.Table.from_arrays(
+                    [pyarrow.array(values, type=field.type) for values, field in zip(columns, schema)],
+                    schema=schema,
+                ))
+                yield sink.drain()
+        finally:
+            writer.close()
+        yield sink.drain()
+
+    def chunks(self, fmt):
+        """The export as an iterator of bytes in `fmt` ("csv" or "parquet")."""
+        if fmt == "parquet":
+            if not _import_pyarrow():
+                raise ValueError("Parquet export requires the pyarrow package")
+            return self.parquet_chunks()
+        return self.csv_chunks()
+
+    def copy_csv(self, out):
+        """Write the rows as stored (no canonicalization) to binary file `out` with COPY."""
+        if self.watermark is None:
+            out.write((",".join(COLUMNS) + "\n").encode())
+            return
+        try:
+            with self._conn.cursor() as cur:
+                query = cur.mogrify(self._query(), self._params).decode()
+                cur.copy_expert(f"COPY ({query}) TO STDOUT WITH (FORMAT csv, HEADER)", out)
+        except psycopg2.Error as e:
+            logger.error("Export failed: %s", e)
+            raise DBError("Export failed") from e
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export detection metadata as CSV or Parquet.")
+    parser.add_argument("--format", choices=FORMATS, default="csv")
+    parser.add_argument("-o", "--output", help="output file (default: stdout)")
+    parser.add_argument("--raw", action="store_true",
+                        help="CSV only: stream COPY output, without canonicalizing brand/color/type")
+    parser.add_argument("--since", help="export rows after this ISO timestamp (a previous watermark)")
+    parser.add_argument("--since-id", help="event id of the previous watermark")
+    parser.add_argument("--search", dest="search_term")
+    parser.add_argument("--brand", dest="brand_filter", action="append")
+    parser.add_argument("--color", dest="color_filter", action="append")
+    parser.add_argument("--type", dest="type_filter", action="append")
+    parser.add_argument("--start", dest="start_date_filter")
+    parser.add_argument("--end", dest="end_date_filter")
+    parser.add_argument("--min-confidence", dest="min_confidence_filter", type=float)
+    args = parser.parse_args(argv)
+    if args.raw and args.format != "csv":
+        parser.error("--raw is only supported with --format csv")
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s",
+                        stream=sys.stderr)
+    filters = {k: getattr(args, k) for k in (
+        "search_term", "brand_filter", "color_filter", "type_filter",
+        "start_date_filter", "end_date_filter", "min_confidence_filter")}
+    if not args.raw:
+        # Canonical filter values expand to their raw spellings
+        db_utils.fetch_filter_options()
+    out = open(args.output, "wb") if args.output else sys.stdout.buffer
+    try:
+        with Export(filters, since=args.since, since_id=args.since_id) as export:
+            if args.raw:
+                export.copy_csv(out)
+            else:
+                for chunk in export.chunks(args.format):
+                    out.write(chunk)
+    finally:
+        if args.output:
+            out.close()
+    if export.watermark:
+        logger.info("Watermark: --since %s --since-id %s", export.watermark[0].isoformat(),
+                    export.watermark[1])
+    else:
+        logger.info("No new rows since the watermark")
+
+
+if __name__ == "__main__":
+    main()
@@ -4,77 +4,94 @@ from dotenv import load_dotenv
 
 load_dotenv()
 
+import blob_store
+
 # --- Configuración de la Base de Datos ---
-DB_HOST = os.environ["DB_HOST"]
-DB_NAME = os.environ["DB_NAME"]
-DB_USER = os.environ["DB_USER"]
-DB_PASSWORD = os.environ["DB_PASSWORD"]
+DB_HOST = os.environ.get("DB_HOST")
+DB_NAME = os.environ.get("DB_NAME")
+DB_USER = os.environ.get("DB_USER")
+DB_PASSWORD = os.environ.get("DB_PASSWORD")
 
 # --- Directorio de Salida ---
 OUTPUT_DIR = "imagenes_extraidas"
 
-# Asegúrate de que el directorio de salida exista
-if not os.path.exists(OUTPUT_DIR):
-    os.makedirs(OUTPUT_DIR)
-
-conn = None
-try:
-    # Establecer la conexión a la base de datos
-    print("Conectando a la base de datos...")
-    conn = psycopg2.connect(host=DB_HOST, database=DB_NAME, user=DB_USER, password=DB_PASSWORD)
-    cur = conn.cursor()
-    print("Conexión exitosa. Extrayendo imágenes...")
-
-    # Consulta para obtener los datos de las imágenes
-    # Puedes modificar esta consulta para filtrar imágenes específicas:
-    # Por ejemplo, para un tipo de imagen específico:
-    # cur.execute("SELECT id, image_type, file_name, image_data FROM event_images WHERE image_type =
-    # 'vehicle_picture' LIMIT 20;")
-    # O para un evento específico:
-    # cur.execute("SELECT id, image_type, file_name, image_data FROM event_images WHERE event_id = 'TU_EVENT_I
-    # LIMIT 1;")
-    # Por ahora, extraemos las primeras 100 imágenes (puedes ajustar el LIMIT)
-    cur.execute("SELECT id, image_type, file_name, image_data FROM event_images ORDER BY id DESC LIMIT 10;")
-
-    images = cur.fetchall()
-
-    if not images:
-        print("No se encontraron imágenes con la consulta actual.")
-    else:
-        for img_id, img_type, file_name, img_data in images:
-            # Intentar determinar la extensión del archivo
-            extension = ".bin" # Por defecto si no se puede determinar
-            if file_name and "." in file_name:
-                ext = os.path.splitext(file_name)[1].lower()
-                if ext in [".jpg", ".jpeg", ".png", ".gif", ".webp"]:
-                    extension = ext
-            elif "jpeg" in img_type.lower():
-                extension = ".jpeg"
-            elif "png" in img_type.lower():
-                extension = ".png"
-
-            # Crear un nombre de archivo seguro y único
-            # Usamos el ID de la imagen para asegurar que sea único
-            # Y el tipo de imagen para que sea descriptivo
-            output_filename = f"{img_id}_{img_type}{extension}"
-
-            # Si el file_name original es útil y seguro, podríamos intentar usarlo
-            # Pero para evitar problemas con caracteres no válidos en rutas, es mejor basarse en el ID.
-            # Puedes ajustar esta lógica si confías en los file_name originales.
-
-            output_path = os.path.join(OUTPUT_DIR, output_filename)
-
-            with open(output_path, 'wb') as f:
-                f.write(img_data)
-            print(f"Imagen guardada: {output_path}")
-
-    cur.close()
-
-except psycopg2.Error as e:
-    print(f"Error de base de datos: {e}")
-except Exception as e:
-    print(f"Un error inesperado ocurrió: {e}")
-finally:
-    if conn:
-        conn.close()
-        print("Conexión a la base de datos cerrada.")
\ No newline at end of file
+
+def main():
+    """Extrae las últimas imágenes de event_images a OUTPUT_DIR."""
+    # Asegúrate de que el directorio de salida exista
+    if not os.path.exists(OUTPUT_DIR):
+        os.makedirs(OUTPUT_DIR)
+
+    conn = None
+    try:
+        # Establecer la conexión a la base de datos
+        print("Conectando a la base de datos...")
+        conn = psycopg2.connect(host=DB_HOST, database=DB_NAME, user=DB_USER, password=DB_PASSWORD)
+        cur = conn.cursor()
+        print("Conexión exitosa. Extrayendo imágenes...")
+
+        # Consulta para obtener los datos de las imágenes
+        # Puedes modificar esta consulta para filtrar imágenes específicas:
+        # Por ejemplo, para un tipo de imagen específico:
+        # cur.execute("SELECT id, image_type, file_name, image_data FROM event_images WHERE image_type =
+        # 'vehicle_picture' LIMIT 20;")
+        # O para un evento específico:
+        # cur.execute("SELECT id, image_type, file_name, image_data FROM event_images WHERE event_id = 'TU_EVENT_I
+        # LIMIT 1;")
+        # Por ahora, extraemos las primeras 100 imágenes (puedes ajustar el LIMIT)
+        # Con BLOB_STORE, las filas migradas tienen image_data NULL y el blob bajo image_sha256
+        sha_column = "image_sha256" if blob_store.store else "NULL"
+        cur.execute(f"SELECT id, image_type, file_name, image_data, {sha_column} FROM event_images "
+                    "ORDER BY id DESC LIMIT 10;")
+
+        images = cur.fetchall()
+
+        if not images:
+            print("No se encontraron imágenes con la consulta actual.")
+        else:
+            for img_id, img_type, file_name, img_data, sha256 in images:
+                if img_data is None and sha256:
+                    img_data = blob_store.store.get(sha256)
+                if img_data is None:
+                    print(f"Imagen sin datos, omitida: {img_id}")
+                    continue
+                # Intentar determinar la extensión del archivo
+                extension = ".bin" # Por defecto si no se puede determinar
+                if file_name and "." in file_name:
+                    ext = os.path.splitext(file_name)[1].lower()
+                    if ext in [".jpg", ".jpeg", ".png", ".gif", ".webp"]:
+                        extension = ext
+                elif "jpeg" in img_type.lower():
+                    extension = ".jpeg"
+                elif "png" in img_type.lower():
+                    extension = ".png"
+
+                # Crear un nombre de archivo seguro y único
+                # Usamos el ID de la imagen para asegurar que sea único
+                # Y el tipo de imagen para que sea descriptivo
+                output_filename = f"{img_id}_{img_type}{extension}"
+
+                # Si el file_name original es útil y seguro, podríamos intentar usarlo
+                # Pero para evitar problemas con caracteres no válidos en rutas, es mejor basarse en el ID.
+                # Puedes ajustar esta lógica si confías en los file_name originales.
+
+                output_path = os.path.join(OUTPUT_DIR, output_filename)
+
+                with open(output_path, 'wb') as f:
+                    f.write(img_data)
+                print(f"Imagen guardada: {output_path}")
+
+        cur.close()
+
+    except psycopg2.Error as e:
+        print(f"Error de base de datos: {e}")
+    except Exception as e:
+        print(f"Un error inesperado ocurrió: {e}")
+    finally:
+        if conn:
+            conn.close()
+            print("Conexión a la base de datos cerrada.")
+
+
+if __name__ == "__main__":
+    main()
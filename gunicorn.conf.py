@@ -5,6 +5,11 @@ worker_class = "gthread"
 workers = int(os.environ.get("WEB_CONCURRENCY", "2"))
 threads = int(os.environ.get("WEB_THREADS", "4"))
 
+# Import the app once in the master and fork workers from it: imports, static
+# precompression, compiled templates and primed caches are shared copy-on-write.
+# DB connections are not: when_ready closes the master's pools before forking.
+preload_app = os.environ.get("GUNICORN_PRELOAD", "true").lower() in {"true", "1", "yes", "on"}
+
 # Timeouts
 timeout = 60
 graceful_timeout = 30
@@ -19,35 +24,45 @@ loglevel = "info"
 bind = f"0.0.0.0:{os.environ.get('PORT', '10000')}"
 
 
+def when_ready(server):
+    """
+    Master is ready to fork. With preload_app the app (and db_utils) is already
+    imported here: warm what workers can inherit, then drop the master's DB
+    connections so no socket is shared with the children.
+    """
+    if not preload_app:
+        return
+    import app
+    import db_utils
+    import warmup
+
+    warmup.warm(app.app, pool=False)
+    db_utils.close_pools()
+
+
 def post_fork(server, worker):
     """
-    Re-initialise the DB connection pool in each worker after fork.
+    Reset per-process clients in each worker after fork.
 
-    gunicorn uses a pre-fork model: the master process forks workers AFTER
-    importing the app. psycopg2 connections are NOT fork-safe, so we must
-    close the inherited pool and create a fresh one per worker.
+    psycopg2 connections are NOT fork-safe. db_utils needs nothing here: its
+    pools are created lazily by the process that uses them, so a worker opens
+    its own on first use (warmup, or its first request) and never touches
+    connections inherited from the master.
     """
-    import db_utils
-    import psycopg2.pool
-
-    # Close connections inherited from the master process
-    try:
-        db_utils._pool.closeall()
-    except Exception:
-        pass
-
-    # Re-create the pool fresh for this worker
-    db_utils._pool = psycopg2.pool.ThreadedConnectionPool(
-        minconn=int(os.environ.get("DB_POOL_MIN", "2")),
-        maxconn=int(os.environ.get("DB_POOL_MAX", "10")),
-        host=db_utils.DB_HOST,
-        database=db_utils.DB_NAME,
-        user=db_utils.DB_USER,
-        password=db_utils.DB_PASSWORD,
-        connect_timeout=10,
-        options="-c statement_timeout=30000",
-        keepalives=1,
-        keepalives_idle=30,
-        keepalives_interval=5,
-        keepalives_count=5,
-    )
+    # A fresh blob store client: an S3 client used during the master's warmup
+    # may hold pooled HTTP connections
+    import blob_store
+    if blob_store.store is not None:
+        blob_store.store = blob_store.from_env()
+
+    # Optional in-process job workers (JOB_WORKER_THREADS); these are extra
+    # threads with their own connections, not gthread request slots
+    import jobs
+    jobs.start_in_process()
+
+
+def post_worker_init(worker):
+    """Warm this worker's pool connections and caches before it accepts requests."""
+    import warmup
+
+    warmup.warm(worker.wsgi)
@@ -0,0 +1,88 @@
+"""
+Worker-local LRU cache of raw image bytes, keyed by event_images.id.
+
+Camera images are written once and never updated, so a cached blob never
+goes stale; entries only leave the cache when it needs room. The bound is on
+total payload bytes (IMAGE_CACHE_MAX_BYTES per worker process), not on the
+number of entries, because image sizes vary between ~5 KB plates and
+~100 KB detection frames. Blobs larger than IMAGE_CACHE_MAX_ITEM_BYTES are
+never cached so one huge image cannot flush everything else.
+
+Each gunicorn worker has its own cache; the memory budget is
+IMAGE_CACHE_MAX_BYTES x WEB_CONCURRENCY. Set IMAGE_CACHE_MAX_BYTES=0 to disable.
+"""
+import collections
+import os
+import threading
+
+IMAGE_CACHE_MAX_BYTES = int(os.environ.get("IMAGE_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+IMAGE_CACHE_MAX_ITEM_BYTES = int(os.environ.get("IMAGE_CACHE_MAX_ITEM_BYTES", str(2 * 1024 * 1024)))
+
+
+class ImageCache:
+    """Thread-safe LRU mapping image id -> (bytes, image_type), bounded by total bytes."""
+
+    def __init__(self, max_bytes, max_item_bytes):
+        self.max_bytes = max_bytes
+        self.max_item_bytes = min(max_item_bytes, max_bytes)
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._bytes = 0
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+    def get(self, image_id):
+        """Return (data, image_type) or None, marking the entry as recently used."""
+        if self.max_bytes <= 0:
+            return None
+        with self._lock:
+            entry = self._entries.get(image_id)
+            if entry is None:
+                self._misses += 1
+                return None
+            self._entries.move_to_end(image_id)
+            self._hits += 1
+            return entry
+
+    def put(self, image_id, data, image_type):
+        """Store one blob, evicting least recently used entries until it fits."""
+        size = len(data)
+        if self.max_bytes <= 0 or size > self.max_item_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(image_id, None)
+            if old is not None:
+                self._bytes -= len(old[0])
+            while self._entries and self._bytes + size > self.max_bytes:
+                _key, (evicted, _type) = self._entries.popitem(last=False)
+                self._bytes -= len(evicted)
+                self._evictions += 1
+            self._entries[image_id] = (data, image_type)
+            self._bytes += size
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def metrics(self):
+        """Counters for /api/metrics."""
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                "enabled": self.max_bytes > 0,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self._hits,
+                "misses": self._misses,
+                "evictions": self._evictions,
+                "hit_ratio": round(self._hits / lookups, 4) if lookups else None,
+            }
+
+
+cache = ImageCache(IMAGE_CACHE_MAX_BYTES, IMAGE_CACHE_MAX_ITEM_BYTES)
+# image id -> sha256 of blobs in a local blob store, so browse_image can
+# sendfile() them without a DB round trip (64-byte values, ~16k entries)
+refs = ImageCache(1024 * 1024, 64)
@@ -0,0 +1,522 @@
+"""
+Background jobs: long-running work outside the request/response cycle.
+
+Requests enqueue a job (a row in background_jobs, migrations/003) and return
+immediately; workers claim jobs with FOR UPDATE SKIP LOCKED, run them on their
+own connection (JOB_STATEMENT_TIMEOUT_MS instead of the pool's 30 s) and store
+the JSON result, so the work is bounded by neither gunicorn's timeout nor the
+gthread slots.
+
+Workers run either as a sidecar process (the Procfile "worker" entry):
+
+    python jobs.py --threads 2
+
+or as JOB_WORKER_THREADS extra threads inside each gunicorn worker (started in
+gunicorn.conf.py post_fork). Each runner keeps one control connection that
+LISTENs for new jobs, writes heartbeats and progress, forwards cancellations
+and requeues jobs whose worker stopped heartbeating (JOB_STALE_SECONDS).
+
+Job kinds are plain functions registered with @job("kind"). They receive a
+JobContext first and the job params as keyword arguments; db_utils functions
+called inside run on the job's connection.
+"""
+import argparse
+import inspect
+import json
+import logging
+import os
+import select
+import signal
+import socket
+import threading
+import time
+
+import psycopg2
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+import db_utils
+import json_provider
+from db_utils import DBError
+
+logger = logging.getLogger(__name__)
+
+JOB_WORKER_THREADS = int(os.environ.get("JOB_WORKER_THREADS", "0"))
+# 0 disables the statement timeout on job connections
+JOB_STATEMENT_TIMEOUT_MS = int(os.environ.get("JOB_STATEMENT_TIMEOUT_MS", "600000"))
+JOB_POLL_SECONDS = float(os.environ.get("JOB_POLL_SECONDS", "5"))
+JOB_HEARTBEAT_SECONDS = float(os.environ.get("JOB_HEARTBEAT_SECONDS", "5"))
+JOB_STALE_SECONDS = float(os.environ.get("JOB_STALE_SECONDS", "120"))
+
+_CHANNEL = "background_jobs"
+STATUSES = ("queued", "running", "succeeded", "failed", "cancelled")
+_SUMMARY_COLUMNS = ("id, kind, params, status, progress, progress_message, error, "
+                    "cancel_requested, attempts, worker, created_at, started_at, finished_at")
+
+# kind -> function
+_registry = {}
+
+
+class JobCancelled(Exception):
+    """Raised by JobContext.check() once cancellation of the job was requested."""
+
+
+def job(kind):
+    """Register the decorated function as the handler for `kind`."""
+    def decorator(fn):
+        _registry[kind] = fn
+        return fn
+    return decorator
+
+
+def kinds():
+    return sorted(_registry)
+
+
+def validate(kind, params):
+    """Raise ValueError unless `kind` is registered and accepts `params`."""
+    fn = _registry.get(kind) if isinstance(kind, str) else None
+    if fn is None:
+        raise ValueError(f"Unknown job kind {kind!r}")
+    if not isinstance(params, dict):
+        raise ValueError("params must be an object")
+    try:
+        inspect.signature(fn).bind(None, **params)
+    except TypeError as e:
+        raise ValueError(f"Invalid params for {kind}: {e}") from e
+
+
+class JobContext:
+    """Handed to a running job: progress reporting and cooperative cancellation."""
+
+    def __init__(self, job_id, kind, attempt):
+        self.job_id = job_id
+        self.kind = kind
+        self.attempt = attempt
+        self.progress_value = 0.0
+        self.progress_message = None
+        self.cancelled = False
+        self.dirty = False
+
+    def progress(self, done, total=None, message=None):
+        """Record progress; written to the job row with the next heartbeat."""
+        if total:
+            self.progress_value = max(0.0, min(1.0, done / total))
+        self.progress_message = message
+        self.dirty = True
+
+    def check(self):
+        """Raise JobCancelled if the job was cancelled. Call between units of work."""
+        if self.cancelled:
+            raise JobCancelled()
+
+
+# ---------------------------------------------------------------------------
+# Queue operations (web side, pooled connections)
+# ---------------------------------------------------------------------------
+
+def enqueue(kind, params=None, max_attempts=3):
+    """Queue a job and wake idle workers. Returns the job id. Raises ValueError, DBError."""
+    params = params or {}
+    validate(kind, params)
+    conn = None
+    try:
+        conn = db_utils._get_conn()
+        cur = conn.cursor()
+        cur.execute(
+            "INSERT INTO background_jobs (kind, params, max_attempts) VALUES (%s, %s, %s) RETURNING id",
+            (kind, json.dumps(params), max_attempts),
+        )
+        job_id = cur.fetchone()[0]
+        cur.execute(f"NOTIFY {_CHANNEL}")
+        conn.commit()
+        cur.close()
+        return job_id
+    except psycopg2.Error as e:
+        logger.error("Error enqueueing %s job: %s", kind, e)
+        raise DBError("Database operation failed") from e
+    finally:
+        if conn:
+            db_utils._put_conn(conn)
+
+
+def get_job(job_id):
+    """Status, progress and (once finished) result of one job, or None."""
+    conn = None
+    try:
+        conn = db_utils._get_conn()
+        cur = conn.cursor()
+        cur.execute(f"SELECT {_SUMMARY_COLUMNS}, result FROM background_jobs WHERE id = %s", (job_id,))
+        records = db_utils._fetch_records(cur)
+        cur.close()
+        return records[0] if records else None
+    except psycopg2.Error as e:
+        logger.error("Error fetching job %s: %s", job_id, e)
+        raise DBError("Database operation failed") from e
+    finally:
+        if conn:
+            db_utils._put_conn(conn)
+
+
+def list_jobs(status=None, limit=20):
+    """Most recent jobs first, without results."""
+    conn = None
+    try:
+        conn = db_utils._get_conn()
+        cur = conn.cursor()
+        where = "WHERE status = %s" if status else ""
+        params = [status] if status else []
+        cur.execute(
+            f"SELECT {_SUMMARY_COLUMNS} FROM background_jobs {where} ORDER BY created_at DESC LIMIT %s",
+            params + [limit],
+        )
+        records = db_utils._fetch_records(cur)
+        cur.close()
+        return records
+    except psycopg2.Error as e:
+        logger.error("Error listing jobs: %s", e)
+        raise DBError("Database operation failed") from e
+    finally:
+        if conn:
+            db_utils._put_conn(conn)
+
+
+def cancel_job(job_id):
+    """
+    Cancel a job. Queued jobs are cancelled at once; running jobs are flagged and
+    stopped by their worker within a heartbeat. Returns the resulting status, or
+    None if the job does not exist.
+    """
+    conn = None
+    try:
+        conn = db_utils._get_conn()
+        cur = conn.cursor()
+        cur.execute(
+            """
+            UPDATE background_jobs SET
+                cancel_requested = cancel_requested OR status IN ('queued', 'running'),
+                status = CASE WHEN status = 'queued' THEN 'cancelled' ELSE status END,
+                finished_at = CASE WHEN status = 'queued' THEN now() ELSE finished_at END
+            WHERE id = %s
+            RETURNING status
+            """,
+            (job_id,),
+        )
+        row = cur.fetchone()
+        conn.commit()
+        cur.close()
+        return row[0] if row else None
+    except psycopg2.Error as e:
+        logger.error("Error cancelling job %s: %s", job_id, e)
+        raise DBError("Database operation failed") from e
+    finally:
+        if conn:
+            db_utils._put_conn(conn)
+
+
+# ---------------------------------------------------------------------------
+# Worker side
+# ---------------------------------------------------------------------------
+
+class JobRunner:
+    """
+    `threads` worker threads plus one control thread. Each worker thread owns a
+    connection used to claim jobs, run them (bound through db_utils.bound_connection)
+    and record the outcome.
+    """
+
+    def __init__(self, threads=1, name=None):
+        self.threads = threads
+        self.name = name or f"{socket.gethostname()}:{os.getpid()}"
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+        self._lock = threading.Lock()
+        self._running = {}   # job id -> (JobContext, worker connection)
+        self._workers = []
+
+    # -- lifecycle ----------------------------------------------------------
+
+    def start(self):
+        control = threading.Thread(target=self._control_loop, name="jobs-control", daemon=True)
+        control.start()
+        self._workers = [control]
+        for i in range(self.threads):
+            t = threading.Thread(target=self._worker_loop, args=(f"{self.name}/{i}",),
+                                 name=f"jobs-worker-{i}", daemon=True)
+            t.start()
+            self._workers.append(t)
+        logger.info("Job runner %s started with %d thread(s); kinds: %s",
+                    self.name, self.threads, ", ".join(kinds()))
+
+    def stop(self, timeout=30):
+        """Stop claiming jobs and wait up to `timeout` seconds for running ones."""
+        self._stop.set()
+        self._wake.set()
+        deadline = time.monotonic() + timeout
+        for t in self._workers:
+            t.join(max(0.0, deadline - time.monotonic()))
+        with self._lock:
+            leftover = list(self._running.values())
+        for ctx, conn in leftover:
+            # The worker puts the interrupted job back in the queue
+            logger.warning("Interrupting job %s (%s) on shutdown", ctx.job_id, ctx.kind)
+            conn.cancel()
+
+    # -- worker threads -----------------------------------------------------
+
+    def _worker_loop(self, worker_name):
+        conn = None
+        while not self._stop.is_set():
+            try:
+                if conn is None or conn.closed:
+                    conn = db_utils.connect_direct(JOB_STATEMENT_TIMEOUT_MS)
+                self._wake.clear()
+                claimed = self._claim(conn, worker_name)
+                if claimed is None:
+                    self._wake.wait(JOB_POLL_SECONDS)
+                    continue
+                conn = self._run(conn, worker_name, *claimed)
+            except psycopg2.Error as e:
+                logger.error("Job worker %s lost its connection: %s", worker_name, e)
+                if conn is not None:
+                    conn.close()
+                conn = None
+                self._stop.wait(JOB_POLL_SECONDS)
+            except Exception:
+                # Keep the thread alive; a job left 'running' is requeued once its heartbeat goes stale
+                logger.exception("Job worker %s hit an unexpected error", worker_name)
+                if conn is not None:
+                    conn.close()
+                conn = None
+                self._stop.wait(JOB_POLL_SECONDS)
+        if conn is not None:
+            conn.close()
+
+    def _claim(self, conn, worker_name):
+        cur = conn.cursor()
+        cur.execute(
+            """
+            UPDATE background_jobs SET
+                status = 'running', attempts = attempts + 1, worker = %s,
+                started_at = now(), heartbeat_at = now(),
+                progress = 0, progress_message = NULL, error = NULL
+            WHERE id = (
+                SELECT id FROM background_jobs WHERE status = 'queued'
+                ORDER BY created_at LIMIT 1
+                FOR UPDATE SKIP LOCKED
+            )
+            RETURNING id, kind, params, attempts
+            """,
+            (worker_name,),
+        )
+        row = cur.fetchone()
+        conn.commit()
+        cur.close()
+        return row
+
+    def _run(self, conn, worker_name, job_id, kind, params, attempt):
+        ctx = JobContext(job_id, kind, attempt)
+        with self._lock:
+            self._running[job_id] = (ctx, conn)
+        logger.info("Job %s (%s) started, attempt %d", job_id, kind, attempt)
+        started = time.monotonic()
+        status, result, error = "succeeded", None, None
+        try:
+            fn = _registry.get(kind)
+            if fn is None:
+                raise ValueError(f"Unknown job kind {kind!r}")
+            with db_utils.bound_connection(conn):
+                result = fn(ctx, **params)
+            ctx.check()
+            # A result that cannot be stored fails the job rather than the worker
+            result = None if result is None else json_provider.dumps(result)
+        except JobCancelled:
+            status = "cancelled"
+        except Exception as e:
+            if ctx.cancelled:
+                status = "cancelled"
+            elif self._stop.is_set():
+                status = "queued"
+            else:
+                status, error = "failed", f"{type(e).__name__}: {e}"
+                logger.exception("Job %s (%s) failed", job_id, kind)
+        finally:
+            with self._lock:
+                self._running.pop(job_id, None)
+
+        if conn.closed:
+            conn = db_utils.connect_direct(JOB_STATEMENT_TIMEOUT_MS)
+        conn.rollback()
+        cur = conn.cursor()
+        # Guarded by worker/status: a job requeued after a missed heartbeat belongs to someone else
+        cur.execute(
+            """
+            UPDATE background_jobs SET
+                status = %(status)s, result = %(result)s::jsonb, error = %(error)s,
+                finished_at = CASE WHEN %(status)s = 'queued' THEN NULL ELSE now() END,
+                worker = CASE WHEN %(status)s = 'queued' THEN NULL ELSE worker END,
+                progress = CASE WHEN %(status)s = 'succeeded' THEN 1 ELSE progress END
+            WHERE id = %(id)s AND worker = %(worker)s AND status = 'running'
+            """,
+            {"status": status, "result": result if status == "succeeded" else None,
+             "error": error, "id": job_id, "worker": worker_name},
+        )
+        conn.commit()
+        cur.close()
+        logger.info("Job %s (%s) %s in %.1fs", job_id, kind, status, time.monotonic() - started)
+        return conn
+
+    # -- control thread -----------------------------------------------------
+
+    def _control_loop(self):
+        conn = None
+        next_beat = 0.0
+        while not self._stop.is_set():
+            try:
+                if conn is None or conn.closed:
+                    conn = db_utils.connect_direct(autocommit=True)
+                    conn.cursor().execute(f"LISTEN {_CHANNEL}")
+                    self._wake.set()
+                timeout = max(0.0, min(JOB_HEARTBEAT_SECONDS, next_beat - time.monotonic()))
+                if select.select([conn], [], [], timeout) != ([], [], []):
+                    conn.poll()
+                    if conn.notifies:
+                        conn.notifies.clear()
+                        self._wake.set()
+                if time.monotonic() >= next_beat:
+                    self._heartbeat(conn)
+                    self._requeue_stale(conn)
+                    next_beat = time.monotonic() + JOB_HEARTBEAT_SECONDS
+            except psycopg2.Error as e:
+                logger.error("Job control connection failed: %s", e)
+                if conn is not None:
+                    conn.close()
+                conn = None
+                self._stop.wait(JOB_POLL_SECONDS)
+        if conn is not None:
+            conn.close()
+
+    def _heartbeat(self, conn):
+        with self._lock:
+            running = list(self._running.values())
+        if not running:
+            return
+        cur = conn.cursor()
+        for ctx, _ in running:
+            if ctx.dirty:
+                ctx.dirty = False
+                cur.execute(
+                    "UPDATE background_jobs SET heartbeat_at = now(), progress = %s, "
+                    "progress_message = %s WHERE id = %s",
+                    (ctx.progress_value, ctx.progress_message, ctx.job_id),
+                )
+        cur.execute(
+            "UPDATE background_jobs SET heartbeat_at = now() WHERE id = ANY(%s::uuid[]) "
+            "RETURNING id, cancel_requested",
+            ([ctx.job_id for ctx, _ in running],),
+        )
+        cancel = {job_id for job_id, requested in cur.fetchall() if requested}
+        cur.close()
+        for ctx, work_conn in running:
+            if ctx.job_id in cancel and not ctx.cancelled:
+                logger.info("Cancelling job %s (%s)", ctx.job_id, ctx.kind)
+                ctx.cancelled = True
+                # Interrupts the statement in flight; the job sees QueryCanceled
+                work_conn.cancel()
+
+    def _requeue_stale(self, conn):
+        cur = conn.cursor()
+        cur.execute(
+            """
+            UPDATE background_jobs SET
+                status = CASE WHEN cancel_requested THEN 'cancelled'
+                              WHEN attempts >= max_attempts THEN 'failed'
+                              ELSE 'queued' END,
+                error = 'worker stopped responding',
+                finished_at = CASE WHEN cancel_requested OR attempts >= max_attempts
+                                   THEN now() END,
+                worker = NULL
+            WHERE status = 'running' AND heartbeat_at < now() - make_interval(secs => %s)
+            RETURNING id, status
+            """,
+            (JOB_STALE_SECONDS,),
+        )
+        for job_id, status in cur.fetchall():
+            logger.warning("Job %s lost its worker; now %s", job_id, status)
+            if status == "queued":
+                self._wake.set()
+        cur.close()
+
+
+_runner = None
+
+
+def start_in_process():
+    """Start JOB_WORKER_THREADS worker threads in this process (no-op when 0)."""
+    global _runner
+    if JOB_WORKER_THREADS <= 0 or _runner is not None:
+        return None
+    _runner = JobRunner(JOB_WORKER_THREADS)
+    _runner.start()
+    return _runner
+
+
+# ---------------------------------------------------------------------------
+# Built-in job kinds
+# ---------------------------------------------------------------------------
+
+@job("stats")
+def _stats_job(ctx, start_date=None, end_date=None):
+    """/api/stats over ranges too large for a request."""
+    return db_utils.fetch_stats(start_date_filter=start_date, end_date_filter=end_date)
+
+
+@job("count_browsable")
+def _count_browsable_job(ctx, types=("vehicle_detection", "vehicle_picture"), start_date=None,
+                         end_date=None, search_term=None, brand_filter=None, color_filter=None,
+                         vehicle_type_filter=None):
+    """Exact carousel total for filters where the inline count would time out."""
+    return {"total_count": db_utils.count_browsable_images(
+        list(types), start_date=start_date, end_date=end_date, search_term=search_term,
+        brand_filter=brand_filter, color_filter=color_filter,
+        vehicle_type_filter=vehicle_type_filter,
+    )}
+
+
+@job("migrate_blobs")
+def _migrate_blobs_job(ctx, batch_size=100, keep_image_data=False):
+    """migrate_blobs.py as a job: one batch per transaction until nothing is pending."""
+    total_rows = total_bytes = 0
+    while True:
+        ctx.check()
+        rows, moved = db_utils.migrate_blob_batch(batch_size, clear_image_data=not keep_image_data)
+        if not rows:
+            return {"rows": total_rows, "bytes": total_bytes}
+        total_rows += rows
+        total_bytes += moved
+        ctx.progress(0, message=f"{total_rows} blobs moved ({total_bytes / 1e6:.1f} MB)")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run background job workers.")
+    parser.add_argument("--threads", type=int, default=max(JOB_WORKER_THREADS, 1),
+                        help="concurrent jobs in this process")
+    parser.add_argument("--shutdown-timeout", type=float, default=30.0,
+                        help="seconds to let running jobs finish on SIGTERM/SIGINT")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    runner = JobRunner(args.threads)
+    stopping = threading.Event()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(sig, lambda *_: stopping.set())
+    runner.start()
+    stopping.wait()
+    logger.info("Shutting down job runner")
+    runner.stop(args.shutdown_timeout)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,202 @@
+"""
+Per-route concurrency budgets (bulkheads) and queue-time load shedding.
+
+flask_limiter caps requests per client per minute; this module caps how much
+of a worker the requests in flight may use at once, so a few expensive calls
+cannot occupy every gthread slot and DB connection while cheap ones wait.
+
+Every endpoint belongs to a priority class:
+
+  - critical: /health, login/logout, static files. Never limited or shed.
+  - light (default): small metadata endpoints. Shed only when a request has
+    already waited SHED_LIGHT_MAX_WAIT_MS.
+  - heavy: endpoints marked @limit(priority="heavy"). At most
+    SHED_HEAVY_CONCURRENCY run at once per worker and they are shed after
+    SHED_HEAVY_MAX_WAIT_MS, leaving the remaining threads to light requests.
+
+A route can also get its own budget (@limit(priority="heavy", concurrency=1)).
+A request over budget waits for a slot, but only while its total queue time
+stays under its class threshold and only with as many waiters as the budget
+has slots; otherwise it gets 503 with Retry-After. Queue time includes the
+time spent upstream when the proxy sends X-Request-Start, e.g. nginx:
+
+    proxy_set_header X-Request-Start "t=${msec}";
+
+Budgets are per gunicorn worker process. LOAD_SHEDDING=false disables it.
+"""
+import logging
+import os
+import threading
+import time
+
+from flask import g, jsonify, request
+
+logger = logging.getLogger(__name__)
+
+_truthy = {"true", "1", "yes", "on"}
+LOAD_SHEDDING = os.environ.get("LOAD_SHEDDING", "true").lower() in _truthy
+_WEB_THREADS = int(os.environ.get("WEB_THREADS", "4"))
+SHED_HEAVY_CONCURRENCY = int(os.environ.get("SHED_HEAVY_CONCURRENCY", str(max(1, _WEB_THREADS // 2))))
+SHED_HEAVY_MAX_WAIT_MS = float(os.environ.get("SHED_HEAVY_MAX_WAIT_MS", "1000"))
+SHED_LIGHT_MAX_WAIT_MS = float(os.environ.get("SHED_LIGHT_MAX_WAIT_MS", "5000"))
+SHED_RETRY_AFTER_SECONDS = int(os.environ.get("SHED_RETRY_AFTER_SECONDS", "2"))
+
+_PRIORITIES = ("critical", "light", "heavy")
+
+
+class Bulkhead:
+    """A counting semaphore with a bounded wait queue and counters for /api/metrics."""
+
+    def __init__(self, name, limit, max_queue=None):
+        self.name = name
+        self.limit = limit
+        self.max_queue = limit if max_queue is None else max_queue
+        self._cond = threading.Condition()
+        self.in_flight = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.shed = 0
+
+    def acquire(self, timeout):
+        """Take a slot, waiting up to `timeout` seconds. False if the request must be shed."""
+        with self._cond:
+            if self.in_flight < self.limit:
+                self.in_flight += 1
+                self.admitted += 1
+                return True
+            if timeout <= 0 or self.waiting >= self.max_queue:
+                self.shed += 1
+                return False
+            deadline = time.monotonic() + timeout
+            self.waiting += 1
+            try:
+                while self.in_flight >= self.limit:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self.shed += 1
+                        return False
+                    self._cond.wait(remaining)
+                self.in_flight += 1
+                self.admitted += 1
+                return True
+            finally:
+                self.waiting -= 1
+
+    def reject(self):
+        """Count a request shed before it reached this bulkhead."""
+        with self._cond:
+            self.shed += 1
+
+    def release(self):
+        with self._cond:
+            self.in_flight -= 1
+            self._cond.notify()
+
+    def metrics(self):
+        with self._cond:
+            return {
+                "limit": self.limit,
+                "in_flight": self.in_flight,
+                "waiting": self.waiting,
+                "admitted": self.admitted,
+                "shed": self.shed,
+            }
+
+
+# Shared budget per priority class; critical has none
+_classes = {
+    "light": Bulkhead("light", _WEB_THREADS),
+    "heavy": Bulkhead("heavy", SHED_HEAVY_CONCURRENCY),
+}
+_max_wait = {
+    "light": SHED_LIGHT_MAX_WAIT_MS / 1000.0,
+    "heavy": SHED_HEAVY_MAX_WAIT_MS / 1000.0,
+}
+# endpoint name -> route Bulkhead
+_routes = {}
+
+
+def limit(priority="light", concurrency=None):
+    """
+    Put the decorated view in `priority` ("critical", "light" or "heavy") and,
+    with `concurrency`, give it its own budget of concurrent requests per worker.
+    Place it directly above the view function, below @app.route.
+    """
+    if priority not in _PRIORITIES:
+        raise ValueError(f"priority must be one of {', '.join(_PRIORITIES)}")
+
+    def decorator(fn):
+        fn._shed_priority = priority
+        if concurrency is not None:
+            _routes[fn.__name__] = Bulkhead(fn.__name__, concurrency)
+        return fn
+    return decorator
+
+
+def _upstream_queue_seconds():
+    """Time since the proxy received the request, from X-Request-Start, or 0."""
+    raw = request.headers.get("X-Request-Start", "")
+    if not raw:
+        return 0.0
+    try:
+        value = float(raw[2:] if raw.startswith("t=") else raw)
+    except ValueError:
+        return 0.0
+    # Proxies send seconds, milliseconds or microseconds since the epoch
+    if value > 1e14:
+        value /= 1e6
+    elif value > 1e11:
+        value /= 1e3
+    return max(0.0, time.time() - value)
+
+
+def _busy():
+    response = jsonify({"error": "Server busy, retry later"})
+    response.headers["Retry-After"] = str(SHED_RETRY_AFTER_SECONDS)
+    return response, 503
+
+
+def metrics():
+    """Per-worker bulkhead counters."""
+    return {
+        "classes": {name: b.metrics() for name, b in _classes.items()},
+        "routes": {name: b.metrics() for name, b in _routes.items()},
+    }
+
+
+def init_app(app):
+    """Admit or shed each request before it reaches the view. Register before login checks."""
+    if not LOAD_SHEDDING:
+        return
+
+    @app.before_request
+    def admit():
+        view = app.view_functions.get(request.endpoint)
+        priority = getattr(view, "_shed_priority", "light")
+        if view is None or request.endpoint == "static" or priority == "critical":
+            return None
+        budget = _max_wait[priority] - _upstream_queue_seconds()
+        if budget <= 0:
+            _classes[priority].reject()
+            logger.warning("Shedding %s %s: queued upstream past %s threshold",
+                           request.method, request.path, priority)
+            return _busy()
+        started = time.monotonic()
+        held = []
+        for bulkhead in (_routes.get(request.endpoint), _classes[priority]):
+            if bulkhead is None:
+                continue
+            if not bulkhead.acquire(budget - (time.monotonic() - started)):
+                for taken in held:
+                    taken.release()
+                logger.warning("Shedding %s %s: %s bulkhead full", request.method, request.path,
+                               bulkhead.name)
+                return _busy()
+            held.append(bulkhead)
+        g.shed_bulkheads = held
+        return None
+
+    @app.teardown_request
+    def release(exc):
+        for bulkhead in reversed(g.pop("shed_bulkheads", ())):
+            bulkhead.release()
@@ -0,0 +1,64 @@
+"""
+Move image blobs from event_images.image_data to the configured blob store.
+
+Runs in batches until no pending rows remain, then exits (or, with --follow,
+keeps polling for rows the ingestion pipeline writes later). Safe to stop at
+any point and to run several copies at once: each batch is one transaction
+and rows are claimed with SKIP LOCKED.
+
+    BLOB_STORE=local BLOB_STORE_DIR=/var/data/blobs python migrate_blobs.py --follow
+
+Clearing image_data leaves the old TOAST space to autovacuum; it is reused
+for new rows but only returned to the OS by VACUUM FULL / pg_repack.
+"""
+import argparse
+import logging
+import time
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+import blob_store
+import db_utils
+
+logger = logging.getLogger("migrate_blobs")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--batch", type=int, default=100, help="rows per transaction")
+    parser.add_argument("--pause", type=float, default=0.0,
+                        help="seconds to sleep between batches, to limit load on the primary")
+    parser.add_argument("--follow", action="store_true",
+                        help="keep running and migrate new rows as they arrive")
+    parser.add_argument("--poll", type=float, default=30.0, help="idle poll interval with --follow")
+    parser.add_argument("--keep-image-data", action="store_true",
+                        help="set image_sha256 but leave image_data in place (dry run for the store)")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    if blob_store.store is None:
+        parser.error("BLOB_STORE is not set; nothing to migrate to")
+
+    total_rows = total_bytes = 0
+    started = time.monotonic()
+    while True:
+        rows, moved = db_utils.migrate_blob_batch(args.batch, clear_image_data=not args.keep_image_data)
+        total_rows += rows
+        total_bytes += moved
+        if rows:
+            rate = total_bytes / max(time.monotonic() - started, 1e-6) / 1e6
+            logger.info("Migrated %d blobs (%.1f MB total, %.1f MB/s)", total_rows, total_bytes / 1e6, rate)
+            if args.pause:
+                time.sleep(args.pause)
+            continue
+        if not args.follow:
+            break
+        time.sleep(args.poll)
+    logger.info("Done: %d blobs, %.1f MB moved to %s", total_rows, total_bytes / 1e6,
+                type(blob_store.store).__name__)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,39 @@
+-- Canonical vehicle brand / color / type values.
+--
+-- Each row maps one raw spelling written by the camera OCR to its canonical
+-- value. db_utils loads this table together with the filter options (every
+-- 300 s), so a new misspelling is a data change, not a code change:
+--
+--   INSERT INTO vehicle_dimension_aliases (dimension, raw_value, canonical)
+--   VALUES ('brand', 'Toyta', 'Toyota');
+--
+-- Raw values are matched case-insensitively and with surrounding whitespace
+-- ignored. Filters expand a canonical value into every raw spelling seen in
+-- detection_events and probe the indexes below with a single = ANY(array).
+-- detection_events itself is never rewritten.
+--
+-- Run with psql outside an explicit transaction (CREATE INDEX CONCURRENTLY).
+
+CREATE TABLE IF NOT EXISTS vehicle_dimension_aliases (
+    dimension  text NOT NULL CHECK (dimension IN ('brand', 'color', 'type')),
+    raw_value  text NOT NULL,
+    canonical  text NOT NULL,
+    created_at timestamptz NOT NULL DEFAULT now(),
+    PRIMARY KEY (dimension, raw_value)
+);
+
+CREATE INDEX IF NOT EXISTS vehicle_dimension_aliases_canonical_idx
+    ON vehicle_dimension_aliases (dimension, canonical);
+
+INSERT INTO vehicle_dimension_aliases (dimension, raw_value, canonical) VALUES
+    ('brand', 'Cheurolet', 'Chevrolet'),
+    ('brand', 'Evolkswagen', 'Volkswagen'),
+    ('brand', 'Renau', 'Renault')
+ON CONFLICT (dimension, raw_value) DO NOTHING;
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS detection_events_vehicle_brand_idx
+    ON detection_events (vehicle_brand);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS detection_events_vehicle_color_idx
+    ON detection_events (vehicle_color);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS detection_events_vehicle_type_idx
+    ON detection_events (vehicle_type);
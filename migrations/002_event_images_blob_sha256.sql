@@ -0,0 +1,17 @@
+-- Image blobs in an external content-addressed store (blob_store.py).
+--
+-- image_sha256 references the blob by content. A row is migrated when
+-- image_sha256 is set; migrate_blobs.py then clears image_data, so Postgres
+-- keeps only the metadata and the hash. Rows written by the ingestion
+-- pipeline keep arriving with image_data and no hash until the migrator
+-- picks them up; readers handle both.
+--
+-- Adding a nullable column without a default does not rewrite the table.
+-- Run with psql outside an explicit transaction (CREATE INDEX CONCURRENTLY).
+
+ALTER TABLE event_images ADD COLUMN IF NOT EXISTS image_sha256 text;
+
+-- Lets the migrator find pending rows without scanning the migrated ones
+CREATE INDEX CONCURRENTLY IF NOT EXISTS event_images_blob_pending_idx
+    ON event_images (created_at)
+    WHERE image_sha256 IS NULL AND image_data IS NOT NULL;
@@ -0,0 +1,33 @@
+-- Queue and status table for jobs.py (long-running work outside requests).
+--
+-- Workers claim the oldest queued job with FOR UPDATE SKIP LOCKED, keep
+-- heartbeat_at fresh while running it, and store either a JSON result or an
+-- error. A running job whose heartbeat stops (worker killed, deploy) is put
+-- back in the queue, or failed after max_attempts.
+
+CREATE TABLE IF NOT EXISTS background_jobs (
+    id               uuid PRIMARY KEY DEFAULT gen_random_uuid(),
+    kind             text NOT NULL,
+    params           jsonb NOT NULL DEFAULT '{}',
+    status           text NOT NULL DEFAULT 'queued'
+                     CHECK (status IN ('queued', 'running', 'succeeded', 'failed', 'cancelled')),
+    progress         real NOT NULL DEFAULT 0,
+    progress_message text,
+    result           jsonb,
+    error            text,
+    cancel_requested boolean NOT NULL DEFAULT false,
+    attempts         integer NOT NULL DEFAULT 0,
+    max_attempts     integer NOT NULL DEFAULT 3,
+    worker           text,
+    created_at       timestamptz NOT NULL DEFAULT now(),
+    started_at       timestamptz,
+    heartbeat_at     timestamptz,
+    finished_at      timestamptz
+);
+
+CREATE INDEX IF NOT EXISTS background_jobs_queued_idx
+    ON background_jobs (created_at) WHERE status = 'queued';
+CREATE INDEX IF NOT EXISTS background_jobs_running_idx
+    ON background_jobs (heartbeat_at) WHERE status = 'running';
+CREATE INDEX IF NOT EXISTS background_jobs_created_idx
+    ON background_jobs (created_at DESC);
@@ -0,0 +1,14 @@
+-- Index on the normalized plate for the plate profile endpoints.
+--
+-- /api/plate_profile and /api/plate_timeline look plates up by their text
+-- with case and separators ignored, so "ab-123 cd" and "AB123CD" are the
+-- same vehicle. The expression must stay identical to db_utils._PLATE_KEY_SQL
+-- or the planner will not use the index. created_at DESC serves the timeline
+-- order and its keyset cursor straight from the index.
+--
+-- Run with psql outside an explicit transaction (CREATE INDEX CONCURRENTLY).
+-- On a table converted by partitions.py, drop CONCURRENTLY (not supported on
+-- a partitioned parent) or create it per partition first.
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS detection_events_plate_key_idx
+    ON detection_events ((upper(regexp_replace(camera_plate_text, '[^[:alnum:]]', '', 'g'))), created_at DESC);
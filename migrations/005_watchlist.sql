@@ -0,0 +1,41 @@
+-- Watchlist (hotlist) of plates and the sightings that matched it (watchlist.py).
+--
+-- watchlist_plates is keyed by the normalized plate (db_utils.normalize_plate:
+-- alphanumerics only, uppercased). Entries are never deleted, only
+-- deactivated, so the matcher can refresh incrementally by updated_at.
+--
+-- The matcher reads detection_events in (created_at, id) order from the
+-- watermark stored in watchlist_consumers and writes one watchlist_hits row
+-- per (event, plate) it matched.
+
+CREATE TABLE IF NOT EXISTS watchlist_plates (
+    plate_key  text PRIMARY KEY,
+    label      text,
+    active     boolean NOT NULL DEFAULT true,
+    created_at timestamptz NOT NULL DEFAULT now(),
+    updated_at timestamptz NOT NULL DEFAULT now()
+);
+
+CREATE INDEX IF NOT EXISTS watchlist_plates_updated_idx ON watchlist_plates (updated_at);
+
+CREATE TABLE IF NOT EXISTS watchlist_hits (
+    id           bigserial PRIMARY KEY,
+    event_id     uuid NOT NULL,
+    plate_key    text NOT NULL,
+    plate_text   text,
+    match_kind   text NOT NULL CHECK (match_kind IN ('exact', 'ocr', 'near')),
+    distance     smallint NOT NULL,
+    label        text,
+    seen_at      timestamptz NOT NULL,
+    matched_at   timestamptz NOT NULL DEFAULT now(),
+    UNIQUE (event_id, plate_key)
+);
+
+CREATE INDEX IF NOT EXISTS watchlist_hits_plate_idx ON watchlist_hits (plate_key, seen_at DESC);
+
+CREATE TABLE IF NOT EXISTS watchlist_consumers (
+    name          text PRIMARY KEY,
+    last_seen_at  timestamptz NOT NULL,
+    last_event_id uuid NOT NULL,
+    updated_at    timestamptz NOT NULL DEFAULT now()
+);
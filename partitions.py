@@ -0,0 +1,445 @@
+"""
+Monthly range partitioning of detection_events and event_images on created_at.
+
+    python partitions.py status
+    python partitions.py convert [--ahead 3]        # one-off, see below
+    python partitions.py ensure [--ahead 3]         # daily cron
+    python partitions.py retain --keep-months 12 [--drop] --yes
+
+Partitions are named <table>_yYYYYmMM and cover one UTC calendar month. There
+is no DEFAULT partition (it would block DETACH ... CONCURRENTLY and make every
+new partition scan it), so `ensure` must run regularly: it creates the current
+month and the next --ahead months, and inserts for a month without a partition
+fail.
+
+convert copies each table into a new partitioned table month by month while
+the application keeps running. A trigger on the old table logs the id of every
+row inserted, updated or deleted from before the copy starts; those rows are
+copied again (or removed) in the new table once the bulk copy is done, and
+again holding an EXCLUSIVE lock (reads keep working, writes wait) for what
+changed meanwhile. Still under that lock the row counts of the old and new
+tables are compared, and the swap is aborted, leaving everything as it was,
+when they differ. The swap itself renames the tables, which takes ACCESS
+EXCLUSIVE locks: from then until the commit reads wait too. The renames wait
+for queries already running on the tables, and every new query queues behind
+them, so run convert when no long report or export is in progress. The old
+tables stay as <table>_unpartitioned for rollback; drop them once satisfied.
+Things to know before running it:
+  - the primary key becomes (id, created_at): a partitioned table cannot have
+    a unique constraint without the partition key. ON CONFLICT (id) in the
+    ingestion pipeline must become ON CONFLICT (id, created_at);
+  - for the same reason created_at becomes NOT NULL, so rows without one have
+    no partition to go to: convert refuses to start while there are any
+    (backfill them first), and a swap in which one appeared is aborted;
+  - for the same reason unique indexes other than the primary key cannot be
+    carried over as they are: convert names them and refuses to start;
+  - for the same reason the event_images.event_id foreign key cannot be
+    recreated; it is reported and left on the old table.
+
+retain detaches partitions whose whole month is older than --keep-months
+(DETACH ... CONCURRENTLY, no lock on the parent for readers or writers), and
+drops them with --drop. Without --yes it only prints the plan.
+
+Connects with DB_HOST/DB_NAME/DB_USER/DB_PASSWORD and no statement timeout,
+so long copies are not cut off like application queries.
+"""
+import argparse
+import datetime
+import os
+import re
+import sys
+import time
+
+import psycopg2
+from dotenv import load_dotenv
+from psycopg2 import sql
+
+load_dotenv()
+
+TABLES = ("detection_events", "event_images")
+_PARTITION_RE = re.compile(r"^(?P<table>.+)_y(?P<year>\d{4})m(?P<month>\d{2})$")
+
+# While convert copies a table, logs the id of every row written to it into
+# the table named by the trigger's argument
+_CAPTURE_FUNCTION = """
+CREATE OR REPLACE FUNCTION partitions_convert_capture() RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    IF TG_OP <> 'INSERT' THEN
+        EXECUTE format('INSERT INTO %I (id) VALUES ($1)', TG_ARGV[0]) USING OLD.id;
+    END IF;
+    IF TG_OP <> 'DELETE' THEN
+        EXECUTE format('INSERT INTO %I (id) VALUES ($1)', TG_ARGV[0]) USING NEW.id;
+    END IF;
+    RETURN NULL;
+END
+$$
+"""
+
+
+def _connect():
+    conn = psycopg2.connect(
+        host=os.environ["DB_HOST"], database=os.environ["DB_NAME"],
+        user=os.environ["DB_USER"], password=os.environ["DB_PASSWORD"],
+        options="-c TimeZone=UTC",
+    )
+    return conn
+
+
+def _month_start(value):
+    return datetime.datetime(value.year, value.month, 1, tzinfo=datetime.timezone.utc)
+
+
+def _add_months(month, count):
+    index = month.year * 12 + month.month - 1 + count
+    return datetime.datetime(index // 12, index % 12 + 1, 1, tzinfo=datetime.timezone.utc)
+
+
+def _partition_name(table, month):
+    return f"{table}_y{month.year:04d}m{month.month:02d}"
+
+
+def _is_partitioned(cur, table):
+    cur.execute("SELECT relkind FROM pg_class WHERE oid = to_regclass(%s)", (table,))
+    row = cur.fetchone()
+    if row is None:
+        sys.exit(f"Table {table} does not exist.")
+    return row[0] == "p"
+
+
+def _partitions(cur, table):
+    """[(partition name, month start)] for partitions following the naming scheme."""
+    cur.execute(
+        """
+        SELECT c.relname FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = to_regclass(%s)
+        ORDER BY c.relname
+        """,
+        (table,),
+    )
+    result = []
+    for (name,) in cur.fetchall():
+        m = _PARTITION_RE.match(name)
+        if m and m.group("table") == table:
+            month = datetime.datetime(int(m.group("year")), int(m.group("month")), 1,
+                                      tzinfo=datetime.timezone.utc)
+            result.append((name, month))
+    return result
+
+
+def _create_partition(cur, parent, table, month):
+    cur.execute(
+        sql.SQL("CREATE TABLE IF NOT EXISTS {} PARTITION OF {} FOR VALUES FROM (%s) TO (%s)").format(
+            sql.Identifier(_partition_name(table, month)), sql.Identifier(parent)),
+        (month, _add_months(month, 1)),
+    )
+
+
+def cmd_status(args):
+    conn = _connect()
+    cur = conn.cursor()
+    for table in TABLES:
+        if not _is_partitioned(cur, table):
+            print(f"{table}: not partitioned")
+            continue
+        print(f"{table}:")
+        for name, month in _partitions(cur, table):
+            cur.execute("SELECT reltuples::bigint, pg_total_relation_size(oid) FROM pg_class "
+                        "WHERE oid = to_regclass(%s)", (name,))
+            rows, size = cur.fetchone()
+            print(f"  {name}  {month:%Y-%m}  ~{max(rows, 0):,} rows  {size / 1e6:,.1f} MB")
+    conn.close()
+
+
+def cmd_ensure(args):
+    conn = _connect()
+    cur = conn.cursor()
+    current = _month_start(datetime.datetime.now(datetime.timezone.utc))
+    for table in TABLES:
+        if not _is_partitioned(cur, table):
+            sys.exit(f"{table} is not partitioned; run `partitions.py convert` first.")
+        for offset in range(args.ahead + 1):
+            _create_partition(cur, table, table, _add_months(current, offset))
+    conn.commit()
+    conn.close()
+    print(f"Partitions present up to {_add_months(current, args.ahead):%Y-%m}.")
+
+
+def _secondary_indexes(cur, table):
+    """(name, definition) of the non-unique indexes of `table`."""
+    cur.execute(
+        """
+        SELECT c.relname, pg_get_indexdef(i.indexrelid)
+        FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid
+        WHERE i.indrelid = to_regclass(%s) AND NOT i.indisunique
+        ORDER BY c.relname
+        """,
+        (table,),
+    )
+    return cur.fetchall()
+
+
+def _unique_indexes(cur, table):
+    """Names of the unique indexes of `table` other than its primary key."""
+    cur.execute(
+        """
+        SELECT c.relname FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid
+        WHERE i.indrelid = to_regclass(%s) AND i.indisunique AND NOT i.indisprimary
+        ORDER BY c.relname
+        """,
+        (table,),
+    )
+    return [name for (name,) in cur.fetchall()]
+
+
+def _copy_grants(cur, table, target):
+    cur.execute(
+        """
+        SELECT grantee, privilege_type FROM information_schema.role_table_grants
+        WHERE table_schema = current_schema() AND table_name = %s AND grantee <> current_user
+        """,
+        (table,),
+    )
+    for grantee, privilege in cur.fetchall():
+        # PUBLIC is a keyword, not a role: quoted it would name a role "PUBLIC"
+        to = sql.SQL("PUBLIC") if grantee == "PUBLIC" else sql.Identifier(grantee)
+        cur.execute(sql.SQL("GRANT {} ON {} TO {}").format(
+            sql.SQL(privilege), sql.Identifier(target), to))
+
+
+def _changes_table(table):
+    return f"{table}_convert_changes"
+
+
+def _start_capture(cur, table):
+    """Log the ids of rows written to `table` from now on (see _CAPTURE_FUNCTION)."""
+    changes = _changes_table(table)
+    cur.execute(sql.SQL("CREATE UNLOGGED TABLE {} AS SELECT id FROM {} WITH NO DATA").format(
+        sql.Identifier(changes), sql.Identifier(table)))
+    cur.execute(sql.SQL(
+        "CREATE TRIGGER {} AFTER INSERT OR UPDATE OR DELETE ON {} "
+        "FOR EACH ROW EXECUTE FUNCTION partitions_convert_capture({})"
+    ).format(sql.Identifier(f"{table}_convert_capture"), sql.Identifier(table), sql.Literal(changes)))
+
+
+def _stop_capture(cur, table):
+    cur.execute(sql.SQL("DROP TRIGGER IF EXISTS {} ON {}").format(
+        sql.Identifier(f"{table}_convert_capture"), sql.Identifier(table)))
+    cur.execute(sql.SQL("DROP TABLE IF EXISTS {}").format(sql.Identifier(_changes_table(table))))
+
+
+def _apply_changes(cur, table, new):
+    """Bring the rows of `new` logged as changed in `table` up to date. Returns how many ids."""
+    changes = _changes_table(table)
+    # Take exactly the ids logged so far: later ones stay for the next call
+    cur.execute(sql.SQL("CREATE TEMP TABLE partitions_batch AS SELECT id FROM {} WITH NO DATA").format(
+        sql.Identifier(changes)))
+    cur.execute(sql.SQL(
+        "WITH taken AS (DELETE FROM {} RETURNING id) INSERT INTO partitions_batch SELECT DISTINCT id FROM taken"
+    ).format(sql.Identifier(changes)))
+    count = cur.rowcount
+    # Delete and re-copy: covers inserts (backdated too), updates (created_at too) and deletes
+    cur.execute(sql.SQL("DELETE FROM {} WHERE id IN (SELECT id FROM partitions_batch)").format(
+        sql.Identifier(new)))
+    cur.execute(sql.SQL("INSERT INTO {} SELECT * FROM {} WHERE id IN (SELECT id FROM partitions_batch)").format(
+        sql.Identifier(new), sql.Identifier(table)))
+    cur.execute("DROP TABLE partitions_batch")
+    return count
+
+
+def _row_count(cur, table):
+    cur.execute(sql.SQL("SELECT count(*) FROM {}").format(sql.Identifier(table)))
+    return cur.fetchone()[0]
+
+
+def cmd_convert(args):
+    conn = _connect()
+    cur = conn.cursor()
+    for table in TABLES:
+        if _is_partitioned(cur, table):
+            sys.exit(f"{table} is already partitioned.")
+        cur.execute(sql.SQL("SELECT count(*) FROM {} WHERE created_at IS NULL").format(sql.Identifier(table)))
+        missing = cur.fetchone()[0]
+        if missing:
+            sys.exit(f"{table} has {missing:,} rows without created_at; they cannot be partitioned. "
+                     "Backfill created_at first.")
+        unique = _unique_indexes(cur, table)
+        if unique:
+            sys.exit(f"{table} has unique indexes besides its primary key ({', '.join(unique)}); a "
+                     "partitioned table can only enforce them with created_at in the key. Replace "
+                     "or drop them first.")
+
+    # Before the copy reads anything, so every later write is logged
+    cur.execute(_CAPTURE_FUNCTION)
+    for table in TABLES:
+        _start_capture(cur, table)
+    conn.commit()
+    try:
+        foreign_keys = _convert(conn, cur, args)
+    except BaseException:
+        conn.rollback()
+        for table in TABLES:
+            _stop_capture(cur, table)
+        cur.execute("DROP FUNCTION IF EXISTS partitions_convert_capture()")
+        conn.commit()
+        print("Conversion stopped; the original tables are unchanged. Drop "
+              + ", ".join(f"{t}_partitioned" for t in TABLES) + " before running convert again.",
+              file=sys.stderr)
+        raise
+
+    for table in TABLES:
+        cur.execute(sql.SQL("ANALYZE {}").format(sql.Identifier(table)))
+    conn.commit()
+    conn.close()
+    print("Converted. Old tables kept as " + ", ".join(f"{t}_unpartitioned" for t in TABLES) + ".")
+    for name, table in foreign_keys:
+        print(f"Note: foreign key {name} stays on {table}_unpartitioned; "
+              "it cannot be recreated on the partitioned tables.")
+
+
+def _convert(conn, cur, args):
+    """Copy, catch up and swap. Returns the foreign keys left on the old tables."""
+    current = _month_start(datetime.datetime.now(datetime.timezone.utc))
+    indexes = {}
+    for table in TABLES:
+        new = f"{table}_partitioned"
+        cur.execute(sql.SQL(
+            "CREATE TABLE {} (LIKE {} INCLUDING DEFAULTS INCLUDING CONSTRAINTS "
+            "INCLUDING STORAGE INCLUDING COMMENTS) PARTITION BY RANGE (created_at)"
+        ).format(sql.Identifier(new), sql.Identifier(table)))
+        cur.execute(sql.SQL("ALTER TABLE {} ADD PRIMARY KEY (id, created_at)").format(sql.Identifier(new)))
+        cur.execute(sql.SQL("SELECT min(created_at), max(created_at) FROM {}").format(sql.Identifier(table)))
+        low, high = cur.fetchone()
+        first = _month_start(low) if low else current
+        last = max(_month_start(high) if high else current, current)
+        month = first
+        months = []
+        while month <= _add_months(last, args.ahead):
+            _create_partition(cur, new, table, month)
+            months.append(month)
+            month = _add_months(month, 1)
+        conn.commit()
+
+        for month in months:
+            if month > last:
+                break
+            started = time.monotonic()
+            cur.execute(
+                sql.SQL("INSERT INTO {} SELECT * FROM {} WHERE created_at >= %s AND created_at < %s").format(
+                    sql.Identifier(new), sql.Identifier(table)),
+                (month, _add_months(month, 1)),
+            )
+            conn.commit()
+            print(f"{table} {month:%Y-%m}: {cur.rowcount:,} rows in {time.monotonic() - started:.1f}s", flush=True)
+
+        # Indexes after the bulk copy: cheaper than maintaining them row by row
+        indexes[table] = _secondary_indexes(cur, table)
+        for name, definition in indexes[table]:
+            definition = definition.replace(f"INDEX {name} ON ", f"INDEX {name}_p ON ", 1)
+            definition = re.sub(rf"\bON (ONLY )?(\S+\.)?{table}\b", f"ON {new}", definition, count=1)
+            started = time.monotonic()
+            cur.execute(definition)
+            conn.commit()
+            print(f"{table}: index {name} rebuilt in {time.monotonic() - started:.1f}s", flush=True)
+        _copy_grants(cur, table, new)
+        conn.commit()
+
+    # Catch up without the lock first, so the locked pass only has the last few seconds of writes
+    for table in TABLES:
+        started = time.monotonic()
+        count = _apply_changes(cur, table, f"{table}_partitioned")
+        conn.commit()
+        print(f"{table}: {count:,} rows changed during the copy, applied in "
+              f"{time.monotonic() - started:.1f}s", flush=True)
+
+    cur.execute(
+        """
+        SELECT conname, conrelid::regclass::text FROM pg_constraint
+        WHERE contype = 'f' AND confrelid = to_regclass('detection_events')
+        """
+    )
+    foreign_keys = cur.fetchall()
+
+    # Writers wait for the EXCLUSIVE lock; readers continue until the renames below
+    for table in TABLES:
+        cur.execute(sql.SQL("LOCK TABLE {} IN EXCLUSIVE MODE").format(sql.Identifier(table)))
+    for table in TABLES:
+        new = f"{table}_partitioned"
+        count = _apply_changes(cur, table, new)
+        print(f"{table}: {count:,} more rows changed, applied under the lock", flush=True)
+        old_rows, new_rows = _row_count(cur, table), _row_count(cur, new)
+        if old_rows != new_rows:
+            sys.exit(f"{table} has {old_rows:,} rows but {new} {new_rows:,}; swap aborted.")
+    # The renames take ACCESS EXCLUSIVE locks: from here to the commit reads wait too
+    for table in TABLES:
+        new = f"{table}_partitioned"
+        _stop_capture(cur, table)
+        cur.execute(
+            "SELECT conname FROM pg_constraint WHERE conrelid = to_regclass(%s) AND contype = 'p'", (table,))
+        pk = cur.fetchone()
+        if pk:
+            cur.execute(sql.SQL("ALTER TABLE {} RENAME CONSTRAINT {} TO {}").format(
+                sql.Identifier(table), sql.Identifier(pk[0]), sql.Identifier(f"{pk[0]}_old")))
+        for name, _definition in indexes[table]:
+            cur.execute(sql.SQL("ALTER INDEX {} RENAME TO {}").format(
+                sql.Identifier(name), sql.Identifier(f"{name}_old")))
+            cur.execute(sql.SQL("ALTER INDEX {} RENAME TO {}").format(
+                sql.Identifier(f"{name}_p"), sql.Identifier(name)))
+        cur.execute(sql.SQL("ALTER TABLE {} RENAME TO {}").format(
+            sql.Identifier(table), sql.Identifier(f"{table}_unpartitioned")))
+        cur.execute(sql.SQL("ALTER TABLE {} RENAME TO {}").format(sql.Identifier(new), sql.Identifier(table)))
+        cur.execute(sql.SQL("ALTER TABLE {} RENAME CONSTRAINT {} TO {}").format(
+            sql.Identifier(table), sql.Identifier(f"{new}_pkey"), sql.Identifier(f"{table}_pkey")))
+    cur.execute("DROP FUNCTION partitions_convert_capture()")
+    conn.commit()
+    return foreign_keys
+
+
+def cmd_retain(args):
+    conn = _connect()
+    conn.autocommit = True  # DETACH ... CONCURRENTLY cannot run inside a transaction
+    cur = conn.cursor()
+    cutoff = _add_months(_month_start(datetime.datetime.now(datetime.timezone.utc)), -args.keep_months)
+    # Images before events, so no window shows images without their event
+    plan = []
+    for table in reversed(TABLES):
+        if not _is_partitioned(cur, table):
+            sys.exit(f"{table} is not partitioned.")
+        plan.extend(name for name, month in _partitions(cur, table) if month < cutoff)
+    if not plan:
+        print(f"Nothing older than {cutoff:%Y-%m}.")
+        return
+    action = "detach and drop" if args.drop else "detach"
+    print(f"Will {action} (months before {cutoff:%Y-%m}): " + ", ".join(plan))
+    if not args.yes:
+        print("Dry run; pass --yes to apply.")
+        return
+    for name in plan:
+        parent = _PARTITION_RE.match(name).group("table")
+        started = time.monotonic()
+        cur.execute(sql.SQL("ALTER TABLE {} DETACH PARTITION {} CONCURRENTLY").format(
+            sql.Identifier(parent), sql.Identifier(name)))
+        if args.drop:
+            cur.execute(sql.SQL("DROP TABLE {}").format(sql.Identifier(name)))
+        print(f"{name}: {action} in {time.monotonic() - started:.1f}s", flush=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("status", help="list partitions with sizes")
+    for name, text in (("convert", "partition the existing tables (one-off)"),
+                       ("ensure", "create the current and upcoming monthly partitions")):
+        sub = commands.add_parser(name, help=text)
+        sub.add_argument("--ahead", type=int, default=3, help="months to create beyond the current one")
+    retain = commands.add_parser("retain", help="detach/drop partitions older than --keep-months")
+    retain.add_argument("--keep-months", type=int, required=True,
+                        help="full months kept besides the current one")
+    retain.add_argument("--drop", action="store_true", help="drop the detached partitions")
+    retain.add_argument("--yes", action="store_true", help="apply the plan (default: dry run)")
+    args = parser.parse_args(argv)
+    {"status": cmd_status, "convert": cmd_convert, "ensure": cmd_ensure, "retain": cmd_retain}[args.command](args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,165 @@
+"""
+Opt-in per-request profiling: a Server-Timing breakdown and sampled stack dumps.
+
+A request is profiled when either
+  - it carries `X-Profile: <PROFILE_TOKEN>` (and PROFILE_TOKEN is set), or
+  - it is picked by PROFILE_SAMPLE_RATE (fraction of requests, default 0).
+
+Profiled responses get a Server-Timing header with the time spent in each
+category (sql, json, b64, blob, brand, compress) plus the total, visible in the
+browser devtools "Timing" tab. When PROFILE_DIR is set, a background thread
+also samples the request thread's Python stack every PROFILE_INTERVAL_MS and
+writes it to PROFILE_DIR in folded format (one "frame;frame;frame count" line
+per stack), ready for flamegraph.pl or speedscope.
+
+When a request is not profiled, span() costs one thread-local lookup and
+returns a shared no-op context manager.
+"""
+import collections
+import hmac
+import logging
+import os
+import random
+import sys
+import threading
+import time
+
+from flask import g, request
+
+logger = logging.getLogger(__name__)
+
+PROFILE_TOKEN = os.environ.get("PROFILE_TOKEN", "")
+PROFILE_SAMPLE_RATE = float(os.environ.get("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_DIR = os.environ.get("PROFILE_DIR", "")
+PROFILE_INTERVAL_MS = float(os.environ.get("PROFILE_INTERVAL_MS", "5"))
+
+_local = threading.local()
+
+
+class _NoopSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NOOP = _NoopSpan()
+
+
+class _Span:
+    __slots__ = ("timings", "name", "start")
+
+    def __init__(self, timings, name):
+        self.timings = timings
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        elapsed = time.perf_counter() - self.start
+        total, calls = self.timings.get(self.name, (0.0, 0))
+        self.timings[self.name] = (total + elapsed, calls + 1)
+        return False
+
+
+def span(name):
+    """Context manager adding the enclosed time to category `name` of the current profiled request."""
+    timings = getattr(_local, "timings", None)
+    if timings is None:
+        return _NOOP
+    return _Span(timings, name)
+
+
+class StackSampler(threading.Thread):
+    """Samples one thread's Python stack at a fixed interval into folded-stack counts."""
+
+    def __init__(self, thread_id, interval):
+        super().__init__(daemon=True, name="profile-sampler")
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = collections.Counter()
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            names = []
+            while frame is not None:
+                code = frame.f_code
+                names.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                frame = frame.f_back
+            self.stacks[";".join(reversed(names))] += 1
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+    def dump(self, path):
+        with open(path, "w") as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+
+
+def _format_server_timing(timings, total):
+    parts = []
+    for name, (seconds, calls) in sorted(timings.items()):
+        parts.append(f'{name};dur={seconds * 1000:.2f};desc="{calls} calls"')
+    parts.append(f"total;dur={total * 1000:.2f}")
+    return ", ".join(parts)
+
+
+def init_app(app):
+    """
+    Register the profiling hooks. Call this before installing other after_request
+    hooks (e.g. compression) so the measured total includes them.
+    """
+    if not PROFILE_TOKEN and PROFILE_SAMPLE_RATE <= 0:
+        return
+
+    @app.before_request
+    def start_profile():
+        header = request.headers.get("X-Profile", "")
+        wanted = bool(PROFILE_TOKEN and header and hmac.compare_digest(header, PROFILE_TOKEN))
+        if not wanted and not (PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE):
+            return
+        _local.timings = {}
+        g.profile_start = time.perf_counter()
+        g.profile_sampler = None
+        if PROFILE_DIR:
+            g.profile_sampler = StackSampler(threading.get_ident(), PROFILE_INTERVAL_MS / 1000.0)
+            g.profile_sampler.start()
+
+    @app.after_request
+    def finish_profile(response):
+        timings = getattr(_local, "timings", None)
+        if timings is None or "profile_start" not in g:
+            return response
+        total = time.perf_counter() - g.profile_start
+        response.headers["Server-Timing"] = _format_server_timing(timings, total)
+        logger.info("profile %s %s %.1fms %s", request.method, request.path, total * 1000,
+                    {k: round(v[0] * 1000, 2) for k, v in timings.items()})
+        sampler = g.profile_sampler
+        if sampler is not None:
+            sampler.stop()
+            os.makedirs(PROFILE_DIR, exist_ok=True)
+            name = f"{int(time.time() * 1000)}-{request.endpoint or 'unknown'}-{os.getpid()}.folded"
+            try:
+                sampler.dump(os.path.join(PROFILE_DIR, name))
+            except OSError as e:
+                logger.error("Could not write profile %s: %s", name, e)
+            g.profile_sampler = None
+        return response
+
+    @app.teardown_request
+    def clear_profile(exc):
+        _local.timings = None
+        sampler = g.pop("profile_sampler", None)
+        if sampler is not None:
+            sampler.stop()
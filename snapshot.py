@@ -0,0 +1,312 @@
+"""
+Memory-mapped local snapshot of detection_events metadata, for plate lookups
+at sites where the central Postgres is slow or unreachable.
+
+The snapshot is one file of fixed-size records sorted by (normalized plate,
+created_at, event id):
+
+    plate key  16 bytes  db_utils.normalize_plate(), cut to 16 and NUL-padded
+    created_at  8 bytes  microseconds since the epoch, big-endian
+    event id   16 bytes  UUID bytes
+    brand, color, type   2 bytes each, codes into the file's dictionary
+    confidence  4 bytes  float32
+
+Because the integers are big-endian, comparing the first 40 bytes of two
+records as bytes orders them exactly like the tuple they encode. Readers
+binary search the mmap'ed file directly and unpack only the records they
+return. A second array of record numbers sorted by (created_at, event id)
+serves date-range queries the same way.
+
+Build it once, then refresh it incrementally (rows after the watermark stored
+in the header) from cron or a loop:
+
+    python snapshot.py build --path /var/lib/patentes/plates.snap
+    python snapshot.py build --path /var/lib/patentes/plates.snap --full   # also drops deleted rows
+    python snapshot.py query --path ... --plate AB123 --limit 20
+
+A refresh writes a new file and renames it over the old one, so readers never
+see a partial file; db_utils reopens it when it changes (PLATE_SNAPSHOT_PATH).
+"""
+import argparse
+import bisect
+import datetime
+import heapq
+import json
+import logging
+import mmap
+import os
+import struct
+import time
+import uuid
+
+import psycopg2
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+import db_utils
+from db_utils import DBError
+
+logger = logging.getLogger(__name__)
+
+# Rows younger than this are left for the next refresh, so rows committed
+# slightly out of created_at order are not skipped by the watermark
+SNAPSHOT_LAG_SECONDS = float(os.environ.get("SNAPSHOT_LAG_SECONDS", "2"))
+
+_MAGIC = b"PLSNAP01"
+# magic, record size, record count, watermark (us, event id), dictionary offset/length, built at (us)
+_HEADER = struct.Struct(">8sHQQ16sQQQ")
+_HEADER_SIZE = 128
+_RECORD = struct.Struct(">16sQ16sHHHf")
+_KEY_SIZE = 16
+_SORT_KEY_SIZE = 40  # plate key, created_at, event id
+_TIME_KEY = slice(16, 40)  # created_at, event id
+_INDEX_ENTRY = struct.Struct(">I")
+_DIMENSIONS = ("brand", "color", "type")
+_EPOCH = datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
+_US = datetime.timedelta(microseconds=1)
+
+
+def _to_us(ts):
+    return (ts - _EPOCH) // _US
+
+
+def _from_us(us):
+    return _EPOCH + datetime.timedelta(microseconds=us)
+
+
+def _parse_ts(value):
+    """ISO string or datetime -> aware datetime (naive values are taken as UTC)."""
+    if isinstance(value, str):
+        value = datetime.datetime.fromisoformat(value)
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=datetime.timezone.utc)
+    return value
+
+
+class _Keys:
+    """Sequence view of one slice of every record, for bisect without copying the file."""
+
+    __slots__ = ("snap", "part", "by_time")
+
+    def __init__(self, snap, part, by_time=False):
+        self.snap = snap
+        self.part = part
+        self.by_time = by_time
+
+    def __len__(self):
+        return self.snap.count
+
+    def __getitem__(self, i):
+        offset = self.snap._record_offset(self.snap._time_rank(i) if self.by_time else i)
+        return self.snap._mm[offset + self.part.start:offset + self.part.stop]
+
+
+class Snapshot:
+    """A read-only snapshot file mapped into memory."""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            self.stat = os.fstat(f.fileno())
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, record_size, self.count, watermark_us, watermark_id,
+         dict_offset, dict_length, built_us) = _HEADER.unpack_from(self._mm, 0)
+        if magic != _MAGIC or record_size != _RECORD.size:
+            self._mm.close()
+            raise ValueError(f"{path} is not a plate snapshot")
+        self.watermark = (_from_us(watermark_us), str(uuid.UUID(bytes=watermark_id))) if self.count else None
+        self.built_at = _from_us(built_us)
+        self._index_offset = _HEADER_SIZE + self.count * _RECORD.size
+        self.dictionary = json.loads(self._mm[dict_offset:dict_offset + dict_length])
+
+    def close(self):
+        self._mm.close()
+
+    def _record_offset(self, i):
+        return _HEADER_SIZE + i * _RECORD.size
+
+    def _time_rank(self, i):
+        return _INDEX_ENTRY.unpack_from(self._mm, self._index_offset + i * _INDEX_ENTRY.size)[0]
+
+    def raw_record(self, i):
+        offset = self._record_offset(i)
+        return self._mm[offset:offset + _RECORD.size]
+
+    def record(self, i):
+        """Record i as a dict in the shape of the plate timeline events."""
+        plate_key, created_us, event_id, brand, color, vtype, confidence = _RECORD.unpack_from(
+            self._mm, self._record_offset(i))
+        return {
+            "event_id": str(uuid.UUID(bytes=event_id)),
+            "created_at": _from_us(created_us),
+            "plate_text": plate_key.rstrip(b"\0").decode() or None,
+            "plate_confidence": round(confidence, 4),
+            "vehicle_brand": self.dictionary["brand"][brand],
+            "vehicle_color": self.dictionary["color"][color],
+            "vehicle_type": self.dictionary["type"][vtype],
+        }
+
+    def _plate_range(self, prefix):
+        """Record numbers [lo, hi) whose plate key starts with `prefix` (bytes)."""
+        keys = _Keys(self, slice(0, len(prefix)))
+        lo = bisect.bisect_left(keys, prefix)
+        hi = bisect.bisect_right(keys, prefix, lo)
+        return lo, hi
+
+    def plate_events(self, plate_key, cursor_ts=None, cursor_id=None, limit=50):
+        """Sightings of one plate, newest first, keyset-paginated like fetch_plate_timeline()."""
+        key = plate_key.encode()[:_KEY_SIZE].ljust(_KEY_SIZE, b"\0")
+        lo, hi = self._plate_range(key)
+        if cursor_ts and cursor_id:
+            bound = key + struct.pack(">Q", _to_us(_parse_ts(cursor_ts))) + uuid.UUID(cursor_id).bytes
+            hi = bisect.bisect_left(_Keys(self, slice(0, _SORT_KEY_SIZE)), bound, lo, hi)
+        return [self.record(i) for i in range(hi - 1, max(lo, hi - limit) - 1, -1)]
+
+    def search(self, plate_text, limit=50):
+        """Newest sightings of the plates whose normalized text starts with `plate_text`."""
+        key = db_utils.normalize_plate(plate_text)
+        if not key:
+            return []
+        lo, hi = self._plate_range(key.encode()[:_KEY_SIZE])
+        # Rows are sorted by plate first: pick the newest across the matching plates
+        newest = heapq.nlargest(limit, range(lo, hi), key=lambda i: self.raw_record(i)[_TIME_KEY])
+        return [self.record(i) for i in newest]
+
+    def between(self, start=None, end=None, limit=500):
+        """Sightings with start <= created_at <= end, oldest first."""
+        keys = _Keys(self, _TIME_KEY, by_time=True)
+        lo = bisect.bisect_left(keys, struct.pack(">Q", _to_us(_parse_ts(start)))) if start else 0
+        hi = bisect.bisect_right(keys, struct.pack(">Q", _to_us(_parse_ts(end))) + b"\xff" * 16) if end else self.count
+        return [self.record(self._time_rank(r)) for r in range(lo, min(hi, lo + limit))]
+
+
+def _fetch_rows(conn, since):
+    """detection_events rows after the (created_at, id) watermark `since`, streamed."""
+    conditions = ["created_at < now() - make_interval(secs => %s)"]
+    params = [SNAPSHOT_LAG_SECONDS]
+    if since:
+        conditions.append("(created_at, id) > (%s, %s::uuid) AND created_at >= %s")
+        params.extend([since[0], since[1], since[0]])
+    with conn.cursor(name="snapshot") as cur:
+        cur.itersize = 10000
+        cur.execute(
+            "SELECT camera_plate_text, created_at, id, vehicle_brand, vehicle_color, vehicle_type,"
+            " camera_confidence FROM detection_events WHERE " + " AND ".join(conditions),
+            params,
+        )
+        yield from cur
+
+
+def build(path, full=False):
+    """
+    Create or refresh the snapshot at `path`. Returns (rows added, total rows).
+    With full=True (or no existing file) every row is read again.
+    """
+    old = None
+    if not full and os.path.exists(path):
+        old = Snapshot(path)
+    dictionary = old.dictionary if old else {d: [None] for d in _DIMENSIONS}
+    codes = {d: {v: i for i, v in enumerate(dictionary[d])} for d in _DIMENSIONS}
+
+    def code(dimension, raw):
+        value = db_utils.canonicalize(dimension, raw)
+        table = codes[dimension]
+        if value not in table:
+            table[value] = len(dictionary[dimension])
+            dictionary[dimension].append(value)
+        return table[value]
+
+    started = time.monotonic()
+    try:
+        # Canonical spellings from vehicle_dimension_aliases
+        db_utils.fetch_filter_options()
+        conn = db_utils.connect_direct(statement_timeout_ms=0)
+    except psycopg2.Error as e:
+        raise DBError("Could not connect for the snapshot") from e
+    try:
+        records = [old.raw_record(i) for i in range(old.count)] if old else []
+        added = 0
+        for plate_text, created_at, event_id, brand, color, vtype, confidence in _fetch_rows(
+                conn, old.watermark if old else None):
+            records.append(_RECORD.pack(
+                # Unread plates (NULL or no letters/digits) get the empty key and sort first
+                (db_utils.normalize_plate(plate_text) or "").encode(), _to_us(created_at),
+                uuid.UUID(str(event_id)).bytes, code("brand", brand), code("color", color),
+                code("type", vtype), confidence or 0.0,
+            ))
+            added += 1
+        conn.rollback()
+    except psycopg2.Error as e:
+        raise DBError("Snapshot refresh failed") from e
+    finally:
+        conn.close()
+        if old:
+            old.close()
+    if old and not added:
+        return 0, len(records)
+
+    # Existing records are already sorted: Timsort merges the new run in linear time
+    records.sort(key=lambda r: r[:_SORT_KEY_SIZE])
+    by_time = sorted(range(len(records)), key=lambda i: records[i][_TIME_KEY])
+    watermark = (max(records, key=lambda r: r[_TIME_KEY]) if records else b"\0" * _RECORD.size)[_TIME_KEY]
+    dict_bytes = json.dumps(dictionary).encode()
+    dict_offset = _HEADER_SIZE + len(records) * (_RECORD.size + _INDEX_ENTRY.size)
+
+    tmp = f"{path}.tmp{os.getpid()}"
+    with open(tmp, "wb") as f:
+        f.write(_HEADER.pack(_MAGIC, _RECORD.size, len(records), struct.unpack(">Q", watermark[:8])[0],
+                             watermark[8:], dict_offset, len(dict_bytes),
+                             _to_us(datetime.datetime.now(datetime.timezone.utc))).ljust(_HEADER_SIZE, b"\0"))
+        f.writelines(records)
+        f.write(struct.pack(f">{len(by_time)}I", *by_time))
+        f.write(dict_bytes)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+    logger.info("Snapshot %s: %d new rows, %d total, %.1fs", path, added, len(records),
+                time.monotonic() - started)
+    return added, len(records)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build or query a local plate snapshot.")
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument("--path", default=db_utils.PLATE_SNAPSHOT_PATH or None,
+                        required=not db_utils.PLATE_SNAPSHOT_PATH,
+                        help="snapshot file (default: PLATE_SNAPSHOT_PATH)")
+    sub = parser.add_subparsers(dest="command", required=True)
+    build_cmd = sub.add_parser("build", parents=[common],
+                               help="create or incrementally refresh the snapshot")
+    build_cmd.add_argument("--full", action="store_true", help="rebuild from scratch")
+    build_cmd.add_argument("--every", type=float, help="keep refreshing every N seconds")
+    query_cmd = sub.add_parser("query", parents=[common], help="look up plates or a time range")
+    query_cmd.add_argument("--plate", help="normalized plate prefix")
+    query_cmd.add_argument("--start", help="ISO timestamp")
+    query_cmd.add_argument("--end", help="ISO timestamp")
+    query_cmd.add_argument("--limit", type=int, default=50)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    if args.command == "build":
+        build(args.path, full=args.full)
+        while args.every:
+            time.sleep(args.every)
+            try:
+                build(args.path)
+            except DBError as e:
+                logger.error("%s: %s", e, e.__cause__)
+        return
+    snap = Snapshot(args.path)
+    if args.plate:
+        rows = snap.search(args.plate, limit=args.limit)
+    else:
+        rows = snap.between(args.start, args.end, limit=args.limit)
+    for row in rows:
+        print(json.dumps(row, default=str, ensure_ascii=False))
+    snap.close()
+
+
+if __name__ == "__main__":
+    main()
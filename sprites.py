@@ -0,0 +1,133 @@
+"""
+Contact sheet ("sprite") of the most recent vehicle_picture thumbnails.
+
+The thumbnail strip used to load /api/recent_thumbnails and then one
+/api/browse_image request per thumbnail, each rate limited and each taking a
+DB connection. With a sprite it loads a JSON offset map and a single JPEG in
+which every thumbnail is a SPRITE_TILE_WIDTH x SPRITE_TILE_HEIGHT tile, left
+to right, newest first.
+
+A sprite is identified by its newest image (the anchor) and its tile count:
+the images it holds, and so its bytes, never change. It is composed with one
+query (db_utils.fetch_sprite_images) when it is first requested, kept in a
+small per-worker LRU and served with a long max-age, an ETag and Range
+support. A new sprite is only built once a new image arrives and the offset
+map, which follows fetch_recent_thumbnails(), names a new anchor.
+
+Composition needs the optional Pillow package; without it the endpoints
+answer 404 and the UI falls back to individual images.
+"""
+import collections
+import hashlib
+import io
+import logging
+import os
+import threading
+
+import db_utils
+import profiling
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # Pillow is optional: without it the strip loads images one by one
+    Image = None
+
+logger = logging.getLogger(__name__)
+
+SPRITE_TILE_WIDTH = int(os.environ.get("SPRITE_TILE_WIDTH", "180"))
+SPRITE_TILE_HEIGHT = int(os.environ.get("SPRITE_TILE_HEIGHT", "120"))
+SPRITE_JPEG_QUALITY = int(os.environ.get("SPRITE_JPEG_QUALITY", "80"))
+SPRITE_CACHE_ENTRIES = int(os.environ.get("SPRITE_CACHE_ENTRIES", "8"))
+
+_EMPTY_TILE_COLOR = (238, 238, 238)
+
+
+def available():
+    return Image is not None
+
+
+def offsets(thumbnails):
+    """The recent_thumbnails items with the x/y of their tile in the sprite."""
+    return [dict(item, x=i * SPRITE_TILE_WIDTH, y=0) for i, item in enumerate(thumbnails)]
+
+
+class Sprite:
+    """Composed sprite JPEG bytes and their ETag."""
+
+    def __init__(self, data):
+        self.data = data
+        self.etag = hashlib.sha256(data).hexdigest()[:32]
+
+
+class SpriteCache:
+    """Per-worker LRU of composed sprites keyed by (anchor image id, tile count)."""
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+        # Serializes composition so concurrent first requests build a sprite once
+        self._compose_lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+
+    def get(self, anchor_image_id, count):
+        """The sprite for (anchor, count), composed on first use. None if the anchor is gone."""
+        key = (str(anchor_image_id).lower(), count)
+        with self._lock:
+            sprite = self._entries.get(key)
+            if sprite is not None:
+                self._entries.move_to_end(key)
+                self._hits += 1
+                return sprite
+        with self._compose_lock:
+            with self._lock:
+                sprite = self._entries.get(key)
+            if sprite is None:
+                images = db_utils.fetch_sprite_images(key[0], limit=count)
+                if not images or images[0]['image_id'] != key[0]:
+                    return None
+                sprite = compose(images)
+                with self._lock:
+                    self._misses += 1
+                    self._entries[key] = sprite
+                    while len(self._entries) > self.max_entries:
+                        self._entries.popitem(last=False)
+        return sprite
+
+    def metrics(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "hits": self._hits,
+                "misses": self._misses,
+            }
+
+
+def _tile(data):
+    """One image scaled and cropped to the tile size, or None if it cannot be decoded."""
+    try:
+        with Image.open(io.BytesIO(data)) as img:
+            # JPEG: let the decoder downscale by up to 8x instead of decoding full size
+            img.draft("RGB", (SPRITE_TILE_WIDTH, SPRITE_TILE_HEIGHT))
+            return ImageOps.fit(img.convert("RGB"), (SPRITE_TILE_WIDTH, SPRITE_TILE_HEIGHT))
+    except (OSError, ValueError) as e:
+        logger.warning("Sprite tile could not be decoded: %s", e)
+        return None
+
+
+def compose(images):
+    """Compose fetch_sprite_images() results into a Sprite, one tile per image."""
+    with profiling.span("sprite"):
+        sheet = Image.new("RGB", (SPRITE_TILE_WIDTH * len(images), SPRITE_TILE_HEIGHT),
+                          _EMPTY_TILE_COLOR)
+        for i, image in enumerate(images):
+            tile = _tile(image['image_data']) if image['image_data'] else None
+            if tile is not None:
+                sheet.paste(tile, (i * SPRITE_TILE_WIDTH, 0))
+        out = io.BytesIO()
+        sheet.save(out, "JPEG", quality=SPRITE_JPEG_QUALITY, optimize=True, progressive=True)
+    return Sprite(out.getvalue())
+
+
+cache = SpriteCache(SPRITE_CACHE_ENTRIES)
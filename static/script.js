@@ -300,6 +300,8 @@ document.addEventListener('DOMContentLoaded', () => {
         results.forEach(item => {
             patentTableBody.appendChild(createTableRow(item));
         });
+        // Warm image metadata for the whole page so "Ver Imágenes" opens instantly
+        fetchEventImages(results.map(item => item.event_id)).catch(() => {});
     }
 
     // --- Pagination ---
@@ -372,31 +374,40 @@ document.addEventListener('DOMContentLoaded', () => {
     }
 
     // --- Fetch table data ---
+    // Query string of /api/all_patents (and /api/dashboard) for the current page and filters
+    function patentsQuery() {
+        let qs = `page=${currentPage}&page_size=${pageSize}`;
+        if (currentPatentFilter) qs += `&search_term=${encodeURIComponent(currentPatentFilter)}`;
+        if (currentBrandFilter.length) qs += `&brand_filter=${encodeURIComponent(currentBrandFilter.join(','))}`;
+        if (currentColorFilter.length) qs += `&color_filter=${encodeURIComponent(currentColorFilter.join(','))}`;
+        if (currentTypeFilter.length)  qs += `&type_filter=${encodeURIComponent(currentTypeFilter.join(','))}`;
+        if (currentStartDateFilter) qs += `&start_date_filter=${encodeURIComponent(currentStartDateFilter)}`;
+        if (currentEndDateFilter) qs += `&end_date_filter=${encodeURIComponent(currentEndDateFilter)}`;
+        if (currentMinConfidenceFilter) {
+            qs += `&min_confidence_filter=${encodeURIComponent(currentMinConfidenceFilter / 100)}`;
+        }
+        return qs;
+    }
+
+    function renderPatentsPage(data) {
+        displayPatentTableResults(data.patents);
+        totalPages = Math.ceil(data.total_count / pageSize);
+        updatePaginationControls(data.total_count);
+    }
+
     async function fetchPatentsTableData() {
         if (tableAbort) tableAbort.abort();
         tableAbort = new AbortController();
 
         patentTableBody.innerHTML = '<tr><td colspan="8">Cargando patentes\u2026</td></tr>';
-        let url = `${BASE}/api/all_patents?page=${currentPage}&page_size=${pageSize}`;
-        if (currentPatentFilter) url += `&search_term=${encodeURIComponent(currentPatentFilter)}`;
-        if (currentBrandFilter.length) url += `&brand_filter=${encodeURIComponent(currentBrandFilter.join(','))}`;
-        if (currentColorFilter.length) url += `&color_filter=${encodeURIComponent(currentColorFilter.join(','))}`;
-        if (currentTypeFilter.length)  url += `&type_filter=${encodeURIComponent(currentTypeFilter.join(','))}`;
-        if (currentStartDateFilter) url += `&start_date_filter=${encodeURIComponent(currentStartDateFilter)}`;
-        if (currentEndDateFilter) url += `&end_date_filter=${encodeURIComponent(currentEndDateFilter)}`;
-        if (currentMinConfidenceFilter) {
-            url += `&min_confidence_filter=${encodeURIComponent(currentMinConfidenceFilter / 100)}`;
-        }
+        const url = `${BASE}/api/all_patents?${patentsQuery()}`;
 
         pushFiltersToURL();
 
         try {
             const response = await fetch(url, { signal: tableAbort.signal });
             if (handle401(response)) return;
-            const data = await response.json();
-            displayPatentTableResults(data.patents);
-            totalPages = Math.ceil(data.total_count / pageSize);
-            updatePaginationControls(data.total_count);
+            renderPatentsPage(await response.json());
         } catch (error) {
             if (error.name === 'AbortError') return;
             console.error('Error fetching all patents:', error);
@@ -469,33 +480,68 @@ document.addEventListener('DOMContentLoaded', () => {
     }
 
     // --- Thumbnails ---
+    // One sprite image with every thumbnail as a tile; null if the server has none
+    async function fetchThumbnailSprite() {
+        const response = await fetch(`${BASE}/api/thumbnail_sprite?limit=7`);
+        if (handle401(response)) return undefined;
+        if (!response.ok) return null;
+        return response.json();
+    }
+
+    function spriteTile(sprite, item, index) {
+        const count = sprite.thumbnails.length;
+        const tile = document.createElement('div');
+        tile.className = 'thumbnail';
+        tile.setAttribute('role', 'img');
+        tile.setAttribute('aria-label', item.plate_text || 'Detección');
+        tile.style.backgroundImage = `url("${sprite.url}")`;
+        tile.style.backgroundSize = `${count * 100}% 100%`;
+        tile.style.backgroundPosition = count > 1 ? `${index / (count - 1) * 100}% 0` : '0 0';
+        return tile;
+    }
+
     async function fetchLatestThumbnails() {
         try {
-            const response = await fetch(`${BASE}/api/recent_thumbnails?limit=7`);
-            if (handle401(response)) return;
-            const data = await response.json();
-            thumbnailStrip.innerHTML = '';
-            data.forEach(item => {
-                const img = document.createElement('img');
+            const sprite = await fetchThumbnailSprite();
+            if (sprite === undefined) return;
+            let data = sprite ? sprite.thumbnails : null;
+            if (!data) {
+                const response = await fetch(`${BASE}/api/recent_thumbnails?limit=7`);
+                if (handle401(response)) return;
+                data = await response.json();
+            }
+            renderThumbnails(sprite, data);
+        } catch (error) {
+            console.error('Error fetching thumbnails:', error);
+        }
+    }
+
+    // Thumbnail strip from recent_thumbnails items, as sprite tiles when `sprite` is set
+    function renderThumbnails(sprite, data) {
+        thumbnailStrip.innerHTML = '';
+        data.forEach((item, index) => {
+            let img;
+            if (sprite) {
+                img = spriteTile(sprite, item, index);
+            } else {
+                img = document.createElement('img');
                 img.className = 'thumbnail';
                 img.src = `${BASE}/api/browse_image/${item.image_id}`;
                 img.alt = item.plate_text || 'Detección';
                 img.width = 120;
                 img.height = 80;
-                img.dataset.eventId = item.event_id;
-                img.addEventListener('click', () => openModalForEvent(item.event_id));
-                thumbnailStrip.appendChild(img);
-            });
-            // "Ver Todas" button
-            viewAllBtn = document.createElement('button');
-            viewAllBtn.className = 'thumbnail view-all-btn';
-            viewAllBtn.textContent = 'Ver Todas';
-            viewAllBtn.addEventListener('click', openBrowseCarousel);
-            thumbnailStrip.appendChild(viewAllBtn);
-            updateViewAllBtn();
-        } catch (error) {
-            console.error('Error fetching thumbnails:', error);
-        }
+            }
+            img.dataset.eventId = item.event_id;
+            img.addEventListener('click', () => openModalForEvent(item.event_id));
+            thumbnailStrip.appendChild(img);
+        });
+        // "Ver Todas" button
+        viewAllBtn = document.createElement('button');
+        viewAllBtn.className = 'thumbnail view-all-btn';
+        viewAllBtn.textContent = 'Ver Todas';
+        viewAllBtn.addEventListener('click', openBrowseCarousel);
+        thumbnailStrip.appendChild(viewAllBtn);
+        updateViewAllBtn();
     }
 
     async function fetchAndInitDropdowns() {
@@ -506,30 +552,33 @@ document.addEventListener('DOMContentLoaded', () => {
                 console.warn('filter_options returned', response.status, '— dropdowns will be empty');
                 return;
             }
-            const options = await response.json();
-            dropdownBrand.populate(options.brands || []);
-            dropdownColor.populate(options.colors || []);
-            dropdownType.populate(options.types  || []);
-            // Restore selection from URL — intersect with available options to drop stale values
-            const brandSet  = new Set(options.brands || []);
-            const colorSet  = new Set(options.colors || []);
-            const typeSet   = new Set(options.types  || []);
-            const validBrand = currentBrandFilter.filter(v => brandSet.has(v));
-            const validColor = currentColorFilter.filter(v => colorSet.has(v));
-            const validType  = currentTypeFilter.filter(v => typeSet.has(v));
-            if (validBrand.length) dropdownBrand.setSelected(validBrand);
-            if (validColor.length) dropdownColor.setSelected(validColor);
-            if (validType.length)  dropdownType.setSelected(validType);
-            // Re-sync state vars in case stale URL values were dropped during validation
-            currentBrandFilter = dropdownBrand.getSelected();
-            currentColorFilter = dropdownColor.getSelected();
-            currentTypeFilter  = dropdownType.getSelected();
-            updateViewAllBtn();
+            initDropdowns(await response.json());
         } catch (e) {
             console.error('Error loading filter options:', e);
         }
     }
 
+    function initDropdowns(options) {
+        dropdownBrand.populate(options.brands || []);
+        dropdownColor.populate(options.colors || []);
+        dropdownType.populate(options.types  || []);
+        // Restore selection from URL — intersect with available options to drop stale values
+        const brandSet  = new Set(options.brands || []);
+        const colorSet  = new Set(options.colors || []);
+        const typeSet   = new Set(options.types  || []);
+        const validBrand = currentBrandFilter.filter(v => brandSet.has(v));
+        const validColor = currentColorFilter.filter(v => colorSet.has(v));
+        const validType  = currentTypeFilter.filter(v => typeSet.has(v));
+        if (validBrand.length) dropdownBrand.setSelected(validBrand);
+        if (validColor.length) dropdownColor.setSelected(validColor);
+        if (validType.length)  dropdownType.setSelected(validType);
+        // Re-sync state vars in case stale URL values were dropped during validation
+        currentBrandFilter = dropdownBrand.getSelected();
+        currentColorFilter = dropdownColor.getSelected();
+        currentTypeFilter  = dropdownType.getSelected();
+        updateViewAllBtn();
+    }
+
     // --- Filter event listeners ---
     // Text/number inputs: debounced on input, immediate on Enter
     filterPatent.addEventListener('input', debouncedFetch);
@@ -632,12 +681,51 @@ document.addEventListener('DOMContentLoaded', () => {
     let carouselImages = [];
     let carouselIndex = 0;
 
+    // event_id -> [{image_id, image_type}], filled in batches by /api/event_images.
+    // A small LRU (Map keeps insertion order): each table page prefetches its events
+    const eventImagesCache = new Map();
+    const EVENT_IMAGES_BATCH = 50;
+    const EVENT_IMAGES_CACHE_MAX = 300;
+
+    function getCachedEventImages(eventId) {
+        const images = eventImagesCache.get(eventId);
+        if (images !== undefined) {
+            eventImagesCache.delete(eventId);
+            eventImagesCache.set(eventId, images);
+        }
+        return images;
+    }
+
+    function cacheEventImages(eventId, images) {
+        eventImagesCache.delete(eventId);
+        eventImagesCache.set(eventId, images);
+        while (eventImagesCache.size > EVENT_IMAGES_CACHE_MAX) {
+            eventImagesCache.delete(eventImagesCache.keys().next().value);
+        }
+    }
+
+    async function fetchEventImages(eventIds) {
+        const missing = [...new Set(eventIds)].filter(id => id && !eventImagesCache.has(id));
+        for (let i = 0; i < missing.length; i += EVENT_IMAGES_BATCH) {
+            const batch = missing.slice(i, i + EVENT_IMAGES_BATCH);
+            const response = await fetch(`${BASE}/api/event_images?event_ids=${encodeURIComponent(batch.join(','))}`);
+            if (handle401(response)) return;
+            if (!response.ok) throw new Error(`HTTP ${response.status}`);
+            const data = await response.json();
+            Object.entries(data.events || {}).forEach(([eventId, images]) => {
+                // Don't cache empty results: images may still be arriving for a fresh event
+                if (images.length > 0) cacheEventImages(eventId, images);
+            });
+        }
+    }
+
     // --- Browse mode state ---
     let browseItems = [];
     let browseIndex = 0;
     let browseTotalCount = 0;
     let browseTypes = ['vehicle_picture'];
     let browseAbort = null;
+    let browseNextCursor = null; // signed token from /api/browse_window, null at the end
     const browseFilters = document.getElementById('browse-filters');
 
     function showModalError(msg) {
@@ -660,12 +748,30 @@ document.addEventListener('DOMContentLoaded', () => {
         if (carouselImages.length === 0) return;
         carouselIndex = ((index % carouselImages.length) + carouselImages.length) % carouselImages.length;
         const img = carouselImages[carouselIndex];
-        modalImage.src = `data:image/jpeg;base64,${img.image_data}`;
+
+        modalImage.onload = function () {
+            hideSpinner();
+            modalImage.style.display = 'block';
+        };
+        modalImage.onerror = function () {
+            hideSpinner();
+            showModalError('Error al cargar la imagen.');
+        };
+        modalSpinner.hidden = false;
+        modalImage.style.display = 'none';
+        modalImage.src = BASE + '/api/browse_image/' + img.image_id;
+
         carouselCounter.textContent = `${carouselIndex + 1} / ${carouselImages.length}`;
         carouselCaption.textContent = img.image_type || '';
         const showNav = carouselImages.length > 1;
         carouselPrev.style.display = showNav ? '' : 'none';
         carouselNext.style.display = showNav ? '' : 'none';
+
+        // Preload only the next slide: /api/browse_image is rate limited per client
+        if (showNav) {
+            const pre = new Image();
+            pre.src = BASE + '/api/browse_image/' + carouselImages[(carouselIndex + 1) % carouselImages.length].image_id;
+        }
     }
 
     carouselPrev.addEventListener('click', () => {
@@ -697,14 +803,12 @@ document.addEventListener('DOMContentLoaded', () => {
         showSpinner();
         imageModal.style.display = 'flex';
         try {
-            const response = await fetch(`${BASE}/api/image/${eventId}`);
-            if (handle401(response)) return;
-            if (!response.ok) throw new Error(`HTTP ${response.status}`);
-            const data = await response.json();
+            if (!eventImagesCache.has(eventId)) await fetchEventImages([eventId]);
+            const images = getCachedEventImages(eventId) || [];
             hideSpinner();
-            if (data && data.images && data.images.length > 0) {
+            if (images.length > 0) {
                 hideModalError();
-                carouselImages = data.images;
+                carouselImages = images;
                 showSlide(0);
             } else {
                 carouselImages = [];
@@ -737,6 +841,7 @@ document.addEventListener('DOMContentLoaded', () => {
         browseItems = [];
         browseIndex = 0;
         browseTotalCount = 0;
+        browseNextCursor = null;
         if (browseAbort) { browseAbort.abort(); browseAbort = null; }
         browseFilters.hidden = true;
         // Shared cleanup
@@ -765,23 +870,10 @@ document.addEventListener('DOMContentLoaded', () => {
     });
 
     // --- Browse mode functions ---
-    async function browseLoadPage(direction) {
-        if (browseAbort) browseAbort.abort();
-        browseAbort = new AbortController();
+    const BROWSE_WINDOW = 10;
 
-        const cursor = direction === 'forward'
-            ? browseItems[browseItems.length - 1]
-            : browseItems[0];
-
-        const params = new URLSearchParams({
-            limit: '5',
-            direction: direction,
-            types: browseTypes.join(',')
-        });
-        if (cursor) {
-            params.set('cursor_ts', cursor.created_at);
-            params.set('cursor_id', cursor.image_id);
-        }
+    function browseParams() {
+        const params = new URLSearchParams({ limit: String(BROWSE_WINDOW), types: browseTypes.join(',') });
         // Inherit active table filters
         if (currentStartDateFilter) params.set('start_date', currentStartDateFilter);
         if (currentEndDateFilter) params.set('end_date', currentEndDateFilter);
@@ -789,13 +881,29 @@ document.addEventListener('DOMContentLoaded', () => {
         if (currentBrandFilter.length)  params.set('brand_filter',        currentBrandFilter.join(','));
         if (currentColorFilter.length)  params.set('color_filter',        currentColorFilter.join(','));
         if (currentTypeFilter.length)   params.set('vehicle_type_filter', currentTypeFilter.join(','));
+        return params;
+    }
+
+    // Loads the first window, or the next one when browseItems is not empty.
+    // The response carries the cursor of the following window, so reaching
+    // the end costs no extra request.
+    async function browseLoadPage() {
+        if (browseAbort) browseAbort.abort();
+        browseAbort = new AbortController();
+
+        const params = browseParams();
+        if (browseItems.length) {
+            if (!browseNextCursor) return 0;
+            params.set('cursor', browseNextCursor);
+        }
 
         try {
-            const resp = await fetch(`${BASE}/api/browse_images?` + params, { signal: browseAbort.signal });
+            const resp = await fetch(`${BASE}/api/browse_window?` + params, { signal: browseAbort.signal });
             if (handle401(resp)) return 0;
             const data = await resp.json();
-            if (direction === 'forward') browseItems.push(...data.images);
-            else browseItems.unshift(...data.images);
+            if (!resp.ok) throw new Error(data.error || resp.status);
+            browseItems.push(...data.images);
+            browseNextCursor = data.next_cursor;
             if (data.total_count !== undefined) browseTotalCount = data.total_count;
             return data.images.length;
         } catch (e) {
@@ -870,30 +978,9 @@ document.addEventListener('DOMContentLoaded', () => {
     }
 
     async function browsePrefetch() {
-        if (prefetchInFlight) return;
+        if (prefetchInFlight || !browseNextCursor) return;
         prefetchInFlight = true;
-        const cursor = browseItems[browseItems.length - 1];
-        if (!cursor) { prefetchInFlight = false; return; }
-
-        const params = new URLSearchParams({
-            limit: '5', direction: 'forward', types: browseTypes.join(','),
-            cursor_ts: cursor.created_at, cursor_id: cursor.image_id
-        });
-        if (currentStartDateFilter) params.set('start_date', currentStartDateFilter);
-        if (currentEndDateFilter) params.set('end_date', currentEndDateFilter);
-        if (currentPatentFilter) params.set('search_term', currentPatentFilter);
-        if (currentBrandFilter.length)  params.set('brand_filter',        currentBrandFilter.join(','));
-        if (currentColorFilter.length)  params.set('color_filter',        currentColorFilter.join(','));
-        if (currentTypeFilter.length)   params.set('vehicle_type_filter', currentTypeFilter.join(','));
-
-        try {
-            const resp = await fetch(`${BASE}/api/browse_images?` + params);
-            if (handle401(resp)) return;
-            const data = await resp.json();
-            browseItems.push(...data.images);
-        } catch (e) {
-            console.error('Prefetch error:', e);
-        }
+        await browseLoadPage();
         prefetchInFlight = false;
     }
 
@@ -903,6 +990,7 @@ document.addEventListener('DOMContentLoaded', () => {
         browseItems = [];
         browseIndex = 0;
         browseTotalCount = 0;
+        browseNextCursor = null;
 
         // Sync checkboxes with browseTypes
         browseFilters.querySelectorAll('input[type="checkbox"]').forEach(cb => {
@@ -913,7 +1001,7 @@ document.addEventListener('DOMContentLoaded', () => {
         showSpinner();
         imageModal.style.display = 'flex';
 
-        const loaded = await browseLoadPage('forward');
+        const loaded = await browseLoadPage();
         hideSpinner();
         if (loaded > 0) {
             browseShowSlide(0);
@@ -938,9 +1026,10 @@ document.addEventListener('DOMContentLoaded', () => {
         browseItems = [];
         browseIndex = 0;
         browseTotalCount = 0;
+        browseNextCursor = null;
 
         showSpinner();
-        const loaded = await browseLoadPage('forward');
+        const loaded = await browseLoadPage();
         hideSpinner();
         if (loaded > 0) {
             browseShowSlide(0);
@@ -950,9 +1039,34 @@ document.addEventListener('DOMContentLoaded', () => {
     });
 
     // --- Initial loads ---
-    // Data first so the table is usable immediately; thumbnails load after.
-    fetchPatentsTableData();
-    fetchStats();
-    Promise.resolve().then(fetchLatestThumbnails);
-    Promise.resolve().then(fetchAndInitDropdowns);
+    // One /api/dashboard request queries table, stats, thumbnails and dropdown
+    // options concurrently; a section it could not load falls back to its own endpoint.
+    async function loadDashboard() {
+        // A filter or page change meanwhile aborts this like any table request
+        if (tableAbort) tableAbort.abort();
+        tableAbort = new AbortController();
+        const signal = tableAbort.signal;
+        const statsRequest = statsAbort;
+        let data = {};
+        patentTableBody.innerHTML = '<tr><td colspan="8">Cargando patentes\u2026</td></tr>';
+        pushFiltersToURL();
+        try {
+            const response = await fetch(`${BASE}/api/dashboard?${patentsQuery()}&thumbnails=7`, { signal });
+            if (handle401(response)) return;
+            if (response.ok) data = await response.json();
+        } catch (error) {
+            if (error.name !== 'AbortError') console.error('Error fetching dashboard:', error);
+        }
+        // Don't overwrite a table or stats fetched for newer filters
+        if (!signal.aborted) {
+            if (data.patents) renderPatentsPage(data.patents); else fetchPatentsTableData();
+        }
+        if (statsAbort === statsRequest) {
+            if (data.stats) renderStats(data.stats); else fetchStats();
+        }
+        if (data.thumbnails) renderThumbnails(data.sprite, data.thumbnails); else fetchLatestThumbnails();
+        if (data.filter_options) initDropdowns(data.filter_options); else fetchAndInitDropdowns();
+    }
+
+    loadDashboard();
 });
@@ -0,0 +1,33 @@
+import datetime
+import uuid
+from unittest import mock
+
+import snapshot
+
+
+def _row(plate_text, minute):
+    created_at = datetime.datetime(2024, 5, 1, 12, minute, tzinfo=datetime.timezone.utc)
+    return (plate_text, created_at, uuid.uuid4(), "Toyota", "Blanco", "Auto", 0.9)
+
+
+def _build(path, rows):
+    with mock.patch.object(snapshot.db_utils, "fetch_filter_options"), \
+            mock.patch.object(snapshot.db_utils, "connect_direct"), \
+            mock.patch.object(snapshot, "_fetch_rows", return_value=iter(rows)):
+        return snapshot.build(str(path), full=True)
+
+
+def test_build_keeps_rows_without_a_plate(tmp_path):
+    path = tmp_path / "plates.snap"
+    rows = [_row("AB 123 CD", 0), _row(None, 1), _row("--", 2), _row("AB123CE", 3)]
+
+    assert _build(path, rows) == (4, 4)
+
+    snap = snapshot.Snapshot(str(path))
+    try:
+        assert [r["plate_text"] for r in snap.between()] == ["AB123CD", None, None, "AB123CE"]
+        assert [r["plate_text"] for r in snap.search("ab123")] == ["AB123CE", "AB123CD"]
+        assert snap.search("--") == []
+        assert snap.search(None) == []
+    finally:
+        snap.close()
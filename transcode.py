@@ -0,0 +1,256 @@
+"""
+AVIF / WebP variants of the stored camera images, negotiated on Accept.
+
+/api/browse_image used to send the stored JPEG to every client. When
+TRANSCODE_DIR is set, a client whose Accept header lists image/avif or
+image/webp explicitly (every current browser does for <img>) gets the first
+of TRANSCODE_FORMATS it accepts instead, usually 30-60% smaller. Others, and
+any image the encoder cannot make smaller, get the stored bytes with their
+real Content-Type (sniffed, no longer always image/jpeg).
+
+Quality depends on what the image shows: plate crops keep more detail so the
+characters stay legible, full vehicle frames are compressed harder. The
+presets below can be overridden with TRANSCODE_QUALITY_<TYPE>_<FORMAT>, e.g.
+TRANSCODE_QUALITY_PLATE_AVIF=75.
+
+Camera images never change, so a variant is encoded once, on the first
+request for it, and kept under TRANSCODE_DIR as <id>.q<quality>.<format>
+(write-then-rename, shared by all workers and served with sendfile()). The
+directory is bounded by TRANSCODE_MAX_BYTES: when a worker's running total
+passes it, the least recently served variants are deleted down to 90%.
+
+Encoding needs the optional Pillow package with WebP/AVIF support; formats it
+lacks are skipped.
+"""
+import io
+import logging
+import os
+import tempfile
+import threading
+import time
+
+try:
+    from PIL import Image, features
+except ImportError:  # Pillow is optional: without it the stored bytes are served as-is
+    Image = None
+
+logger = logging.getLogger(__name__)
+
+TRANSCODE_DIR = os.environ.get("TRANSCODE_DIR", "")
+TRANSCODE_FORMATS = [f.strip() for f in os.environ.get("TRANSCODE_FORMATS", "avif,webp").lower().split(",")
+                     if f.strip()]
+TRANSCODE_MAX_BYTES = int(os.environ.get("TRANSCODE_MAX_BYTES", str(1024 * 1024 * 1024)))
+# AVIF encoder effort, 0 (slowest, smallest) to 10: variants are encoded inline
+# on the first request, so favour speed
+TRANSCODE_AVIF_SPEED = int(os.environ.get("TRANSCODE_AVIF_SPEED", "8"))
+
+MIMETYPES = {"avif": "image/avif", "webp": "image/webp"}
+_PIL_FORMATS = {"avif": "AVIF", "webp": "WEBP"}
+
+# Quality per (image_type, format). Plate crops are small and their text must
+# stay readable; vehicle frames tolerate stronger compression.
+_QUALITY_PRESETS = {
+    ("plate", "webp"): 88,
+    ("plate", "avif"): 70,
+    ("vehicle_picture", "webp"): 72,
+    ("vehicle_picture", "avif"): 50,
+    ("vehicle_detection", "webp"): 72,
+    ("vehicle_detection", "avif"): 50,
+}
+QUALITY = {
+    (image_type, fmt): int(os.environ.get(f"TRANSCODE_QUALITY_{image_type.upper()}_{fmt.upper()}", q))
+    for (image_type, fmt), q in _QUALITY_PRESETS.items()
+}
+_DEFAULT_QUALITY = {"webp": 75, "avif": 55}
+
+# Touch a served variant's mtime (its last-use time for eviction) at most this often
+_TOUCH_SECONDS = 3600
+# Variant file content meaning "not smaller than the original: serve that"
+_NOT_SMALLER = b""
+
+
+def sniff_mimetype(head):
+    """Content-Type of image bytes from their first 12 bytes (image/jpeg when unknown)."""
+    if head[:8] == b"\x89PNG\r\n\x1a\n":
+        return "image/png"
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "image/webp"
+    if head[4:12] in (b"ftypavif", b"ftypavis"):
+        return "image/avif"
+    if head[:6] in (b"GIF87a", b"GIF89a"):
+        return "image/gif"
+    return "image/jpeg"
+
+
+def _supported():
+    if Image is None or not TRANSCODE_DIR:
+        return []
+    return [f for f in TRANSCODE_FORMATS if f in _PIL_FORMATS and features.check(f)]
+
+
+FORMATS = _supported()
+
+
+def negotiate(accept_mimetypes):
+    """The first of FORMATS the client lists explicitly in Accept, or None for the original."""
+    # Only explicit entries count: */* would also "accept" AVIF from clients that cannot decode it
+    accepted = {value.lower() for value, q in accept_mimetypes if q > 0}
+    for fmt in FORMATS:
+        if MIMETYPES[fmt] in accepted:
+            return fmt
+    return None
+
+
+def quality(image_type, fmt):
+    return QUALITY.get((image_type, fmt), _DEFAULT_QUALITY[fmt])
+
+
+class VariantStore:
+    """Transcoded variants on disk under `root`, bounded by `max_bytes` in total."""
+
+    def __init__(self, root, max_bytes):
+        self.root = os.path.abspath(root)
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        # Per-key locks so concurrent first requests encode a variant once per worker
+        self._encoding = {}
+        self._bytes = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _file(self, image_id, fmt, q):
+        return os.path.join(self.root, image_id[:2], f"{image_id}.q{q}.{fmt}")
+
+    def get(self, image_id, image_type, fmt, load_original):
+        """
+        Path of the `fmt` variant of image `image_id`, encoding it from
+        load_original() (the stored bytes) on first use. None when the original
+        should be served: the variant would not be smaller or cannot be made.
+        """
+        q = quality(image_type, fmt)
+        path = self._file(image_id, fmt, q)
+        found = self._lookup(path)
+        if found is not None:
+            self.hits += 1
+            return found or None
+        with self._lock:
+            key_lock = self._encoding.setdefault(path, threading.Lock())
+        try:
+            with key_lock:
+                found = self._lookup(path)
+                if found is not None:
+                    self.hits += 1
+                    return found or None
+                self.misses += 1
+                return self._encode(path, load_original(), fmt, q)
+        finally:
+            with self._lock:
+                self._encoding.pop(path, None)
+
+    def _lookup(self, path):
+        """path if the variant exists, "" if it is a not-smaller marker, None if missing."""
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        if st.st_size and time.time() - st.st_mtime > _TOUCH_SECONDS:
+            try:
+                os.utime(path)
+            except OSError:
+                pass
+        return path if st.st_size else ""
+
+    def _encode(self, path, original, fmt, q):
+        if not original:
+            return None
+        try:
+            with Image.open(io.BytesIO(original)) as img:
+                img = img.convert("RGB")
+                out = io.BytesIO()
+                options = {"quality": q}
+                if fmt == "avif":
+                    options["speed"] = TRANSCODE_AVIF_SPEED
+                else:
+                    options["method"] = 4
+                img.save(out, _PIL_FORMATS[fmt], **options)
+        except (OSError, ValueError, Image.DecompressionBombError) as e:
+            logger.warning("Could not transcode %s to %s: %s", os.path.basename(path), fmt, e)
+            return None
+        data = out.getvalue()
+        smaller = len(data) < len(original)
+        stored = self._write(path, data if smaller else _NOT_SMALLER)
+        return path if stored and smaller else None
+
+    def _write(self, path, data):
+        """Store a variant file. False if it could not be written."""
+        directory = os.path.dirname(path)
+        try:
+            os.makedirs(directory, exist_ok=True)
+            fd, tmp = tempfile.mkstemp(dir=directory, prefix=".tmp-")
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    f.write(data)
+                os.replace(tmp, path)
+            except BaseException:
+                os.unlink(tmp)
+                raise
+        except OSError as e:
+            logger.warning("Could not store transcoded image %s: %s", path, e)
+            return False
+        with self._lock:
+            if self._bytes is None:
+                self._bytes = self._scan_size()
+            self._bytes += len(data)
+            over = self._bytes > self.max_bytes
+        if over:
+            self._prune()
+        return True
+
+    def _scan(self):
+        """(mtime, size, path) of every stored variant."""
+        entries = []
+        for directory, _dirs, files in os.walk(self.root):
+            for name in files:
+                if name.startswith(".tmp-"):
+                    continue
+                path = os.path.join(directory, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, path))
+        return entries
+
+    def _scan_size(self):
+        return sum(size for _mtime, size, _path in self._scan())
+
+    def _prune(self):
+        """Delete the least recently served variants until the store is at 90% of max_bytes."""
+        entries = sorted(self._scan())
+        total = sum(size for _mtime, size, _path in entries)
+        target = self.max_bytes * 0.9
+        for _mtime, size, path in entries:
+            if total <= target:
+                break
+            if not size:
+                continue  # not-smaller markers cost no space and save an encode
+            try:
+                os.unlink(path)
+            except OSError:
+                continue
+            total -= size
+            self.evictions += 1
+        with self._lock:
+            self._bytes = total
+
+    def metrics(self):
+        return {
+            "formats": FORMATS,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+
+store = VariantStore(TRANSCODE_DIR, TRANSCODE_MAX_BYTES) if FORMATS else None
@@ -0,0 +1,61 @@
+"""
+Warm a worker before it accepts traffic, so deploys and scale-ups don't start cold.
+
+gunicorn.conf.py calls warm() twice:
+
+  - in the master (when_ready, with preload_app): templates are compiled, the
+    analytics cache (ANALYTICS_CACHE) loaded and the page-load caches filled
+    once, then the master's DB pools are closed. Forked workers inherit all of
+    it copy-on-write.
+  - in each worker (post_worker_init), before its first request: pool
+    connections are exercised and any cache the master did not fill, or that
+    has expired since, is loaded.
+
+Every step is best effort: a failure is logged and the worker starts anyway.
+WARMUP=false skips it.
+"""
+import logging
+import os
+import time
+
+import analytics
+import db_utils
+from db_utils import DBError
+
+logger = logging.getLogger(__name__)
+
+WARMUP = os.environ.get("WARMUP", "true").lower() in {"true", "1", "yes", "on"}
+
+# What the index page requests on load (static/script.js)
+_RECENT_THUMBNAILS_LIMIT = 7
+
+
+def _compile_templates(app):
+    for name in app.jinja_env.list_templates():
+        app.jinja_env.get_template(name)
+
+
+def _prime_caches():
+    db_utils.fetch_filter_options()
+    db_utils.fetch_stats()
+    db_utils.fetch_recent_thumbnails(limit=_RECENT_THUMBNAILS_LIMIT)
+
+
+def warm(app, pool=True):
+    """Compile templates, warm the DB pools (unless pool=False) and prime the caches."""
+    if not WARMUP:
+        return
+    started = time.monotonic()
+    steps = [("templates", lambda: _compile_templates(app)), ("analytics", analytics.start),
+             ("caches", _prime_caches)]
+    if pool:
+        steps.insert(0, ("pool", db_utils.warm_pool))
+    done = []
+    for name, step in steps:
+        try:
+            step()
+            done.append(name)
+        except (DBError, RuntimeError, OSError) as e:
+            logger.warning("Warmup step %s failed: %s", name, e)
+    logger.info("Warmup (%s) finished in %.0f ms", ", ".join(done) or "nothing",
+                (time.monotonic() - started) * 1000)
@@ -0,0 +1,431 @@
+"""
+Watchlist (hotlist) matching of new detections.
+
+Plates on the watchlist (watchlist_plates, migrations/005) are held in an
+in-memory WatchlistIndex and every new detection_events row is matched against
+it:
+
+  - exact: same normalized plate (db_utils.normalize_plate).
+  - ocr:   equal once characters the OCR confuses (O/0, I/1, B/8, ...) are folded.
+  - near:  one insertion, deletion or substitution away after folding.
+
+Near matches use a deletion-neighbourhood index: every folded plate is also
+stored under each string obtained by deleting one of its characters, so a
+lookup is a handful of dict probes (one per character of the query) plus an
+exact check of the few candidates, independent of the watchlist size.
+
+The consumer reads detections in (created_at, id) order from a watermark kept
+in watchlist_consumers, a batch per transaction, and records hits in
+watchlist_hits. The index is refreshed incrementally from
+watchlist_plates.updated_at between batches. Run it next to the web app
+(the Procfile "watchlist" entry):
+
+    python watchlist.py --batch 500 --poll 2
+
+A consumer that has never run starts at the newest detection; pass --since to
+match older rows.
+"""
+import argparse
+import datetime
+import logging
+import os
+import time
+
+import psycopg2
+import psycopg2.extras
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+import db_utils
+from db_utils import DBError
+
+logger = logging.getLogger(__name__)
+
+# Rows younger than this are left for the next batch, so rows committed slightly
+# out of created_at order are not skipped by the watermark
+WATCHLIST_LAG_SECONDS = float(os.environ.get("WATCHLIST_LAG_SECONDS", "2"))
+# Incremental refreshes re-read this much history to catch late commits; a full
+# reload every WATCHLIST_RELOAD_SECONDS covers anything else
+_REFRESH_OVERLAP = datetime.timedelta(seconds=60)
+WATCHLIST_RELOAD_SECONDS = float(os.environ.get("WATCHLIST_RELOAD_SECONDS", "600"))
+
+_MAX_IMPORT = 10000
+_NIL_UUID = "00000000-0000-0000-0000-000000000000"
+_MISSING = object()
+
+_OCR_FOLD = str.maketrans({
+    "O": "0", "Q": "0", "D": "0",
+    "I": "1", "L": "1",
+    "Z": "2",
+    "S": "5",
+    "G": "6",
+    "B": "8",
+})
+
+
+def ocr_fold(plate_key):
+    """`plate_key` with OCR-confusable letters replaced by the digit they resemble."""
+    return plate_key.translate(_OCR_FOLD)
+
+
+def _deletions(s):
+    return {s[:i] + s[i + 1:] for i in range(len(s))}
+
+
+def _within_one_edit(a, b):
+    """True if a and b differ by at most one insertion, deletion or substitution."""
+    if len(a) > len(b):
+        a, b = b, a
+    if len(b) - len(a) > 1:
+        return False
+    i = 0
+    while i < len(a) and a[i] == b[i]:
+        i += 1
+    if len(a) == len(b):
+        return a[i + 1:] == b[i + 1:]
+    return a[i:] == b[i + 1:]
+
+
+class WatchlistIndex:
+    """Exact, OCR-folded and edit-distance-1 lookup of normalized plates."""
+
+    def __init__(self):
+        self._labels = {}    # plate_key -> label
+        self._folded = {}    # folded key -> {plate_key}
+        self._deletes = {}   # folded key minus one character -> {folded key}
+
+    def __len__(self):
+        return len(self._labels)
+
+    def __contains__(self, plate_key):
+        return plate_key in self._labels
+
+    def add(self, plate_key, label=None):
+        self._labels[plate_key] = label
+        folded = ocr_fold(plate_key)
+        keys = self._folded.setdefault(folded, set())
+        if not keys:
+            for d in _deletions(folded):
+                self._deletes.setdefault(d, set()).add(folded)
+        keys.add(plate_key)
+
+    def remove(self, plate_key):
+        if self._labels.pop(plate_key, _MISSING) is _MISSING:
+            return
+        folded = ocr_fold(plate_key)
+        keys = self._folded[folded]
+        keys.discard(plate_key)
+        if keys:
+            return
+        del self._folded[folded]
+        for d in _deletions(folded):
+            bucket = self._deletes[d]
+            bucket.discard(folded)
+            if not bucket:
+                del self._deletes[d]
+
+    def match(self, plate_text):
+        """
+        Watchlist entries matching a plate as read by a camera, best match first:
+        a list of (plate_key, match_kind, distance, label).
+        """
+        key = db_utils.normalize_plate(plate_text)
+        if not key:
+            return []
+        folded = ocr_fold(key)
+        hits = {}
+        if key in self._labels:
+            hits[key] = ("exact", 0)
+        for k in self._folded.get(folded, ()):
+            hits.setdefault(k, ("ocr", 0))
+
+        # Entries one character longer, shorter, or with one character replaced
+        candidates = set(self._deletes.get(folded, ()))
+        for d in _deletions(folded):
+            if d in self._folded:
+                candidates.add(d)
+            candidates.update(self._deletes.get(d, ()))
+        candidates.discard(folded)
+        for f in candidates:
+            if _within_one_edit(folded, f):
+                for k in self._folded[f]:
+                    hits.setdefault(k, ("near", 1))
+
+        return sorted(
+            ((k, kind, distance, self._labels[k]) for k, (kind, distance) in hits.items()),
+            key=lambda hit: (hit[2], hit[1] != "exact", hit[0]),
+        )
+
+
+# ---------------------------------------------------------------------------
+# Watchlist management and hits (web side, pooled connections)
+# ---------------------------------------------------------------------------
+
+def add_plates(entries):
+    """
+    Add or reactivate watchlist entries: an iterable of (plate text, label).
+    Returns the normalized keys stored. Raises ValueError, DBError.
+    """
+    rows = {}
+    for plate, label in entries:
+        key = db_utils.normalize_plate(plate)
+        if not key:
+            raise ValueError(f"Invalid plate {plate!r}")
+        rows[key] = label
+    if not rows:
+        return []
+    if len(rows) > _MAX_IMPORT:
+        raise ValueError(f"At most {_MAX_IMPORT} plates per request")
+    conn = None
+    try:
+        conn = db_utils._get_conn()
+        cur = conn.cursor()
+        psycopg2.extras.execute_values(
+            cur,
+            """
+            INSERT INTO watchlist_plates (plate_key, label) VALUES %s
+            ON CONFLICT (plate_key) DO UPDATE
+                SET label = EXCLUDED.label, active = true, updated_at = now()
+            """,
+            list(rows.items()),
+        )
+        conn.commit()
+        cur.close()
+        return list(rows)
+    except psycopg2.Error as e:
+        logger.error("Error adding watchlist plates: %s", e)
+        raise DBError("Database operation failed") from e
+    finally:
+        if conn:
+            db_utils._put_conn(conn)
+
+
+def remove_plate(plate_key):
+    """Deactivate a watchlist entry. Returns False if it was not active."""
+    conn = None
+    try:
+        conn = db_utils._get_conn()
+        cur = conn.cursor()
+        cur.execute(
+            "UPDATE watchlist_plates SET active = false, updated_at = now() "
+            "WHERE plate_key = %s AND active",
+            (plate_key,),
+        )
+        removed = cur.rowcount > 0
+        conn.commit()
+        cur.close()
+        return removed
+    except psycopg2.Error as e:
+        logger.error("Error removing watchlist plate: %s", e)
+        raise DBError("Database operation failed") from e
+    finally:
+        if conn:
+            db_utils._put_conn(conn)
+
+
+def list_plates(limit=100, offset=0):
+    """Active watchlist entries in plate order."""
+    conn = None
+    try:
+        conn = db_utils._get_conn(readonly=True)
+        cur = conn.cursor()
+        cur.execute(
+            "SELECT plate_key AS plate, label, created_at, updated_at FROM watchlist_plates "
+            "WHERE active ORDER BY plate_key LIMIT %s OFFSET %s",
+            (limit, offset),
+        )
+        records = db_utils._fetch_records(cur)
+        cur.close()
+        return records
+    except psycopg2.Error as e:
+        logger.error("Error listing watchlist plates: %s", e)
+        raise DBError("Database operation failed") from e
+    finally:
+        if conn:
+            db_utils._put_conn(conn)
+
+
+def fetch_hits(since_id=None, plate_key=None, limit=100):
+    """
+    Watchlist hits. With since_id, the hits recorded after it in ascending id
+    order (for polling); otherwise the most recent first.
+    """
+    conn = None
+    try:
+        conn = db_utils._get_conn(readonly=True)
+        cur = conn.cursor()
+        conditions, params = [], []
+        if since_id is not None:
+            conditions.append("id > %s")
+            params.append(since_id)
+        if plate_key:
+            conditions.append("plate_key = %s")
+            params.append(plate_key)
+        where = " WHERE " + " AND ".join(conditions) if conditions else ""
+        order = "ASC" if since_id is not None else "DESC"
+        cur.execute(
+            "SELECT id, event_id, plate_key AS plate, plate_text, match_kind, distance, label, "
+            f"seen_at, matched_at FROM watchlist_hits{where} ORDER BY id {order} LIMIT %s",
+            params + [limit],
+        )
+        records = db_utils._fetch_records(cur)
+        cur.close()
+        return records
+    except psycopg2.Error as e:
+        logger.error("Error fetching watchlist hits: %s", e)
+        raise DBError("Database operation failed") from e
+    finally:
+        if conn:
+            db_utils._put_conn(conn)
+
+
+# ---------------------------------------------------------------------------
+# Consumer
+# ---------------------------------------------------------------------------
+
+class WatchlistMatcher:
+    """Keeps a WatchlistIndex current and matches detections past the watermark."""
+
+    def __init__(self, conn, name="default"):
+        self.conn = conn
+        self.name = name
+        self.index = WatchlistIndex()
+        self._refreshed_to = None
+        self._reloaded_at = 0.0
+
+    def refresh(self):
+        """Apply watchlist changes since the last refresh (everything on the first call)."""
+        if time.monotonic() - self._reloaded_at > WATCHLIST_RELOAD_SECONDS:
+            self.index = WatchlistIndex()
+            self._refreshed_to = None
+            self._reloaded_at = time.monotonic()
+        cur = self.conn.cursor()
+        try:
+            if self._refreshed_to is None:
+                cur.execute("SELECT plate_key, label, active, updated_at FROM watchlist_plates")
+            else:
+                cur.execute(
+                    "SELECT plate_key, label, active, updated_at FROM watchlist_plates "
+                    "WHERE updated_at > %s ORDER BY updated_at",
+                    (self._refreshed_to - _REFRESH_OVERLAP,),
+                )
+            for plate_key, label, active, updated_at in cur.fetchall():
+                if active:
+                    self.index.add(plate_key, label)
+                else:
+                    self.index.remove(plate_key)
+                if self._refreshed_to is None or updated_at > self._refreshed_to:
+                    self._refreshed_to = updated_at
+            self.conn.commit()
+        except BaseException:
+            # An aborted transaction would fail every later statement on this connection
+            self.conn.rollback()
+            raise
+        finally:
+            cur.close()
+
+    def _watermark(self, cur, since):
+        cur.execute(
+            "SELECT last_seen_at, last_event_id FROM watchlist_consumers WHERE name = %s FOR UPDATE",
+            (self.name,),
+        )
+        row = cur.fetchone()
+        if row is not None and since is None:
+            return row
+        if since is None:
+            cur.execute("SELECT COALESCE(MAX(created_at), now()) FROM detection_events")
+            since = cur.fetchone()[0]
+        cur.execute(
+            """
+            INSERT INTO watchlist_consumers (name, last_seen_at, last_event_id) VALUES (%s, %s, %s)
+            ON CONFLICT (name) DO UPDATE SET last_seen_at = EXCLUDED.last_seen_at,
+                last_event_id = EXCLUDED.last_event_id, updated_at = now()
+            """,
+            (self.name, since, _NIL_UUID),
+        )
+        return since, _NIL_UUID
+
+    def run_batch(self, batch_size=500, since=None):
+        """
+        Match the next batch of detections and advance the watermark in the same
+        transaction. Returns (detections matched, hits, seconds spent matching).
+        """
+        cur = self.conn.cursor()
+        try:
+            last_seen_at, last_event_id = self._watermark(cur, since)
+            cur.execute(
+                """
+                SELECT id, camera_plate_text, created_at FROM detection_events
+                WHERE (created_at, id) > (%s, %s) AND created_at >= %s
+                  AND created_at <= now() - make_interval(secs => %s)
+                ORDER BY created_at, id
+                LIMIT %s
+                """,
+                (last_seen_at, last_event_id, last_seen_at, WATCHLIST_LAG_SECONDS, batch_size),
+            )
+            rows = cur.fetchall()
+            hits = []
+            started = time.perf_counter()
+            for event_id, plate_text, created_at in rows:
+                for plate_key, kind, distance, label in self.index.match(plate_text):
+                    hits.append((event_id, plate_key, plate_text, kind, distance, label, created_at))
+            elapsed = time.perf_counter() - started
+            if hits:
+                psycopg2.extras.execute_values(
+                    cur,
+                    "INSERT INTO watchlist_hits (event_id, plate_key, plate_text, match_kind, "
+                    "distance, label, seen_at) VALUES %s ON CONFLICT (event_id, plate_key) DO NOTHING",
+                    hits,
+                )
+            if rows:
+                cur.execute(
+                    "UPDATE watchlist_consumers SET last_seen_at = %s, last_event_id = %s, "
+                    "updated_at = now() WHERE name = %s",
+                    (rows[-1][2], rows[-1][0], self.name),
+                )
+            self.conn.commit()
+            return len(rows), len(hits), elapsed
+        except BaseException:
+            self.conn.rollback()
+            raise
+        finally:
+            cur.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Match new detections against the watchlist.")
+    parser.add_argument("--name", default="default", help="consumer name (one watermark per name)")
+    parser.add_argument("--batch", type=int, default=500, help="detections per transaction")
+    parser.add_argument("--poll", type=float, default=2.0, help="idle poll interval in seconds")
+    parser.add_argument("--since", type=datetime.datetime.fromisoformat,
+                        help="restart the watermark at this ISO timestamp")
+    parser.add_argument("--once", action="store_true", help="exit when caught up")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    matcher = WatchlistMatcher(db_utils.connect_direct(), args.name)
+    since = args.since
+    while True:
+        try:
+            matcher.refresh()
+            rows, hits, elapsed = matcher.run_batch(args.batch, since=since)
+        except psycopg2.Error as e:
+            logger.error("Watchlist batch failed: %s", e)
+            if matcher.conn.closed:
+                matcher.conn = db_utils.connect_direct()
+            time.sleep(args.poll)
+            continue
+        since = None
+        if rows:
+            logger.info("Matched %d detections against %d plates: %d hits, %.1f us/detection",
+                        rows, len(matcher.index), hits, elapsed / rows * 1e6)
+        if rows < args.batch:
+            if args.once:
+                break
+            time.sleep(args.poll)
+
+
+if __name__ == "__main__":
+    main()